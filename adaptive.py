@@ -0,0 +1,84 @@
+import freedv
+
+# approximate net bit rates of the forward modes, used to rank them
+MODE_BITRATES = {
+    freedv.MODE_DATAC1: 980,
+    freedv.MODE_DATAC3: 321,
+    freedv.MODE_DATAC4: 87,
+}
+
+
+class ModeSelector:
+    """
+
+    Picks the fastest FreeDV data mode that still decodes. After each transmission the sender reports
+    the fraction of frames the receiver missed (from its first NACK), plus the bit error rate and sync
+    of the reverse link, which shares the same channel. Poor results step down to a slower, more robust
+    mode, and a run of clean transmissions steps back up.
+
+    """
+
+    loss_down_threshold = 0.25
+    loss_up_threshold = 0.02
+    ber_down_threshold = 0.05
+    ber_up_threshold = 0.005
+    clean_transfers_to_step_up = 2
+
+    # weight of the newest result in the per mode loss average
+    loss_smoothing = 0.5
+
+    def __init__(self, modes=(freedv.MODE_DATAC1, freedv.MODE_DATAC3, freedv.MODE_DATAC4), start_mode=None):
+        # fastest first
+        self.modes = sorted(modes, key=lambda mode: MODE_BITRATES[mode], reverse=True)
+        self.index = 0 if start_mode is None else self.modes.index(start_mode)
+        self.loss = {mode: None for mode in self.modes}
+        self.clean_transfers = 0
+
+    @property
+    def mode(self):
+        return self.modes[self.index]
+
+    def expected_goodput(self, mode):
+        loss = self.loss[mode] or 0.0
+        return MODE_BITRATES[mode] * (1 - loss)
+
+    def update(self, frame_loss, ber=None, sync_ok=True):
+        """
+        frame_loss: fraction of frames missed in the first round, 1.0 if nothing was heard back
+        ber: bit error rate measured on the reverse link, if any bits were received
+        sync_ok: whether the reverse link reached sync
+        """
+        mode = self.mode
+        old_loss = self.loss[mode]
+
+        if old_loss is None:
+            self.loss[mode] = frame_loss
+        else:
+            self.loss[mode] = self.loss_smoothing * frame_loss + (1 - self.loss_smoothing) * old_loss
+
+        poor = frame_loss > self.loss_down_threshold or not sync_ok or \
+            (ber is not None and ber > self.ber_down_threshold)
+        clean = frame_loss <= self.loss_up_threshold and sync_ok and \
+            (ber is None or ber <= self.ber_up_threshold)
+
+        if poor:
+            self.clean_transfers = 0
+
+            # only step down if the slower mode is expected to do better
+            if self.index + 1 < len(self.modes):
+                slower = self.modes[self.index + 1]
+
+                if self.expected_goodput(slower) > self.expected_goodput(mode) or self.loss[slower] is None:
+                    self.index += 1
+
+        elif clean:
+            self.clean_transfers += 1
+
+            if self.clean_transfers >= self.clean_transfers_to_step_up and self.index > 0:
+                self.index -= 1
+                self.clean_transfers = 0
+
+        else:
+            self.clean_transfers = 0
+
+        return self.mode
@@ -0,0 +1,268 @@
+import numpy as np
+import freedv
+import threading
+import time
+
+# value pyaudio uses for paContinue, so callbacks don't need pyaudio imported
+CONTINUE = 0
+
+
+def list_audio_devices():
+    import pyaudio
+
+    p = pyaudio.PyAudio()
+    input_devices = {}
+    output_devices = {}
+
+    for i in range(p.get_device_count()):
+        device = p.get_device_info_by_index(i)
+
+        if device['maxInputChannels'] == 0 and device['hostApi'] == 0:
+            output_devices[str(i)] = device['name']
+
+        elif device['maxOutputChannels'] == 0 and device['hostApi'] == 0:
+            input_devices[str(i)] = device['name']
+
+    p.terminate()
+    return input_devices, output_devices
+
+
+def read_level(buffer):
+    # RMS of the samples waiting in an audio_buffer relative to full scale, None if there are none. Empties it
+    num_samples = buffer.nbuffer
+
+    if num_samples == 0:
+        return None
+
+    samples = buffer.get(num_samples).astype(np.float32)
+    buffer.pop(num_samples)
+
+    return float(np.sqrt(np.mean(samples * samples))) / 32768
+
+
+class AudioBackend:
+    """
+
+    Base class for the audio I/O that drives a Modem. A backend calls callback(in_data, frame_count,
+    time_info, status) once per block of frames_per_buffer mono int16 samples, with the same signature
+    and return value as a PyAudio stream callback.
+
+    """
+
+    def start(self, callback, sample_rate, frames_per_buffer):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def clock(self):
+        # time source for the modem's timeouts
+        return time.time()
+
+
+class PyAudioBackend(AudioBackend):
+    def __init__(self, in_device, out_device):
+        self.in_device = in_device
+        self.out_device = out_device
+        self.p = None
+        self.pastream = None
+
+    def start(self, callback, sample_rate, frames_per_buffer):
+        import pyaudio
+
+        self.p = pyaudio.PyAudio()
+        self.pastream = self.p.open(rate=sample_rate, channels=1, format=pyaudio.paInt16,
+                                    frames_per_buffer=frames_per_buffer,
+                                    input=True, output=True,
+                                    input_device_index=self.in_device, output_device_index=self.out_device,
+                                    stream_callback=callback)
+
+    def close(self):
+        if self.pastream is not None:
+            self.pastream.close()
+            self.p.terminate()
+
+
+class SharedRingBackend(AudioBackend):
+    """
+
+    Audio that another process captures and plays, handed over through a pair of rings (e.g.
+    modemprocess.SharedRing): capture_ring is filled with received samples, playback_ring is drained
+    into the output. The callback runs on a thread here, once per frames_per_buffer captured samples,
+    so it is paced by the real sound card's clock.
+
+    """
+
+    poll_time = 0.002
+
+    def __init__(self, capture_ring, playback_ring):
+        self.capture_ring = capture_ring
+        self.playback_ring = playback_ring
+        self.running = False
+        self.thread = None
+
+    def start(self, callback, sample_rate, frames_per_buffer):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=(callback, frames_per_buffer), daemon=True)
+        self.thread.start()
+
+    def run(self, callback, frames_per_buffer):
+        in_samples = np.zeros(frames_per_buffer, dtype=np.int16)
+
+        while self.running:
+            if self.capture_ring.nbuffer < frames_per_buffer:
+                time.sleep(self.poll_time)
+                continue
+
+            out_data, _ = callback(self.capture_ring.get(frames_per_buffer, out=in_samples), frames_per_buffer,
+                                   None, 0)
+            self.capture_ring.pop(frames_per_buffer)
+
+            out_samples = np.frombuffer(out_data, dtype=np.int16)
+
+            # the output side plays at the same rate, so it only fills up if that process stalls
+            if self.playback_ring.free() >= len(out_samples):
+                self.playback_ring.push(out_samples)
+
+    def close(self):
+        self.running = False
+
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+
+class LoopbackBackend(AudioBackend):
+    # one end of a LoopbackLink
+    def __init__(self, link, delay_samples):
+        self.link = link
+        self.callback = None
+
+        # delay line, prefilled with silence
+        self.input_buffer = freedv.audio_buffer(delay_samples + link.sample_rate * 10)
+        self.input_buffer.push(np.zeros(delay_samples, dtype=np.int16))
+
+        # zero samples take_input had to make up
+        self.underrun_samples = 0
+
+    def start(self, callback, sample_rate, frames_per_buffer):
+        assert sample_rate == self.link.sample_rate
+        assert frames_per_buffer == self.link.frames_per_buffer
+
+        self.callback = callback
+        self.link.endpoint_started()
+
+    def close(self):
+        self.link.stop()
+
+    def clock(self):
+        return self.link.time()
+
+    def take_input(self, frame_count):
+        # the next frame_count samples of the delay line. Dropped samples (a positive clock_ppm) use up the
+        # delay; once it is gone the block is padded with zeros, which are counted in underrun_samples
+        samples = np.zeros(frame_count, dtype=np.int16)
+        num_samples = min(frame_count, self.input_buffer.nbuffer)
+        samples[:num_samples] = self.input_buffer.get(num_samples)
+        self.input_buffer.pop(num_samples)
+        self.underrun_samples += frame_count - num_samples
+
+        return samples
+
+
+class LoopbackLink:
+    """
+
+    Connects two modems in one process, without any audio hardware. Whatever one end transmits is
+    received by the other after delay seconds, scaled by gain, with optional white noise and a sample
+    clock offset in parts per million (simulating mismatched sound card clocks).
+
+    Both ends run on a virtual clock that advances with the samples exchanged, and speed sets how many
+    times faster than real time the link runs. Runs aren't deterministic: the modems' worker threads
+    still race the link thread, so where a frame lands against a timeout depends on scheduling. Keep
+    speed low enough for every demodulator to keep up, a modem that falls behind counts rx_overruns.
+
+    Usage:
+        link = LoopbackLink(delay=0.1)
+        a = ArqModem(None, None, 'A', backend=link.a)
+        b = ArqModem(None, None, 'B', backend=link.b)
+
+    """
+
+    def __init__(self, delay=0.0, gain=1.0, noise=0.0, clock_ppm=0.0, speed=10.0, seed=0,
+                 sample_rate=8000, frames_per_buffer=256):
+        self.gain = gain
+        self.noise = noise
+        self.clock_ppm = clock_ppm
+        self.speed = speed
+        self.sample_rate = sample_rate
+        self.frames_per_buffer = frames_per_buffer
+
+        self.rng = np.random.default_rng(seed)
+        self.clock_error = 0.0
+        self.samples = 0
+
+        delay_samples = int(delay * sample_rate)
+        self.a = LoopbackBackend(self, delay_samples)
+        self.b = LoopbackBackend(self, delay_samples)
+
+        self.started = 0
+        self.running = False
+        self.thread = None
+
+    def time(self):
+        return self.samples / self.sample_rate
+
+    def endpoint_started(self):
+        self.started += 1
+
+        # run once both modems are listening
+        if self.started == 2:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def channel(self, samples):
+        samples = np.frombuffer(samples, dtype=np.int16).astype(np.float32) * self.gain
+
+        if self.noise:
+            samples += self.rng.normal(0, self.noise, len(samples)).astype(np.float32)
+
+        samples = np.clip(samples, -32768, 32767).astype(np.int16)
+
+        # the receiving sound card's clock runs fast / slow: drop or repeat a sample when a whole one has drifted
+        self.clock_error += len(samples) * self.clock_ppm * 1e-6
+
+        if self.clock_error >= 1:
+            self.clock_error -= 1
+            samples = samples[:-1]
+        elif self.clock_error <= -1:
+            self.clock_error += 1
+            samples = np.append(samples, samples[-1])
+
+        return samples
+
+    def run(self):
+        frame_count = self.frames_per_buffer
+        block_time = frame_count / self.sample_rate
+        start_time = time.perf_counter()
+
+        while self.running:
+            out_a, _ = self.a.callback(self.a.take_input(frame_count), frame_count, None, 0)
+            out_b, _ = self.b.callback(self.b.take_input(frame_count), frame_count, None, 0)
+
+            self.b.input_buffer.push(self.channel(out_a))
+            self.a.input_buffer.push(self.channel(out_b))
+            self.samples += frame_count
+
+            if self.speed:
+                # pace the link, so the modems' worker threads keep up
+                ahead = self.time() / self.speed - (time.perf_counter() - start_time)
+
+                if ahead > 0:
+                    time.sleep(ahead)
@@ -0,0 +1,386 @@
+from ctypes import *
+import numpy as np
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import threading
+import time
+import sys
+import os
+import audio
+import freedv
+
+
+def time_calls(func, iterations):
+    start = time.perf_counter()
+
+    for _ in range(iterations):
+        func()
+
+    return (time.perf_counter() - start) / iterations
+
+
+def bench_ctypes_overhead(mode=freedv.MODE_DATAC1, iterations=2000):
+    """
+    Per-call cost of FreeDVData.rx, comparing the old path (tobytes copy and a fresh
+    create_string_buffer on every call) with the preallocated, pointer passing path.
+    """
+    modem = freedv.FreeDVData(mode)
+    samples = np.zeros(modem.get_n_max_modem_samples(), dtype=np.int16)
+
+    def legacy_rx():
+        bytes_out = create_string_buffer(modem.bytes_per_modem_frame)
+        demod_in = samples[:modem.nin].tobytes()
+        nbytes_out = modem.c_lib.freedv_rawdatarx(modem.freedv, cast(bytes_out, POINTER(c_ubyte)),
+                                                  cast(demod_in, POINTER(c_short)))
+        modem.nin = modem.get_freedv_rx_nin()
+        modem.get_rx_status()
+        return bytes_out[:nbytes_out]
+
+    def current_rx():
+        return modem.rx(samples[:modem.nin])
+
+    results = {
+        'legacy_rx_call_s': time_calls(legacy_rx, iterations),
+        'rx_call_s': time_calls(current_rx, iterations),
+    }
+
+    modem.close()
+    return results
+
+
+def make_test_image(size=500, seed=0):
+    # smooth gradients with a bit of noise, so the encoder has something realistic to chew on
+    rng = np.random.default_rng(seed)
+    x, y = np.meshgrid(np.linspace(0, 255, size), np.linspace(0, 255, size))
+    image = np.stack([x, y, (x + y) / 2], axis=-1)
+    image += rng.normal(0, 8, image.shape)
+
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def bench_image_encode(levels=(4, 6, 8, 10), repeats=3):
+    import imagecodecs
+
+    image = make_test_image()
+    results = {}
+
+    for level in levels:
+        encode_time = time_calls(lambda: imagecodecs.avif_encode(image, level=level), repeats)
+        results[f'avif_level_{level}'] = {
+            'encode_s': encode_time,
+            'bytes': len(imagecodecs.avif_encode(image, level=level)),
+        }
+
+    return results
+
+
+def bench_modulation(mode=freedv.MODE_DATAC1, num_frames=20):
+    modem = freedv.FreeDVData(mode)
+    data = np.random.default_rng(0).integers(0, 256, num_frames * modem.payload_bytes_per_modem_frame,
+                                             dtype=np.uint8).tobytes()
+
+    start = time.perf_counter()
+    samples = modem.tx_data(data)
+    run_time = time.perf_counter() - start
+
+    modem.close()
+    return {'samples': len(samples), 'run_time_s': run_time, 'samples_per_second': len(samples) / run_time}, samples
+
+
+def bench_demodulation(samples, mode=freedv.MODE_DATAC1):
+    modem = freedv.FreeDVData(mode)
+    offset = 0
+    frames = 0
+
+    start = time.perf_counter()
+
+    while offset + modem.nin <= len(samples):
+        nin = modem.nin
+        status, rx_bytes = modem.rx(samples[offset:offset + nin])
+        offset += nin
+
+        if rx_bytes:
+            frames += 1
+
+    run_time = time.perf_counter() - start
+
+    modem.close()
+    return {'samples': offset, 'frames_decoded': frames, 'run_time_s': run_time,
+            'samples_per_second': offset / run_time}
+
+
+def bench_audio_buffer(block_size=256, fill_levels=(0, 0.5, 0.95), iterations=20000):
+    # push / pop cost must not depend on how full the buffer is
+    results = {}
+    block = np.zeros(block_size, dtype=np.int16)
+
+    for fill in fill_levels:
+        buffer = freedv.audio_buffer(block_size * 5000)
+        buffer.push(np.zeros(int(buffer.size * fill), dtype=np.int16))
+
+        def push_pop():
+            buffer.push(block)
+            buffer.pop(block_size)
+
+        results[f'push_pop_fill_{fill}'] = time_calls(push_pop, iterations)
+
+    return results
+
+
+def bench_arq_goodput(image_bytes=20000, timeout=600, speed=2):
+    """
+    Send a payload between two ArqModems over a LoopbackLink and report goodput
+    in payload bytes per second of (virtual) airtime. speed must leave the demodulators
+    time to keep up, or frames are lost to rx overruns.
+    """
+    from modem import ArqModem
+
+    link = audio.LoopbackLink(delay=0.05, speed=speed)
+    sender = ArqModem(None, None, 'TX', backend=link.a)
+    receiver = ArqModem(None, None, 'RX', backend=link.b)
+
+    data = np.random.default_rng(0).integers(0, 256, image_bytes, dtype=np.uint8).tobytes()
+    tx_thread = threading.Thread(target=sender.arq_tx, args=(data,), daemon=True)
+    tx_thread.start()
+
+    start_time = link.time()
+    rx_data = None
+
+    while rx_data is None and link.time() - start_time < timeout:
+        receiver.arq_rx(timeout=0.1)
+        rx_data = receiver.get_rx_data()
+
+    airtime = link.time() - start_time
+
+    # the sender is still waiting for the ACK, keep the receiver running until it has it
+    while tx_thread.is_alive() and link.time() - start_time < timeout:
+        receiver.arq_rx(timeout=0.1)
+
+    sender.halt_tx()
+    tx_thread.join(sender.arq_wait_time)
+
+    sender.close()
+    receiver.close()
+
+    return {
+        'payload_bytes': image_bytes,
+        'received': rx_data is not None and bytes(rx_data[:image_bytes]) == data,
+        'airtime_s': airtime,
+        'goodput_bytes_per_s': image_bytes / airtime if rx_data is not None else 0.0,
+    }
+
+
+def bench_burst_airtime(num_frames=100, frames_per_burst=(1, 2, 4, 8, 16),
+                        modes=(freedv.MODE_DATAC1, freedv.MODE_DATAC3, freedv.MODE_DATAC4)):
+    # airtime for a num_frames transmission for each burst length, and what it saves over single frame bursts
+    results = {}
+
+    for mode in modes:
+        modem = freedv.FreeDVData(mode)
+        single_frame_airtime = num_frames * modem.get_burst_samples(1) / 8000
+        mode_results = {}
+
+        for burst_frames in [n for n in frames_per_burst if n <= num_frames]:
+            full_bursts, last_burst = divmod(num_frames, burst_frames)
+            samples = full_bursts * modem.get_burst_samples(burst_frames)
+
+            if last_burst:
+                samples += modem.get_burst_samples(last_burst)
+
+            airtime = samples / 8000
+            mode_results[burst_frames] = {
+                'airtime_s': airtime,
+                'saved_s': single_frame_airtime - airtime,
+                'saved_fraction': 1 - airtime / single_frame_airtime,
+            }
+
+        modem.close()
+        results[f'mode_{mode}'] = mode_results
+
+    return results
+
+
+# white noise levels that cost each mode a few percent of its frames on the loopback link
+TRANSFER_NOISE = {
+    freedv.MODE_DATAC1: 6500,
+    freedv.MODE_DATAC3: 11500,
+    freedv.MODE_DATAC4: 22500,
+}
+
+
+def bench_burst_transfer(num_frames=100, frames_per_burst=(1, 2, 4, 8, 16),
+                         modes=(freedv.MODE_DATAC1, freedv.MODE_DATAC3, freedv.MODE_DATAC4), noise=False, speed=2,
+                         timeout=3600):
+    """
+    A real num_frames transfer between two ArqModems over a LoopbackLink, for each mode and burst length:
+    (virtual) seconds until the sender has its ACK, NACK rounds and the padding of a short last burst
+    included. With noise, the link adds the mode's TRANSFER_NOISE.
+    """
+    from modem import ArqModem
+
+    results = {}
+
+    for mode in modes:
+        mode_results = {}
+
+        for burst_frames in frames_per_burst:
+            link = audio.LoopbackLink(delay=0.05, noise=TRANSFER_NOISE[mode] if noise else 0.0, speed=speed)
+            sender = ArqModem(None, None, 'TX', backend=link.a)
+            receiver = ArqModem(None, None, 'RX', backend=link.b)
+
+            # both ends have to agree on the burst length
+            sender.set_frames_per_burst(mode, burst_frames)
+            receiver.set_frames_per_burst(mode, burst_frames)
+            sender.adaptive_mode = False
+            sender.forward_mode = mode
+
+            # once the sender is done both modems demodulate every mode on one core, so the loopback runs behind
+            # and the ACK may be decoded after the usual wait. That is the benchmark's lag, not a lost ACK
+            sender.arq_wait_time = 60
+
+            num_bytes = ArqModem.get_payload_budget(num_frames, sender.bytes_per_frame[mode], sender.fec_group_size,
+                                                    sender.fec_parity_frames)
+            data = np.random.default_rng(0).integers(0, 256, num_bytes, dtype=np.uint8).tobytes()
+            tx_thread = threading.Thread(target=sender.arq_tx, args=(data,), daemon=True)
+            tx_thread.start()
+
+            rx_data = None
+
+            while tx_thread.is_alive() and link.time() < timeout:
+                receiver.arq_rx(timeout=0.1)
+                rx_data = receiver.get_rx_data() or rx_data
+
+            transfer_time = link.time()
+            sender.halt_tx()
+            tx_thread.join(sender.arq_wait_time)
+
+            received = rx_data is not None and bytes(rx_data[:num_bytes]) == data
+            mode_results[burst_frames] = {
+                'transfer_s': transfer_time,
+                'received': received,
+                'acked': bool(sender.arq_callsign),
+                'goodput_bytes_per_s': num_bytes / transfer_time if received else 0.0,
+                'frames_retransmitted': sender.metrics.counters.get('frames_retransmitted', 0),
+                'rx_overruns': sum(count for name, count in receiver.metrics.counters.items()
+                                   if name.startswith('rx_overruns')),
+            }
+
+            sender.close()
+            receiver.close()
+
+        results[f'mode_{mode}'] = mode_results
+
+    return results
+
+
+def startup_probe(stage):
+    """
+    Runs in a fresh interpreter for bench_startup, and prints the wall clock time once the stage is reached:
+    'window' is the main window shown, 'demod' is the first demodulator call on a newly opened modem.
+    """
+    if stage == 'window':
+        from PySide6.QtWidgets import QApplication
+        import freetv
+
+        app = QApplication([])
+        window = freetv.MainWindow()
+        window.show()
+        app.processEvents()
+
+    elif stage == 'demod':
+        from modem import Modem
+
+        # a second of silence waiting in the capture ring, so the first demod runs as soon as the modem is up
+        capture = freedv.audio_buffer(Modem.sample_rate)
+        capture.push(np.zeros(Modem.sample_rate, dtype=np.int16))
+        modem = Modem(None, None, backend=audio.SharedRingBackend(capture, freedv.audio_buffer(Modem.sample_rate)))
+
+        modem.wait_for_rx(10)
+        modem.rx_all()
+
+    print(json.dumps({'time': time.time()}))
+
+
+def bench_startup(repeats=3):
+    # time to window and time to first demod, from launching the interpreter. The best of repeats runs
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+    results = {}
+
+    for stage, name in (('window', 'time_to_window_s'), ('demod', 'time_to_first_demod_s')):
+        times = []
+
+        for _ in range(repeats):
+            start = time.time()
+            probe = subprocess.run([sys.executable, os.path.abspath(__file__), '--startup-probe', stage],
+                                   capture_output=True, text=True, env=env)
+
+            if probe.returncode != 0:
+                print(f'Startup probe {stage} failed: {probe.stderr.strip()}')
+                break
+
+            times.append(json.loads(probe.stdout.strip().splitlines()[-1])['time'] - start)
+
+        results[name] = min(times) if times else None
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_all(iterations):
+    results = {
+        'commit': git_commit(),
+        'date': datetime.datetime.now().isoformat(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+    }
+
+    results['ctypes_overhead'] = bench_ctypes_overhead(iterations=iterations)
+    results['image_encode'] = bench_image_encode()
+    results['modulation'], samples = bench_modulation()
+    results['demodulation'] = bench_demodulation(samples)
+    results['audio_buffer'] = bench_audio_buffer()
+    results['burst_airtime'] = bench_burst_airtime()
+    results['burst_transfer'] = bench_burst_transfer()
+    results['burst_transfer_noisy'] = bench_burst_transfer(noise=True)
+    results['arq_goodput'] = bench_arq_goodput()
+    results['startup'] = bench_startup()
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FreeTV benchmarks')
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--output', help='save results as json, to compare across commits')
+    parser.add_argument('--startup', action='store_true', help='only run the startup benchmark')
+    parser.add_argument('--burst-transfer', action='store_true',
+                        help='only run the burst length transfers, clean and noisy (about an hour)')
+    parser.add_argument('--startup-probe', choices=['window', 'demod'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup_probe:
+        startup_probe(args.startup_probe)
+        sys.exit()
+
+    if args.startup:
+        results = {'commit': git_commit(), 'startup': bench_startup()}
+    elif args.burst_transfer:
+        results = {'commit': git_commit(), 'burst_transfer': bench_burst_transfer(),
+                   'burst_transfer_noisy': bench_burst_transfer(noise=True)}
+    else:
+        results = run_all(args.iterations)
+
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,213 @@
+"""
+
+Several radios at once. Every channel is a complete, independent modem (its own FreeDVData instances,
+reassembly table and spool) in a worker process of its own, so total throughput scales with cores
+instead of sharing one GIL. A channel either opens its own audio devices, or is one channel of a
+multichannel interface: MultichannelAudio runs that interface's single stream here and splits it into
+per channel shared memory rings, which the channel's modem reads through audio.SharedRingBackend.
+
+"""
+import argparse
+import os
+import queue
+import threading
+import numpy as np
+import audio
+import modemprocess
+from modem import ArqModem
+
+
+class MultichannelAudio:
+    """
+
+    One interleaved int16 stream of num_channels channels. The capture is deinterleaved by viewing it as
+    a (frames, channels) array, so each channel is a strided column of the buffer PyAudio handed over,
+    written straight into that channel's ring. The output is interleaved the same way, into a
+    preallocated array.
+
+    """
+
+    ring_seconds = 2
+
+    def __init__(self, in_device, out_device, num_channels, sample_rate=ArqModem.sample_rate, frames_per_buffer=256):
+        self.in_device = in_device
+        self.out_device = out_device
+        self.num_channels = num_channels
+        self.sample_rate = sample_rate
+        self.frames_per_buffer = frames_per_buffer
+
+        ring_size = sample_rate * self.ring_seconds
+        self.capture_rings = [modemprocess.SharedRing(ring_size) for _ in range(num_channels)]
+        self.playback_rings = [modemprocess.SharedRing(ring_size) for _ in range(num_channels)]
+        self.out = np.zeros((frames_per_buffer, num_channels), dtype=np.int16)
+
+        # blocks a channel's modem didn't take in time, per channel
+        self.overruns = [0] * num_channels
+
+        self.p = None
+        self.pastream = None
+
+    def get_backend(self, channel):
+        # the AudioBackend for that channel's modem, it is handed to the worker process
+        return audio.SharedRingBackend(self.capture_rings[channel], self.playback_rings[channel])
+
+    def start(self):
+        import pyaudio
+
+        self.p = pyaudio.PyAudio()
+        self.pastream = self.p.open(rate=self.sample_rate, channels=self.num_channels, format=pyaudio.paInt16,
+                                    frames_per_buffer=self.frames_per_buffer,
+                                    input=True, output=True,
+                                    input_device_index=self.in_device, output_device_index=self.out_device,
+                                    stream_callback=self.pa_callback)
+
+    def pa_callback(self, in_data, frame_count, time_info, status):
+        capture = np.frombuffer(in_data, dtype=np.int16).reshape(frame_count, self.num_channels)
+
+        for channel, ring in enumerate(self.capture_rings):
+            if ring.free() >= frame_count:
+                ring.push(capture[:, channel])
+            else:
+                self.overruns[channel] += 1
+
+        if frame_count > len(self.out):
+            self.out = np.zeros((frame_count, self.num_channels), dtype=np.int16)
+
+        out = self.out[:frame_count]
+        out[:] = 0
+
+        for channel, ring in enumerate(self.playback_rings):
+            num_samples = min(ring.nbuffer, frame_count)
+            offset = 0
+
+            for view in ring.peek(num_samples):
+                out[offset:offset + len(view), channel] = view
+                offset += len(view)
+
+            ring.pop(num_samples)
+
+        return out, audio.CONTINUE
+
+    def close(self):
+        if self.pastream is not None:
+            self.pastream.close()
+            self.p.terminate()
+            self.pastream = None
+
+        for ring in self.capture_rings + self.playback_rings:
+            ring.close()
+
+
+class ChannelManager:
+    """
+
+    Runs one modem per channel and merges what they hear. Channels are numbered in the order they are
+    added; each one gets its own spool directory under spool_dir.
+
+    """
+
+    def __init__(self, callsign, spool_dir='spool'):
+        self.callsign = callsign
+        self.spool_dir = spool_dir
+        self.channels = []
+        self.interfaces = []
+
+        self.events_queue = queue.Queue()
+        self.event_threads = []
+
+    def __len__(self):
+        return len(self.channels)
+
+    def __getitem__(self, channel):
+        return self.channels[channel]
+
+    def add_channel(self, in_device=None, out_device=None, backend=None):
+        channel = len(self.channels)
+        modem_process = modemprocess.ModemProcess(self.callsign, in_device, out_device,
+                                                  os.path.join(self.spool_dir, f'ch{channel}'), backend)
+        self.channels.append(modem_process)
+
+        thread = threading.Thread(target=self.forward_events, args=(channel, modem_process), daemon=True)
+        thread.start()
+        self.event_threads.append(thread)
+
+        return channel
+
+    def add_device(self, in_device, out_device):
+        # a radio on its own sound card, opened by its worker process
+        return self.add_channel(in_device, out_device)
+
+    def add_multichannel(self, in_device, out_device, num_channels):
+        # a radio per channel of one multichannel interface, returns their channel numbers
+        interface = MultichannelAudio(in_device, out_device, num_channels)
+        channels = [self.add_channel(backend=interface.get_backend(i)) for i in range(num_channels)]
+
+        # the stream only starts once every worker is there to drain its ring
+        interface.start()
+        self.interfaces.append(interface)
+
+        return channels
+
+    def forward_events(self, channel, modem_process):
+        for header, payload in modem_process.events():
+            if header['type'] != 'keepalive':
+                self.events_queue.put((channel, header, payload))
+
+    def events(self, timeout=None):
+        # yields (channel, header, payload) for the events of every channel, in the order they came in
+        while True:
+            try:
+                yield self.events_queue.get(timeout=timeout)
+            except queue.Empty:
+                return
+
+    def submit(self, channel, payload):
+        return self.channels[channel].submit(payload)
+
+    def status(self):
+        return [modem_process.status() for modem_process in self.channels]
+
+    def close(self):
+        for modem_process in self.channels:
+            modem_process.close()
+
+        for interface in self.interfaces:
+            interface.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FreeTV multi-radio receiver: one modem per channel, '
+                                                 'received payloads are archived in each channel\'s spool')
+    parser.add_argument('--callsign', required=True)
+    parser.add_argument('--device', nargs=2, type=int, action='append', default=[], metavar=('IN', 'OUT'),
+                        help='a radio on its own sound card')
+    parser.add_argument('--multichannel', nargs=3, type=int, action='append', default=[],
+                        metavar=('IN', 'OUT', 'CHANNELS'), help='one radio per channel of a multichannel interface')
+    parser.add_argument('--spool', default='spool')
+    args = parser.parse_args()
+
+    manager = ChannelManager(args.callsign, args.spool)
+
+    for in_device, out_device in args.device:
+        manager.add_device(in_device, out_device)
+
+    for in_device, out_device, num_channels in args.multichannel:
+        manager.add_multichannel(in_device, out_device, num_channels)
+
+    print(f'Running {len(manager)} channels')
+    heard = {}
+
+    try:
+        for channel, header, payload in manager.events():
+            if header['type'] == 'rx':
+                print(f'Channel {channel}: received {len(payload)} bytes from {header["callsign"]}')
+
+            elif header['type'] == 'callsign' and heard.get(channel) != header['callsign']:
+                heard[channel] = header['callsign']
+                print(f'Channel {channel}: hearing {header["callsign"]}')
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        manager.close()
@@ -0,0 +1,537 @@
+"""
+
+Headless modem service. The daemon owns the ArqModem and serves a small HTTP API on localhost, so FreeTV
+can run as an unattended gateway, other software can submit payloads, and several clients (the Qt app
+among them) can share one radio.
+
+    GET  /status                 link status as JSON
+    GET  /metrics                modem metrics snapshot as JSON
+    GET  /frame_budget?seconds=  how many DATAC1 frames fit in that much airtime
+    GET  /rx/stream              event stream, see below
+    GET  /rx/archive             completed payloads kept in the spool
+    GET  /rx/archive/<name>      one archived payload
+    POST /tx                     queue the request body for transmission, 413 if it is too large to send
+    POST /retransmit             NACK the frames still missing from the current reception
+    POST /test_frame             send a test frame
+    POST /halt                   stop the current transmission
+    POST /volume?value=          TX volume, 0 to 100
+
+The event stream is a sequence of records, each a JSON header line followed by header['length'] bytes of
+payload. Types are 'rx' (a completed payload), 'partial' (the chunks of a reception that came in since the
+last one, see PartialReceptions), 'callsign' (when the station heard changes), 'transmitting', 'error' and
+'keepalive'.
+
+"""
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+import argparse
+import json
+import queue
+import threading
+import numpy as np
+import freedv
+import modem
+import spool
+from modem import ArqModem, list_audio_devices
+
+default_port = 8073
+
+
+class PartialReceptions:
+    """
+
+    Client side of the 'partial' events. Each one only carries the chunks that are new since the last
+    (header['chunks'] lists their indices, the payload is the chunks back to back), so the data of every
+    reception is put back together here. The max_sessions receptions heard last are kept.
+
+    """
+
+    max_sessions = 8
+
+    def __init__(self):
+        self.sessions = OrderedDict()
+
+    def update(self, header, payload):
+        # returns the data so far and is_available(start, end) for it, like ArqModem.get_rx_partial
+        session_id = header['session']
+        chunk_size = header['chunk_size']
+        num_chunks = header['num_chunks']
+        buffer, available = self.sessions.get(session_id, (None, None))
+
+        if buffer is None or buffer.shape != (num_chunks, chunk_size):
+            buffer = np.zeros((num_chunks, chunk_size), dtype=np.uint8)
+            available = np.zeros(num_chunks, dtype=bool)
+
+        self.sessions[session_id] = buffer, available
+        self.sessions.move_to_end(session_id)
+
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+
+        chunks = np.asarray(header['chunks'], dtype=np.int64)
+        buffer[chunks] = np.frombuffer(payload, dtype=np.uint8).reshape(len(chunks), chunk_size)
+        available[chunks] = True
+
+        data = memoryview(buffer.reshape(-1)).toreadonly()
+        offset = header['offset']
+        return data[offset:], modem.make_is_available(available, chunk_size, offset)
+
+    def forget(self, session_id):
+        self.sessions.pop(session_id, None)
+
+
+class ModemService:
+    """
+
+    The modem loop without any front end: payloads to send are queued, and everything the modem hears
+    is published as events to every subscriber. ModemDaemon serves it over HTTP, modemprocess runs it in
+    a process of its own.
+
+    """
+
+    rx_poll_time = 0.1
+    keepalive_time = 5.0
+    subscriber_queue_size = 64
+
+    def __init__(self, arq_modem):
+        self.modem = arq_modem
+        self.running = True
+
+        self.tx_queue = queue.Queue()
+        self.retransmit = False
+        self.test_frame = False
+        self.transmitting = False
+
+        self.subscribers = []
+        self.subscribers_lock = threading.Lock()
+        self.rx_frame_counts = {}
+        self.status = {}
+
+        # partial events only carry new chunks and callsign events only changes. A subscriber joining, or
+        # losing events, gets everything again with the next ones
+        self.partial_sent = {}
+        self.resend_partial = False
+        self.rx_callsign = None
+
+        # checked when a payload is submitted, so a client finds out right away
+        self.max_payload_bytes = arq_modem.get_max_payload()
+
+    def subscribe(self):
+        events = queue.Queue(self.subscriber_queue_size)
+
+        with self.subscribers_lock:
+            self.subscribers.append(events)
+
+        self.resend_partial = True
+        self.rx_callsign = None
+        return events
+
+    def unsubscribe(self, events):
+        with self.subscribers_lock:
+            if events in self.subscribers:
+                self.subscribers.remove(events)
+
+    def publish(self, header, payload=b''):
+        header['length'] = len(payload)
+
+        with self.subscribers_lock:
+            subscribers = list(self.subscribers)
+
+        for events in subscribers:
+            # a slow client loses its oldest events, it never holds up the modem
+            while True:
+                try:
+                    events.put_nowait((header, payload))
+                    break
+                except queue.Full:
+                    self.resend_partial = True
+
+                    try:
+                        events.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def set_transmitting(self, transmitting):
+        self.transmitting = transmitting
+        self.publish({'type': 'transmitting', 'transmitting': transmitting})
+
+    def submit(self, payload):
+        if len(payload) > self.max_payload_bytes:
+            raise freedv.DataTooLarge
+
+        self.tx_queue.put(payload)
+        return self.tx_queue.qsize()
+
+    def request_retransmit(self):
+        self.retransmit = True
+
+    def request_test_frame(self):
+        self.test_frame = True
+
+    def halt(self):
+        self.modem.halt_tx()
+
+    def set_volume(self, volume):
+        self.modem.set_tx_volume(volume)
+
+    def get_frame_budget(self, seconds):
+        return self.modem.get_frame_budget(seconds, freedv.MODE_DATAC1)
+
+    def run(self):
+        try:
+            while self.running:
+                self.step()
+        finally:
+            self.modem.close()
+
+    def step(self):
+        if self.test_frame:
+            self.set_transmitting(True)
+            self.modem.tx_test_frame()
+            self.test_frame = False
+            self.set_transmitting(False)
+
+        elif self.retransmit:
+            self.modem.tx_retransmit_request()
+            self.retransmit = False
+
+        elif not self.tx_queue.empty():
+            payload = self.tx_queue.get()
+            self.set_transmitting(True)
+
+            try:
+                self.modem.arq_tx(payload)
+            except freedv.DataTooLarge:
+                self.publish({'type': 'error', 'error': f'payload of {len(payload)} bytes is too large to send'})
+
+            self.set_transmitting(False)
+
+        else:
+            self.modem.arq_rx(timeout=self.rx_poll_time)
+            self.publish_partial()
+            rx_data = self.modem.get_rx_data()
+
+            callsign = self.modem.get_rx_callsign()
+
+            if callsign is not None and callsign != self.rx_callsign:
+                self.rx_callsign = callsign
+                self.publish({'type': 'callsign', 'callsign': callsign})
+
+            if rx_data is not None:
+                session = self.modem.rx_last_session
+                self.publish({'type': 'rx', 'session': session.session_id, 'callsign': callsign}, bytes(rx_data))
+
+        self.update_status()
+
+    def publish_partial(self):
+        session = self.modem.rx_current
+
+        for session_id in list(self.rx_frame_counts):
+            if self.modem.rx_table.get(session_id) is None:
+                del self.rx_frame_counts[session_id]
+                self.partial_sent.pop(session_id, None)
+
+        if self.resend_partial:
+            self.resend_partial = False
+            self.rx_frame_counts.clear()
+            self.partial_sent.clear()
+
+        # only when new frames came in
+        if session is None or session.received_count == self.rx_frame_counts.get(session.session_id):
+            return
+
+        self.rx_frame_counts[session.session_id] = session.received_count
+
+        if session.data is None:
+            return
+
+        available = session.get_data_available()
+
+        # nothing is sent before the first chunk, which holds the callsign and so where the data starts
+        if not available[0]:
+            return
+
+        sent = self.partial_sent.get(session.session_id)
+        chunks = np.flatnonzero(available if sent is None else available & ~sent)
+        self.partial_sent[session.session_id] = available
+
+        if len(chunks) == 0:
+            return
+
+        self.publish({
+            'type': 'partial',
+            'session': session.session_id,
+            'chunk_size': session.chunk_size,
+            'num_chunks': len(available),
+            'offset': 1 + int(session.data[0, 0]),
+            'chunks': chunks.tolist(),
+        }, session.data[chunks].tobytes())
+
+    def update_status(self):
+        # built on the modem thread and swapped in whole, so the HTTP threads never see it half done
+        last_rx_sync = self.modem.last_rx_sync
+
+        self.status = {
+            'callsign': self.modem.callsign,
+            'transmitting': self.transmitting,
+            'tx_queue': self.tx_queue.qsize(),
+            'forward_mode': self.modem.mode_selector.mode if self.modem.adaptive_mode else self.modem.forward_mode,
+            'last_rx_sync_age_s': None if last_rx_sync is None else self.modem.clock() - last_rx_sync,
+            'rx_sessions': [{
+                'session': session.session_id,
+                'callsign': None if session.callsign is None else session.callsign.decode(errors='replace'),
+                'received_frames': session.received_count,
+                'num_frames': session.num_frames,
+                'complete': session.complete,
+            } for session in self.modem.rx_table.sessions.values()],
+        }
+
+    def stop(self):
+        self.running = False
+
+
+class ModemDaemon(ModemService):
+    def __init__(self, arq_modem, host='127.0.0.1', port=default_port):
+        super().__init__(arq_modem)
+
+        self.server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+        self.server.daemon_threads = True
+        self.server.modem_daemon = self
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def run(self):
+        self.server_thread.start()
+        print(f'FreeTV daemon listening on http://{self.server.server_address[0]}:{self.server.server_address[1]}')
+
+        try:
+            super().run()
+        finally:
+            self.server.shutdown()
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, value, code=200):
+        body = json.dumps(value).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def get_number(self, query, name, default, convert):
+        # a query parameter, None after answering 400 if it isn't a number
+        try:
+            return convert(query.get(name, [default])[0])
+        except ValueError:
+            self.send_json({'error': f'{name} must be a number'}, 400)
+            return None
+
+    def do_GET(self):
+        daemon = self.server.modem_daemon
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path == '/status':
+            self.send_json(daemon.status)
+
+        elif url.path == '/metrics':
+            self.send_json(daemon.modem.metrics.snapshot())
+
+        elif url.path == '/frame_budget':
+            seconds = self.get_number(query, 'seconds', '0', float)
+
+            if seconds is not None:
+                self.send_json({'frames': daemon.get_frame_budget(seconds)})
+
+        elif url.path == '/rx/stream':
+            self.stream_events(daemon)
+
+        elif url.path == '/rx/archive':
+            rx_spool = daemon.modem.rx_table.spool
+            self.send_json([] if rx_spool is None else [dict(entry, name=name) for name, entry in rx_spool.completed()])
+
+        elif url.path.startswith('/rx/archive/'):
+            rx_spool = daemon.modem.rx_table.spool
+            name = url.path[len('/rx/archive/'):]
+
+            if rx_spool is None or name not in rx_spool.index or not rx_spool.index[name]['complete']:
+                self.send_json({'error': 'no such payload'}, 404)
+                return
+
+            payload = rx_spool.get_payload(name)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        daemon = self.server.modem_daemon
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if url.path == '/tx':
+            if not body:
+                self.send_json({'error': 'empty payload'}, 400)
+                return
+
+            try:
+                self.send_json({'queued': daemon.submit(body)})
+            except freedv.DataTooLarge:
+                self.send_json({'error': 'payload too large', 'max_bytes': daemon.max_payload_bytes}, 413)
+
+        elif url.path == '/retransmit':
+            daemon.request_retransmit()
+            self.send_json({'ok': True})
+
+        elif url.path == '/test_frame':
+            daemon.request_test_frame()
+            self.send_json({'ok': True})
+
+        elif url.path == '/halt':
+            daemon.halt()
+            self.send_json({'ok': True})
+
+        elif url.path == '/volume':
+            volume = self.get_number(query, 'value', '100', int)
+
+            if volume is None:
+                return
+
+            if not 0 <= volume <= 100:
+                self.send_json({'error': 'value must be 0 to 100'}, 400)
+                return
+
+            daemon.set_volume(volume)
+            self.send_json({'ok': True})
+
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def stream_events(self, daemon):
+        # no Content-Length: the stream runs until either side closes the connection
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.end_headers()
+
+        events = daemon.subscribe()
+
+        try:
+            while daemon.running:
+                try:
+                    header, payload = events.get(timeout=daemon.keepalive_time)
+                except queue.Empty:
+                    header, payload = {'type': 'keepalive', 'length': 0}, b''
+
+                self.wfile.write(json.dumps(header).encode() + b'\n')
+                self.wfile.write(payload)
+                self.wfile.flush()
+
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+        finally:
+            daemon.unsubscribe(events)
+
+
+class ModemClient:
+    """
+
+    Client side of the daemon API, plain urllib so it works from any Python program.
+
+    """
+
+    def __init__(self, url=f'http://127.0.0.1:{default_port}', timeout=10):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def request(self, path, data=None):
+        request = Request(self.url + path, data=data, method='GET' if data is None else 'POST')
+
+        with urlopen(request, timeout=self.timeout) as response:
+            return response.read()
+
+    def get_json(self, path):
+        return json.loads(self.request(path))
+
+    def post(self, path, data=b''):
+        return json.loads(self.request(path, data))
+
+    def status(self):
+        return self.get_json('/status')
+
+    def get_frame_budget(self, seconds):
+        return self.get_json(f'/frame_budget?seconds={seconds}')['frames']
+
+    def submit(self, payload):
+        try:
+            return self.post('/tx', bytes(payload))
+        except HTTPError as e:
+            if e.code == 413:
+                raise freedv.DataTooLarge from e
+
+            raise
+
+    def retransmit(self):
+        return self.post('/retransmit')
+
+    def test_frame(self):
+        return self.post('/test_frame')
+
+    def halt(self):
+        return self.post('/halt')
+
+    def set_volume(self, volume):
+        return self.post(f'/volume?value={volume}')
+
+    def get_audio_level(self):
+        # the daemon's audio isn't shared with its HTTP clients
+        return None
+
+    def close(self):
+        pass
+
+    def events(self):
+        # yields (header, payload) for every event, keepalives included, until the daemon goes away
+        with urlopen(self.url + '/rx/stream', timeout=self.timeout + ModemService.keepalive_time) as response:
+            while True:
+                line = response.readline()
+
+                if not line:
+                    return
+
+                header = json.loads(line)
+                yield header, response.read(header['length'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FreeTV headless modem daemon')
+    parser.add_argument('--callsign', required=True)
+    parser.add_argument('--in-device', type=int)
+    parser.add_argument('--out-device', type=int)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=default_port)
+    parser.add_argument('--spool', default='spool', help='directory for partial and completed receptions')
+    args = parser.parse_args()
+
+    in_devices, out_devices = list_audio_devices()
+    in_device = args.in_device if args.in_device is not None else int(next(iter(in_devices)))
+    out_device = args.out_device if args.out_device is not None else int(next(iter(out_devices)))
+
+    daemon = ModemDaemon(ArqModem(in_device, out_device, args.callsign, spool=spool.Spool(args.spool)),
+                         args.host, args.port)
+
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
@@ -0,0 +1,283 @@
+"""
+
+Image encoding off the GUI and modem threads. Encodes run in a worker process as soon as an image is
+picked, and finished payloads go into an LRU cache keyed by the image's hash and the encoder settings,
+so pressing Transmit, or sending the same image again, doesn't wait on the encoder.
+
+"""
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+import progressive
+
+# codec name: imagecodecs' name for it. Each one has <name>_encode, <name>_decode and <name>_check functions,
+# and quality runs 0 to 100 for all
+CODECS = {
+    'avif': 'AVIF',
+    'jpegxl': 'JPEGXL',
+    'webp': 'WEBP',
+}
+
+QUALITY_MIN = 0
+QUALITY_MAX = 100
+
+
+def get_codec(codec):
+    """
+    (availability flag, encode(image, quality), decode(data), check(data)) of a codec. imagecodecs takes a
+    while to import, so that waits until an image is actually encoded or decoded.
+    """
+    import imagecodecs
+
+    encode = getattr(imagecodecs, f'{codec}_encode')
+
+    return (getattr(imagecodecs, CODECS[codec]).available, lambda image, quality: encode(image, level=quality),
+            getattr(imagecodecs, f'{codec}_decode'), getattr(imagecodecs, f'{codec}_check'))
+
+
+def available_codecs(codecs=None):
+    return [codec for codec in (codecs or CODECS) if get_codec(codec)[0]]
+
+
+def decode_image(data):
+    # whatever codec the payload was encoded with, None if it doesn't decode
+    data = bytes(data)
+
+    for codec in available_codecs():
+        _, _, decode, check = get_codec(codec)
+
+        if check(data):
+            try:
+                return decode(data)
+            except RuntimeError:
+                return None
+
+    return None
+
+
+def encode_candidate(image, codec, quality):
+    # one point of the budget search, runs in a worker process. PSNR makes qualities comparable across codecs
+    import cv2
+
+    _, encode, decode, _ = get_codec(codec)
+    data = encode(image, quality)
+    decoded = decode(data)
+
+    return codec, quality, data, cv2.PSNR(image, decoded[:, :, :image.shape[2]])
+
+
+def encode_to_budget(image, max_bytes, pool, codecs=None, time_limit=20.0, steps=6):
+    """
+    Best encoding of image that fits in max_bytes, searched across codecs and quality levels on pool.
+    Each round tries steps qualities per codec at once, between the best quality known to fit and the
+    lowest known to be too big. Stops when the search converges or time_limit seconds have passed.
+    Returns (codec, quality, data, psnr), or None if nothing fits.
+    """
+    deadline = time.monotonic() + time_limit
+    bounds = {codec: [QUALITY_MIN - 1, QUALITY_MAX + 1] for codec in available_codecs(codecs)}
+    best = None
+
+    while True:
+        futures = []
+
+        for codec, (fits, too_big) in bounds.items():
+            qualities = {fits + (too_big - fits) * i // (steps + 1) for i in range(1, steps + 1)}
+
+            for quality in sorted(qualities - {fits, too_big}):
+                futures.append(pool.submit(encode_candidate, image, codec, quality))
+
+        if not futures:
+            break
+
+        done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+
+        for future in not_done:
+            future.cancel()
+
+        for future in done:
+            if future.exception() is not None:
+                continue
+
+            codec, quality, data, psnr = future.result()
+
+            if len(data) <= max_bytes:
+                bounds[codec][0] = max(bounds[codec][0], quality)
+
+                if best is None or psnr > best[3]:
+                    best = (codec, quality, data, psnr)
+            else:
+                bounds[codec][1] = min(bounds[codec][1], quality)
+
+        if not_done or time.monotonic() >= deadline:
+            break
+
+    return best
+
+
+def encode_image(image, progressive_tx=False, level=10):
+    # runs in the worker process, so it has to be a plain module level function
+    if progressive_tx:
+        return progressive.encode(image, level=level)
+
+    return get_codec('avif')[1](image, level)
+
+
+def image_key(image, settings):
+    digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+    digest.update(repr((image.shape, str(image.dtype))).encode())
+
+    return digest.hexdigest(), tuple(sorted(settings.items()))
+
+
+class EncodeCache:
+    # LRU of encoded payloads, limited by their total size in bytes
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+
+            if data is not None:
+                self.entries.move_to_end(key)
+
+            return data
+
+    def put(self, key, data):
+        with self.lock:
+            old = self.entries.pop(key, None)
+
+            if old is not None:
+                self.total_bytes -= len(old)
+
+            # something bigger than the whole cache is never kept
+            if len(data) > self.max_bytes:
+                return
+
+            self.entries[key] = data
+            self.total_bytes += len(data)
+
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class EncodePipeline:
+    """
+
+    Hands out futures for encoded images. A cached payload comes back as an already finished future,
+    an image that is still being encoded shares the running future, anything else is queued on the
+    worker process.
+
+    """
+
+    def __init__(self, max_workers=None, cache_bytes=32 * 1024 * 1024):
+        self.max_workers = max_workers
+        self.pool = None
+        self.search_pool = ThreadPoolExecutor(max_workers=1)
+        self.cache = EncodeCache(cache_bytes)
+        self.pending = {}
+        self.lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_pool(self):
+        # started on first use, so creating the pipeline costs nothing
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.max_workers)
+
+        return self.pool
+
+    def submit(self, image, **settings):
+        key = image_key(image, settings)
+        data = self.cache.get(key)
+
+        if data is not None:
+            self.hits += 1
+            future = Future()
+            future.set_result(data)
+            return future
+
+        with self.lock:
+            future = self.pending.get(key)
+
+            if future is None:
+                self.misses += 1
+                future = self.get_pool().submit(encode_image, image, **settings)
+                self.pending[key] = future
+                future.add_done_callback(lambda done: self.finished(key, done))
+
+            return future
+
+    def submit_budget(self, image, max_bytes, codecs=None, time_limit=20.0):
+        """
+        Like submit, but searches codecs and qualities for the best encoding that fits in max_bytes.
+        The search is driven from a thread, the encodes themselves run on the worker processes.
+        """
+        codecs = tuple(available_codecs(codecs))
+        settings = {'max_bytes': max_bytes, 'codecs': codecs, 'time_limit': time_limit}
+        key = image_key(image, settings)
+        data = self.cache.get(key)
+
+        if data is not None:
+            self.hits += 1
+            future = Future()
+            future.set_result(data)
+            return future
+
+        with self.lock:
+            future = self.pending.get(key)
+
+            if future is None:
+                self.misses += 1
+                future = self.search_pool.submit(self.search, image, max_bytes, codecs, time_limit)
+                self.pending[key] = future
+                future.add_done_callback(lambda done: self.finished(key, done))
+
+            return future
+
+    def search(self, image, max_bytes, codecs, time_limit):
+        start = time.monotonic()
+        best = encode_to_budget(image, max_bytes, self.get_pool(), codecs, time_limit)
+
+        if best is None:
+            raise ValueError(f'No encoding fits in {max_bytes} bytes')
+
+        codec, quality, data, psnr = best
+        print(f'Encoded {codec} quality {quality}: {len(data)} of {max_bytes} bytes, '
+              f'PSNR {psnr:.1f} dB, {time.monotonic() - start:.1f} s')
+
+        return data
+
+    def finished(self, key, future):
+        # cache first, so a submit in between finds the result in one place or the other
+        if not future.cancelled() and future.exception() is None:
+            self.cache.put(key, future.result())
+
+        with self.lock:
+            self.pending.pop(key, None)
+
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'cached': len(self.cache),
+            'cached_bytes': self.cache.total_bytes,
+            'pending': len(self.pending),
+        }
+
+    def close(self):
+        self.search_pool.shutdown(wait=False, cancel_futures=True)
+
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
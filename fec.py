@@ -0,0 +1,257 @@
+"""
+
+Cross-frame erasure coding. Frames are split into groups of group_size data frames, and each group
+gets parity frames from a systematic Reed-Solomon (Cauchy) code over GF(256), so any group_size of a
+group's frames rebuild it. All byte arithmetic is done on whole frames at once with numpy log tables.
+
+"""
+import numpy as np
+import math
+
+# GF(256) with the 0x11d polynomial. GF_EXP is doubled, so sums of two logs never need a modulo
+GF_EXP = np.zeros(512, dtype=np.uint8)
+GF_LOG = np.zeros(256, dtype=np.int32)
+
+_x = 1
+for _i in range(255):
+    GF_EXP[_i] = _x
+    GF_LOG[_x] = _i
+    _x <<= 1
+
+    if _x & 0x100:
+        _x ^= 0x11d
+
+GF_EXP[255:510] = GF_EXP[:255]
+
+
+def gf_inv(a):
+    return int(GF_EXP[255 - GF_LOG[a]])
+
+
+def gf_mul_rows(coefficients, rows):
+    """
+    Linear combination over GF(256): coefficients is (m, k), rows is (k, n) uint8.
+    Returns the (m, n) xor sum of coefficients[j, i] * rows[i].
+    """
+    coefficients = np.asarray(coefficients, dtype=np.uint8)
+    products = GF_EXP[GF_LOG[coefficients][:, :, None] + GF_LOG[rows][None, :, :]]
+
+    # log tables don't cover zero, anything times zero is zero
+    products[(coefficients == 0)[:, :, None] | (rows == 0)[None, :, :]] = 0
+
+    return np.bitwise_xor.reduce(products, axis=1)
+
+
+def cauchy_matrix(data_count, parity_count):
+    # element j, i is 1 / (x_j + y_i) with x_j = data_count + j and y_i = i, so every square submatrix is invertible
+    assert data_count + parity_count <= 256
+
+    matrix = np.zeros((parity_count, data_count), dtype=np.uint8)
+
+    for j in range(parity_count):
+        for i in range(data_count):
+            matrix[j, i] = gf_inv((data_count + j) ^ i)
+
+    return matrix
+
+
+def gf_invert_matrix(matrix):
+    # Gauss-Jordan elimination over GF(256), each step works on whole rows
+    size = len(matrix)
+    work = np.concatenate([matrix.astype(np.uint8), np.eye(size, dtype=np.uint8)], axis=1)
+
+    for col in range(size):
+        pivot = col + np.nonzero(work[col:, col])[0][0]
+        work[[col, pivot]] = work[[pivot, col]]
+
+        work[col] = gf_mul_rows([[gf_inv(work[col, col])]], work[col:col + 1])[0]
+
+        factors = work[:, col].copy()
+        factors[col] = 0
+        work ^= gf_mul_rows(factors[:, None], work[col:col + 1])
+
+    return work[:, size:]
+
+
+def group_parity(data_count, group_size, parity):
+    # a short last group gets proportionally fewer parity frames, but at least one
+    if parity == 0:
+        return 0
+
+    return max(1, math.ceil(data_count * parity / group_size))
+
+
+def group_layout(num_data, group_size, parity):
+    # list of (first frame id, data frames, parity frames) for each group, in transmission order
+    if parity == 0:
+        return [(0, num_data, 0)]
+
+    layout = []
+    frame_id = 0
+
+    for first_data in range(0, num_data, group_size):
+        data_count = min(group_size, num_data - first_data)
+        parity_count = group_parity(data_count, group_size, parity)
+        layout.append((frame_id, data_count, parity_count))
+        frame_id += data_count + parity_count
+
+    return layout
+
+
+def frame_slots(num_data, group_size, parity):
+    """
+    Where every frame goes in preallocated buffers, as arrays indexed by frame id: whether it is a parity
+    frame, its row in the data or the parity buffer, and its group. Also returns each group's data frame count.
+    """
+    is_parity = []
+    rows = []
+    groups = []
+    data_row = 0
+    parity_row = 0
+    layout = group_layout(num_data, group_size, parity)
+
+    for group, (_, data_count, parity_count) in enumerate(layout):
+        is_parity += [False] * data_count + [True] * parity_count
+        rows += list(range(data_row, data_row + data_count)) + list(range(parity_row, parity_row + parity_count))
+        groups += [group] * (data_count + parity_count)
+        data_row += data_count
+        parity_row += parity_count
+
+    return (np.array(is_parity, dtype=bool), np.array(rows, dtype=np.int64), np.array(groups, dtype=np.int64),
+            np.array([data_count for _, data_count, _ in layout], dtype=np.int64))
+
+
+def num_data_frames(num_frames, group_size, parity):
+    # invert group_layout: how many data frames a transmission of num_frames frames carries, None if no
+    # number of data frames adds up to exactly num_frames
+    if parity == 0:
+        return num_frames
+
+    # every full group has group_size + parity frames
+    full_groups, last_frames = divmod(num_frames, group_size + parity)
+
+    if last_frames == 0:
+        return full_groups * group_size
+
+    # the short last group grows by at least a frame per data frame, so at most one data count fits
+    for data_count in range(1, group_size):
+        if data_count + group_parity(data_count, group_size, parity) == last_frames:
+            return full_groups * group_size + data_count
+
+    return None
+
+
+def encode(chunks, group_size, parity):
+    """
+    chunks is a (num_data, chunk_size) uint8 array. Returns every frame's chunk in transmission order:
+    each group's data chunks followed by its parity chunks.
+    """
+    if parity == 0:
+        return list(chunks)
+
+    frames = []
+    first_data = 0
+
+    for _, data_count, parity_count in group_layout(len(chunks), group_size, parity):
+        group = chunks[first_data:first_data + data_count]
+        frames.extend(group)
+        frames.extend(gf_mul_rows(cauchy_matrix(data_count, parity_count), group))
+        first_data += data_count
+
+    return frames
+
+
+def needed_frames(received, num_frames, group_size, parity):
+    # frame ids still needed before every group can be rebuilt, missing data frames are asked for first
+    num_data = num_data_frames(num_frames, group_size, parity)
+    needed = []
+
+    if num_data is None:
+        return [i for i in range(num_frames) if i not in received]
+
+    for first_frame, data_count, parity_count in group_layout(num_data, group_size, parity):
+        group_ids = range(first_frame, first_frame + data_count + parity_count)
+        missing = [i for i in group_ids if i not in received]
+        shortfall = len(missing) - parity_count
+
+        if shortfall > 0:
+            needed.extend(missing[:shortfall])
+
+    return needed
+
+
+def needed_from_mask(received, groups, group_data):
+    # needed_frames for a bool array of received frames, with groups and group_data from frame_slots
+    missing = np.flatnonzero(~received)
+
+    if len(missing) == 0:
+        return missing
+
+    shortfall = group_data - np.bincount(groups[received], minlength=len(group_data))
+    missing_groups = groups[missing]
+
+    # frame ids, and so groups, are in order: a frame's rank among its group's missing frames is its
+    # distance from the group's first missing frame
+    rank = np.arange(len(missing)) - np.searchsorted(missing_groups, missing_groups)
+
+    return missing[rank < shortfall[missing_groups]]
+
+
+def decode_into(data, parity_chunks, received, num_data, group_size, parity):
+    """
+    In place decode for preallocated buffers. data is (num_data, chunk_size) with the data frames that
+    arrived already in their rows, parity_chunks holds the parity frames by row (see frame_slots) and
+    received is a bool array by frame id. Missing data rows are rebuilt in place.
+    Returns False if some group doesn't have enough frames yet.
+    """
+    data_row = 0
+    parity_row = 0
+
+    for first_frame, data_count, parity_count in group_layout(num_data, group_size, parity):
+        group_received = received[first_frame:first_frame + data_count + parity_count]
+
+        if not group_received[:data_count].all():
+            available = np.flatnonzero(group_received)[:data_count]
+
+            if len(available) < data_count:
+                return False
+
+            # rows of the generator matrix for the frames we have: identity rows for data, cauchy rows for parity
+            generator = np.concatenate([np.eye(data_count, dtype=np.uint8), cauchy_matrix(data_count, parity_count)])
+            group_rows = np.concatenate([data[data_row:data_row + data_count],
+                                         parity_chunks[parity_row:parity_row + parity_count]])
+
+            data[data_row:data_row + data_count] = gf_mul_rows(gf_invert_matrix(generator[available]),
+                                                               group_rows[available])
+
+        data_row += data_count
+        parity_row += parity_count
+
+    return True
+
+
+def decode(frames, num_frames, group_size, parity):
+    """
+    frames is a dict of {frame_id: chunk bytes}. Returns the data chunks joined together,
+    or None if some group doesn't have enough frames yet.
+    """
+    num_data = num_data_frames(num_frames, group_size, parity)
+
+    if num_data is None or not frames:
+        return None
+
+    chunk_size = len(next(iter(frames.values())))
+    is_parity, rows, _, _ = frame_slots(num_data, group_size, parity)
+    data = np.zeros((num_data, chunk_size), dtype=np.uint8)
+    parity_chunks = np.zeros((num_frames - num_data, chunk_size), dtype=np.uint8)
+    received = np.zeros(num_frames, dtype=bool)
+
+    for frame_id, chunk in frames.items():
+        if frame_id < num_frames:
+            (parity_chunks if is_parity[frame_id] else data)[rows[frame_id]] = np.frombuffer(chunk, dtype=np.uint8)
+            received[frame_id] = True
+
+    if not decode_into(data, parity_chunks, received, num_data, group_size, parity):
+        return None
+
+    return data.tobytes()
@@ -0,0 +1,174 @@
+"""
+
+Headless file modem: turns payloads into WAV / raw int16 recordings and decodes recordings back
+into payloads, as fast as the CPU allows. Handy for reprocessing recordings, regression testing
+the decoder and measuring demodulator throughput without a sound card.
+
+"""
+import numpy as np
+import argparse
+import fec
+import freedv
+import os
+import time
+import wave
+from modem import ArqModem
+
+
+sample_rate = 8000
+
+
+def read_audio(filename):
+    if filename.endswith('.wav'):
+        with wave.open(filename, 'rb') as wav:
+            assert wav.getsampwidth() == 2, 'only 16 bit recordings are supported'
+            assert wav.getframerate() == sample_rate, f'recording must be sampled at {sample_rate} Hz'
+
+            samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+
+            # only the first channel is used
+            return samples[::wav.getnchannels()]
+
+    return np.fromfile(filename, dtype=np.int16)
+
+
+def write_audio(filename, samples):
+    samples = np.asarray(samples, dtype=np.int16)
+
+    if filename.endswith('.wav'):
+        with wave.open(filename, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(samples.tobytes())
+
+    else:
+        samples.tofile(filename)
+
+
+def modulate(data, callsign, tx_id=0, mode=freedv.MODE_DATAC1,
+             fec_group_size=ArqModem.fec_group_size, fec_parity_frames=ArqModem.fec_parity_frames):
+    # returns the int16 samples for data, framed the same way ArqModem.arq_tx frames it
+    tx_freedv = freedv.FreeDVData(mode)
+    frames = ArqModem.build_frames(data, callsign, tx_id, tx_freedv.payload_bytes_per_modem_frame,
+                                   fec_group_size, fec_parity_frames)
+    samples = tx_freedv.tx_data(b''.join(frames))
+    tx_freedv.close()
+
+    return samples
+
+
+def demodulate(samples, mode=freedv.MODE_DATAC1):
+    """
+    Decode every ArqModem frame in samples.
+
+    Returns a dict of {session id: {frame_id: payload}}, the number of frames and erasure coding
+    parameters of each transmission, and stats about the run.
+    """
+    rx_freedv = freedv.FreeDVData(mode)
+    transmissions = {}
+    num_frames = {}
+    frames_decoded = 0
+    offset = 0
+
+    start_time = time.perf_counter()
+
+    while offset + rx_freedv.nin <= len(samples):
+        nin = rx_freedv.nin
+        status, rx_bytes = rx_freedv.rx(samples[offset:offset + nin])
+        offset += nin
+
+        if rx_bytes:
+            frame = ArqModem.parse_frame(rx_bytes[:-2])
+
+            if frame is None:
+                continue
+
+            session, frame_id, frame_num, fec_params, payload = frame
+            transmissions.setdefault(session, {})[frame_id] = payload
+            num_frames[session] = (frame_num, fec_params)
+            frames_decoded += 1
+
+    run_time = time.perf_counter() - start_time
+    rx_freedv.close()
+
+    stats = {
+        'samples': offset,
+        'frames_decoded': frames_decoded,
+        'run_time_s': run_time,
+        'samples_per_second': offset / run_time if run_time else 0.0,
+        'realtime_factor': (offset / sample_rate) / run_time if run_time else 0.0,
+    }
+
+    return transmissions, num_frames, stats
+
+
+def reassemble(frames, num_frames, fec_params):
+    # rebuild the data, or return the frame ids still needed
+    data = fec.decode(frames, num_frames, *fec_params)
+
+    if data is None:
+        return None, fec.needed_frames(frames, num_frames, *fec_params)
+
+    return data, []
+
+
+def encode_command(args):
+    with open(args.input, 'rb') as f:
+        data = f.read()
+
+    start_time = time.perf_counter()
+    samples = modulate(data, args.callsign, args.tx_id, args.mode)
+    run_time = time.perf_counter() - start_time
+
+    write_audio(args.output, samples)
+    print(f'Wrote {len(samples)} samples ({len(samples) / sample_rate:.1f} s of audio) in {run_time:.2f} s '
+          f'({len(samples) / run_time:.0f} samples/s)')
+
+
+def decode_command(args):
+    samples = read_audio(args.input)
+    transmissions, num_frames, stats = demodulate(samples, args.mode)
+
+    os.makedirs(args.output, exist_ok=True)
+
+    for session, frames in transmissions.items():
+        data, missing = reassemble(frames, *num_frames[session])
+
+        if data is None:
+            print(f'session {session:04x}: missing frames {missing}')
+            continue
+
+        callsign, data = ArqModem.split_callsign(data)
+        name = f'{callsign.decode(errors="replace")}_{session & 0xff}'
+
+        # the last frame is zero padded, so the payload may have trailing zeros
+        with open(os.path.join(args.output, name + '.bin'), 'wb') as f:
+            f.write(data)
+
+        print(f'{name}: {len(data)} bytes')
+
+    print(f'Decoded {stats["frames_decoded"]} frames from {stats["samples"]} samples in {stats["run_time_s"]:.2f} s '
+          f'({stats["samples_per_second"]:.0f} samples/s, {stats["realtime_factor"]:.1f}x realtime)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='FreeTV headless file modem')
+    subparsers = parser.add_subparsers(required=True)
+
+    encode_parser = subparsers.add_parser('encode', help='modulate a payload file into a .wav or raw int16 file')
+    encode_parser.add_argument('input')
+    encode_parser.add_argument('output')
+    encode_parser.add_argument('--callsign', default='-CALLSIGN-')
+    encode_parser.add_argument('--tx-id', type=int, default=0)
+    encode_parser.add_argument('--mode', type=int, default=freedv.MODE_DATAC1)
+    encode_parser.set_defaults(func=encode_command)
+
+    decode_parser = subparsers.add_parser('decode', help='decode a .wav or raw int16 recording into payload files')
+    decode_parser.add_argument('input')
+    decode_parser.add_argument('output', help='directory for the decoded payloads')
+    decode_parser.add_argument('--mode', type=int, default=freedv.MODE_DATAC1)
+    decode_parser.set_defaults(func=decode_command)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -12,6 +12,12 @@ MODE_DATAC4 = 18
 MODE_DATAC13 = 19
 MODE_700D = 7
 
+# freedv_get_rx_status() flags
+FREEDV_RX_TRIAL_SYNC = 0x1
+FREEDV_RX_SYNC = 0x2
+FREEDV_RX_BITS = 0x4
+FREEDV_RX_BIT_ERRORS = 0x8
+
 
 def generate_silence(duration):
     num_delay_samples = (duration / 1000) * 8000  # sample rate is 8000
@@ -23,116 +29,148 @@ class DataTooLarge(Exception):
 
 
 def get_payload_bytes_from_mode(mode):
-    if mode == MODE_DATAC1:
+    if mode == MODE_DATAC0:
+        return 14
+    elif mode == MODE_DATAC1:
         return 510
     elif mode == MODE_DATAC3:
         return 126
+    elif mode == MODE_DATAC4:
+        return 54
     elif mode == MODE_DATAC13:
         return 14
     else:
         return None
 
 
-class FreeDVData:
+# prototypes from codec2's freedv_api.h, as (argtypes, restype). The struct freedv handle is opaque, so it is
+# passed as a void pointer
+PROTOTYPES = {
+    'freedv_open': ([c_int], c_void_p),
+    'freedv_close': ([c_void_p], None),
+    'freedv_get_n_max_modem_samples': ([c_void_p], c_int),
+    'freedv_get_n_tx_modem_samples': ([c_void_p], c_int),
+    'freedv_get_n_tx_preamble_modem_samples': ([c_void_p], c_int),
+    'freedv_get_n_tx_postamble_modem_samples': ([c_void_p], c_int),
+    'freedv_get_bits_per_modem_frame': ([c_void_p], c_int),
+    'freedv_nin': ([c_void_p], c_int),
+    'freedv_rawdatarx': ([c_void_p, POINTER(c_ubyte), POINTER(c_short)], c_int),
+    'freedv_rawdatapreambletx': ([c_void_p, POINTER(c_short)], c_int),
+    'freedv_rawdatatx': ([c_void_p, POINTER(c_short), POINTER(c_ubyte)], None),
+    'freedv_rawdatapostambletx': ([c_void_p, POINTER(c_short)], c_int),
+    'freedv_gen_crc16': ([POINTER(c_ubyte), c_int], c_ushort),
+    'freedv_set_frames_per_burst': ([c_void_p, c_int], None),
+    'freedv_set_verbose': ([c_void_p, c_int], None),
+    'freedv_get_sync': ([c_void_p], c_int),
+    'freedv_set_sync': ([c_void_p, c_int], None),
+    'freedv_get_rx_status': ([c_void_p], c_int),
+    'freedv_get_total_bits': ([c_void_p], c_int),
+    'freedv_get_total_bit_errors': ([c_void_p], c_int),
+    'freedv_set_tx_amp': ([c_void_p, c_float], None),
+}
+
+c_lib = None
+c_lib_lock = Lock()
+
+
+def load_library():
     """
+    libcodec2, loaded and given its prototypes on first use, then shared by every FreeDVData
+    """
+    global c_lib
 
-    Python interface for the FreeDV API raw data modes. Written by Max, KO4VMI
-
-    Credits:
+    with c_lib_lock:
+        if c_lib is None:
+            system = platform.system()
+            libname = None
 
-    David Rowe, for developing FreeDV and the audio_buffer class
-
-    Simon DJ2LS, for helping me make this and providing me with example code.
+            if system == 'Windows':
+                libname = 'lib/libcodec2.dll'
+            elif system == 'Linux':
+                libname = 'lib/libcodec2.so'
 
-    """
+            assert libname is not None
 
-    def __init__(self, mode):
-        system = platform.system()
-        libname = None
+            lib = CDLL(libname)
 
-        if system == 'Windows':
-            libname = 'lib/libcodec2.dll'
-        elif system == 'Linux':
-            libname = 'lib/libcodec2.so'
+            for name, (argtypes, restype) in PROTOTYPES.items():
+                function = getattr(lib, name)
+                function.argtypes = argtypes
+                function.restype = restype
 
-        assert libname is not None
+            c_lib = lib
 
-        self.c_lib = CDLL(libname)
+    return c_lib
 
-        self.c_lib.freedv_open.restype = POINTER(c_ubyte)
 
-        self.freedv = self.c_lib.freedv_open(mode)
+class FreeDVSet:
+    """
 
-        self.c_lib.freedv_get_n_max_modem_samples.argtype = [c_void_p]
-        self.c_lib.freedv_get_n_max_modem_samples.restype = c_int
+    FreeDVData instances by mode, each opened on first use. setup(mode, freedv_data) runs once on every new
+    instance. Only opened instances show up in values() and items().
 
-        self.c_lib.freedv_get_n_tx_modem_samples.argtype = [self.freedv]
-        self.c_lib.freedv_get_n_tx_modem_samples.restype = c_size_t
+    """
 
-        self.c_lib.freedv_get_n_tx_preamble_modem_samples.argtype = [self.freedv]
-        self.c_lib.freedv_get_n_tx_preamble_modem_samples.restype = c_size_t
+    def __init__(self, modes, setup=None):
+        self.modes = list(modes)
+        self.setup = setup
+        self.instances = {}
+        self.lock = Lock()
 
-        self.c_lib.freedv_get_n_tx_postamble_modem_samples.argtype = [self.freedv]
-        self.c_lib.freedv_get_n_tx_postamble_modem_samples.restype = c_size_t
+    def __contains__(self, mode):
+        return mode in self.modes
 
-        self.c_lib.freedv_get_bits_per_modem_frame.argtype = [self.freedv]
-        self.c_lib.freedv_get_bits_per_modem_frame.restype = c_size_t
+    def __getitem__(self, mode):
+        instance = self.instances.get(mode)
 
-        self.c_lib.freedv_nin.argtype = [self.freedv]
-        self.c_lib.freedv_nin.restype = c_int
+        if instance is not None:
+            return instance
 
-        self.c_lib.freedv_rawdatarx.argtype = [self.freedv, c_uint8, c_short]
-        self.c_lib.freedv_rawdatarx.restype = c_size_t
+        if mode not in self.modes:
+            raise KeyError(mode)
 
-        self.c_lib.freedv_rawdatapreambletx.argtype = [self.freedv, c_short]
-        self.c_lib.freedv_rawdatapreambletx.restype = c_int
+        with self.lock:
+            if mode not in self.instances:
+                instance = FreeDVData(mode)
 
-        self.c_lib.freedv_rawdatatx.argtype = [self.freedv, c_short, c_uint8]
-        self.c_lib.freedv_rawdatatx.restype = c_void_p
+                if self.setup is not None:
+                    self.setup(mode, instance)
 
-        self.c_lib.freedv_rawdatapostambletx.argtype = [self.freedv, c_short]
-        self.c_lib.freedv_rawdatapostambletx.restype = c_int
+                self.instances[mode] = instance
 
-        self.c_lib.freedv_gen_crc16.argtype = [c_uint8, c_size_t]
-        self.c_lib.freedv_gen_crc16.restype = c_uint16
+        return self.instances[mode]
 
-        self.bytes_per_modem_frame = self.c_lib.freedv_get_bits_per_modem_frame(self.freedv) // 8
-        self.payload_bytes_per_modem_frame = self.bytes_per_modem_frame - 2
+    def get(self, mode, default=None):
+        return self[mode] if mode in self.modes else default
 
-        self.n_mod_out = self.c_lib.freedv_get_n_tx_modem_samples(self.freedv)
+    def values(self):
+        return list(self.instances.values())
 
-        self.c_lib.freedv_set_frames_per_burst.argtype = [self.freedv, c_int]
-        self.c_lib.freedv_set_frames_per_burst.restype = c_void_p
+    def items(self):
+        return list(self.instances.items())
 
-        self.c_lib.freedv_set_verbose.argtype = [self.freedv, c_int]
-        self.c_lib.freedv_set_verbose.restype = c_void_p
 
-        self.c_lib.freedv_rawdatarx.argtype = [self.freedv, c_uint8, c_short]
-        self.c_lib.freedv_rawdatarx.restype = c_size_t
+class FreeDVData:
+    """
 
-        self.c_lib.freedv_close.argtype = [c_void_p]
-        self.c_lib.freedv_close.restype = c_void_p
+    Python interface for the FreeDV API raw data modes. Written by Max, KO4VMI
 
-        self.c_lib.freedv_get_sync.argtype = [self.freedv]
-        self.c_lib.freedv_get_sync.restype = c_int
+    Credits:
 
-        self.c_lib.freedv_set_sync.argtype = [self.freedv, c_int]
-        self.c_lib.freedv_set_sync.restype = c_void_p
+    David Rowe, for developing FreeDV and the audio_buffer class
 
-        self.c_lib.freedv_get_rx_status.argtype = [self.freedv]
-        self.c_lib.freedv_get_rx_status.restype = c_int
+    Simon DJ2LS, for helping me make this and providing me with example code.
 
-        self.c_lib.freedv_get_total_bits.argtype = [self.freedv]
-        self.c_lib.freedv_get_total_bits.restype = c_int
+    """
 
-        self.c_lib.freedv_get_total_bit_errors.argtype = [self.freedv]
-        self.c_lib.freedv_get_total_bit_errors.restype = c_int
+    def __init__(self, mode):
+        self.c_lib = load_library()
 
-        self.c_lib.freedv_set_frames_per_burst.argtype = [self.freedv, c_int]
-        self.c_lib.freedv_set_frames_per_burst.restype = c_void_p
+        self.mode = mode
+        self.freedv = self.c_lib.freedv_open(mode)
 
-        self.c_lib.freedv_set_tx_amp.argtype = [self.freedv, c_float]
-        self.c_lib.freedv_set_tx_amp.restype = c_void_p
+        self.bytes_per_modem_frame = self.c_lib.freedv_get_bits_per_modem_frame(self.freedv) // 8
+        self.payload_bytes_per_modem_frame = self.bytes_per_modem_frame - 2
 
         self.c_lib.freedv_set_frames_per_burst(self.freedv, 1)
         self.c_lib.freedv_set_verbose(self.freedv, 1)
@@ -141,23 +179,52 @@ class FreeDVData:
         self.frames_per_burst = 1
 
         self.n_tx_modem_samples = self.c_lib.freedv_get_n_tx_modem_samples(self.freedv)
+        self.n_mod_out = self.n_tx_modem_samples
         self.n_tx_preamble_modem_samples = self.c_lib.freedv_get_n_tx_preamble_modem_samples(self.freedv)
         self.n_tx_postamble_modem_samples = self.c_lib.freedv_get_n_tx_postamble_modem_samples(self.freedv)
 
+        # preallocated buffers, with their ctypes pointers cached, so rx / tx don't allocate per call
+        self.demod_in = np.zeros(self.get_n_max_modem_samples(), dtype=np.int16)
+        self.demod_in_ptr = self.demod_in.ctypes.data_as(POINTER(c_short))
+
+        self.bytes_out = np.zeros(self.bytes_per_modem_frame, dtype=np.uint8)
+        self.bytes_out_ptr = self.bytes_out.ctypes.data_as(POINTER(c_ubyte))
+
+        self.tx_frame = np.zeros(self.bytes_per_modem_frame, dtype=np.uint8)
+        self.tx_frame_ptr = self.tx_frame.ctypes.data_as(POINTER(c_ubyte))
+
+        # rx statistics, read by the modem's metrics
+        self.frames_decoded = 0
+        self.frames_failed = 0
+        self.demod_calls = 0
+
+        self.silence_samples = int(50 / 1000 * 8000)  # silence between bursts, sample rate is 8000
+
+        self.mod_out = np.zeros(self.n_tx_modem_samples, dtype=np.int16)
+        self.mod_out_ptr = self.mod_out.ctypes.data_as(POINTER(c_short))
+
+        self.mod_out_preamble = np.zeros(self.n_tx_preamble_modem_samples, dtype=np.int16)
+        self.mod_out_preamble_ptr = self.mod_out_preamble.ctypes.data_as(POINTER(c_short))
+
+        self.mod_out_postamble = np.zeros(self.n_tx_postamble_modem_samples + self.silence_samples, dtype=np.int16)
+        self.mod_out_postamble_ptr = self.mod_out_postamble.ctypes.data_as(POINTER(c_short))
+
+        # tx_burst's output, grown to the burst length when that goes up
+        self.burst_out = np.zeros(0, dtype=np.int16)
+
     def set_frames_per_burst(self, num_frames):
         self.frames_per_burst = num_frames
         self.c_lib.freedv_set_frames_per_burst(self.freedv, num_frames)
 
-    def tx_burst(self, data_in):
-        # init buffers
-        mod_out = create_string_buffer(self.n_tx_modem_samples * 2)
-        mod_out_preamble = create_string_buffer(self.n_tx_preamble_modem_samples * 2)
-        mod_out_postamble = create_string_buffer(self.n_tx_postamble_modem_samples * 2)
-
-        # preamble
-        self.c_lib.freedv_rawdatapreambletx(self.freedv, mod_out_preamble)
-        txbuffer = bytes(mod_out_preamble)
+    def get_burst_samples(self, num_frames):
+        return (self.n_tx_preamble_modem_samples + num_frames * self.n_tx_modem_samples +
+                self.n_tx_postamble_modem_samples + self.silence_samples)
 
+    def tx_burst_chunks(self, data_in):
+        """
+        Modulate a burst one piece at a time: the preamble, each frame, then the postamble followed by
+        the silence between bursts. The yielded arrays are reused, so copy them before the next iteration.
+        """
         # find number of frames needed to tx all data
         num_frames = math.ceil(len(data_in) / self.payload_bytes_per_modem_frame)
 
@@ -166,42 +233,70 @@ class FreeDVData:
 
         print(f'MODEM: Transmitting burst with {num_frames} frames')
 
+        # preamble
+        self.c_lib.freedv_rawdatapreambletx(self.freedv, self.mod_out_preamble_ptr)
+        yield self.mod_out_preamble
+
         # create data frames
+        payload_bytes = self.payload_bytes_per_modem_frame
+        data_in = np.frombuffer(bytes(data_in), dtype=np.uint8)
+
         for i in range(num_frames):
-            # main data buffer
-            buffer = bytearray(self.payload_bytes_per_modem_frame)
-            data_chunk = data_in[i * self.payload_bytes_per_modem_frame:(i + 1) * self.payload_bytes_per_modem_frame]
-            buffer[:len(data_chunk)] = data_chunk
+            data_chunk = data_in[i * payload_bytes:(i + 1) * payload_bytes]
+            self.tx_frame[:len(data_chunk)] = data_chunk
+            self.tx_frame[len(data_chunk):] = 0
 
             # add crc16
-            crc16 = c_ushort(self.c_lib.freedv_gen_crc16(bytes(buffer), self.payload_bytes_per_modem_frame))
-            crc16 = crc16.value.to_bytes(2, byteorder='big')
-            buffer += crc16
+            crc16 = self.c_lib.freedv_gen_crc16(self.tx_frame_ptr, payload_bytes)
+            self.tx_frame[payload_bytes] = crc16 >> 8
+            self.tx_frame[payload_bytes + 1] = crc16 & 0xff
+
+            self.c_lib.freedv_rawdatatx(self.freedv, self.mod_out_ptr, self.tx_frame_ptr)
+            yield self.mod_out
+
+        # postamble, the rest of the array stays zero as silence between bursts
+        self.c_lib.freedv_rawdatapostambletx(self.freedv, self.mod_out_postamble_ptr)
+        yield self.mod_out_postamble
+
+    def tx_burst(self, data_in, out=None):
+        """
+        Modulate one burst into out, by default a buffer every call reuses, so copy the result before the next
+        call. Returns the part of out that was written.
+        """
+        if out is None:
+            num_samples = self.get_burst_samples(self.frames_per_burst)
+
+            if len(self.burst_out) < num_samples:
+                self.burst_out = np.zeros(num_samples, dtype=np.int16)
 
-            data = (c_ubyte * self.bytes_per_modem_frame).from_buffer_copy(buffer)
-            self.c_lib.freedv_rawdatatx(self.freedv, mod_out, data)
-            txbuffer += bytes(mod_out)
+            out = self.burst_out
 
-        # postamble
-        self.c_lib.freedv_rawdatapostambletx(self.freedv, mod_out_postamble)
-        txbuffer += mod_out_postamble
+        offset = 0
 
-        # add silence between bursts
-        txbuffer += generate_silence(50)
+        for chunk in self.tx_burst_chunks(data_in):
+            out[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
 
-        return txbuffer
+        return out[:offset]
 
     def tx_data(self, data_in):
         # this function will split up incoming data if data is larger than can be transmitted in one burst
         bytes_per_burst = self.frames_per_burst * self.payload_bytes_per_modem_frame
-        tx_buffer = b''
+        payload_bytes = self.payload_bytes_per_modem_frame
 
         # calculate how many bursts are requird to tx all data
         num_bursts = math.ceil(len(data_in) / bytes_per_burst)
-        for i in range(num_bursts):
-            tx_buffer += self.tx_burst(data_in[i * bytes_per_burst:(i + 1) * bytes_per_burst])
+        bursts = [data_in[i * bytes_per_burst:(i + 1) * bytes_per_burst] for i in range(num_bursts)]
 
-        return tx_buffer
+        # every burst is modulated straight into its place in one output array
+        out = np.zeros(sum(self.get_burst_samples(math.ceil(len(burst) / payload_bytes)) for burst in bursts),
+                       dtype=np.int16)
+        offset = 0
+
+        for burst in bursts:
+            offset += len(self.tx_burst(burst, out[offset:]))
+
+        return out
 
     def set_tx_amp(self, amp):
         self.c_lib.freedv_set_tx_amp(self.freedv, c_float(amp))
@@ -228,13 +323,39 @@ class FreeDVData:
         return self.c_lib.freedv_get_rx_status(self.freedv)
 
     def rx(self, demod_in):
-        bytes_out = create_string_buffer(self.bytes_per_modem_frame)
-        nbytes_out = self.c_lib.freedv_rawdatarx(self.freedv, bytes_out, demod_in)
+        # demod_in is an int16 array (passed to C without copying) or raw int16 bytes
+        if isinstance(demod_in, np.ndarray):
+            demod_in = np.ascontiguousarray(demod_in, dtype=np.int16)
+            demod_ptr = demod_in.ctypes.data_as(POINTER(c_short))
+        else:
+            samples = np.frombuffer(demod_in, dtype=np.int16)
+            self.demod_in[:len(samples)] = samples
+            demod_ptr = self.demod_in_ptr
+
+        nbytes_out = self.c_lib.freedv_rawdatarx(self.freedv, self.bytes_out_ptr, demod_ptr)
 
         self.nin = self.get_freedv_rx_nin()
         status = self.get_rx_status()
 
-        return status, bytes_out[:nbytes_out]
+        self.demod_calls += 1
+
+        if nbytes_out:
+            self.frames_decoded += 1
+        elif status & FREEDV_RX_BITS:
+            # bits came out of the demodulator, but the frame failed its crc
+            self.frames_failed += 1
+
+        return status, self.bytes_out[:nbytes_out].tobytes()
+
+    def get_stats(self):
+        return {
+            'demod_calls': self.demod_calls,
+            'frames_decoded': self.frames_decoded,
+            'frames_failed': self.frames_failed,
+            'sync': self.get_sync(),
+            'total_bits': self.get_total_bits(),
+            'total_bit_errors': self.get_total_bit_errors(),
+        }
 
     def close(self):
         self.c_lib.freedv_close(self.freedv)
@@ -242,49 +363,111 @@ class FreeDVData:
 
 class audio_buffer:
     """
-    Thread-safe audio buffer, which fits the needs of codec2
+    Thread-safe circular audio buffer, which fits the needs of codec2
 
-    made by David Rowe, VK5DGR
+    Original linear version made by David Rowe, VK5DGR
     """
 
-    # A buffer of int16 samples, using a fixed length numpy array self.buffer for storage
-    # self.nbuffer is the current number of samples in the buffer
+    # A ring of int16 samples, using a fixed length numpy array self.buffer for storage.
+    # self.head and self.tail are monotonic sample counters for the producer and consumer,
+    # so push / pop are O(1) no matter how full the buffer is. The mutex only guards the
+    # counters; sample copies happen outside of it, which is safe with a single producer
+    # and a single consumer because they never touch the same region of the ring.
     def __init__(self, size):
-        # log.debug("[C2 ] Creating audio buffer", size=size)
         self.size = size
         self.buffer = np.zeros(size, dtype=np.int16)
-        self.nbuffer = 0
+        self.head = 0
+        self.tail = 0
         self.mutex = Lock()
 
+    @property
+    def nbuffer(self):
+        return self.head - self.tail
+
+    def free(self):
+        return self.size - self.nbuffer
+
     def push(self, samples):
         """
         Push new data to buffer
 
         Args:
-            samples:
+            samples: int16 samples
 
         Returns:
             Nothing
         """
-        self.mutex.acquire()
-        # Add samples at the end of the buffer
-        assert self.nbuffer + len(samples) <= self.size
-        self.buffer[self.nbuffer: self.nbuffer + len(samples)] = samples
-        self.nbuffer += len(samples)
-        self.mutex.release()
+        num_samples = len(samples)
+        assert num_samples <= self.free()
+
+        start = self.head % self.size
+        end = start + num_samples
+
+        if end <= self.size:
+            self.buffer[start:end] = samples
+        else:
+            first = self.size - start
+            self.buffer[start:] = samples[:first]
+            self.buffer[:num_samples - first] = samples[first:]
+
+        with self.mutex:
+            self.head += num_samples
+
+    def peek(self, size):
+        """
+        Zero-copy view of the oldest samples in the buffer
+        Args:
+          size: number of samples, must not exceed nbuffer
+
+        Returns:
+            Tuple of one view, or two views if the data wraps around the end of the ring
+        """
+        assert size <= self.nbuffer
+
+        start = self.tail % self.size
+        end = start + size
+
+        if end <= self.size:
+            return (self.buffer[start:end],)
+
+        return self.buffer[start:], self.buffer[:end - self.size]
+
+    def get(self, size, out=None):
+        """
+        Contiguous copy-free (when possible) read of the oldest samples, without removing them
+        Args:
+          size: number of samples, must not exceed nbuffer
+          out: optional preallocated array used when the data wraps around
+
+        Returns:
+            int16 array of length size
+        """
+        views = self.peek(size)
+
+        if len(views) == 1:
+            return views[0]
+
+        if out is None:
+            out = np.empty(size, dtype=self.buffer.dtype)
+
+        first = len(views[0])
+        out[:first] = views[0]
+        out[first:size] = views[1]
+        return out[:size]
 
     def pop(self, size):
         """
-        get data from buffer in size of NIN
+        Remove samples from the start of the buffer
         Args:
-          size:
+          size: number of samples
 
         Returns:
             Nothing
         """
-        self.mutex.acquire()
-        # Remove samples from the start of the buffer
-        self.nbuffer -= size
-        self.buffer[: self.nbuffer] = self.buffer[size: size + self.nbuffer]
-        assert self.nbuffer >= 0
-        self.mutex.release()
+        with self.mutex:
+            assert size <= self.head - self.tail
+            self.tail += size
+
+    def clear(self):
+        with self.mutex:
+            self.tail = self.head
@@ -3,9 +3,19 @@ from PySide6.QtCore import *
 from PySide6.QtGui import *
 from modem import ArqModem, list_audio_devices
 import numpy as np
-import imagecodecs
-import cv2
+import progressive
+import encoder
+import freedv
+import spool
+import daemon
+import modemprocess
+import audio
 import time
+import argparse
+import multiprocessing
+from concurrent import futures
+import math
+import sys
 
 # import faulthandler
 # faulthandler.enable()
@@ -13,14 +23,55 @@ import time
 
 class ModemSignals(QObject):
     rx_signal = Signal(bytes)
+    rx_image_signal = Signal(object)
     transmit_on_off_signal = Signal(bool)
     rx_callsign_signal = Signal(str)
 
 
+class RxImages:
+    """
+
+    Progressive images are painted as their segments arrive, one decoder per session being received.
+    Shared by the local and the remote modem worker.
+
+    """
+
+    def __init__(self):
+        self.decoders = {}
+
+    def forget(self, session_ids):
+        for session_id in list(self.decoders):
+            if session_id not in session_ids:
+                del self.decoders[session_id]
+
+    def partial(self, session_id, data, is_available):
+        # the image so far, or None if there is nothing new to show
+        if not is_available(0, len(progressive.MAGIC)) or not progressive.is_progressive(data):
+            return None
+
+        return self.decoders.setdefault(session_id, progressive.ProgressiveDecoder()).update(data, is_available)
+
+    def complete(self, session_id, data):
+        # the finished image of a progressive payload, None for anything else
+        decoder = self.decoders.pop(session_id, None) or progressive.ProgressiveDecoder()
+
+        if not progressive.is_progressive(data):
+            return None
+
+        return decoder.update(data, lambda start, end: end <= len(data))
+
+
 class ModemWorker(QObject):
+    rx_poll_time = 0.1
+
+    # partial receptions are kept here across modem restarts, along with an archive of completed ones
+    spool_dir = 'spool'
+
     def __init__(self, callsign, in_device, out_device):
         super().__init__()
-        self.modem = ArqModem(in_device, out_device, callsign)
+        self.modem = ArqModem(in_device, out_device, callsign, spool=spool.Spool(self.spool_dir))
+        self.audio_monitor = freedv.audio_buffer(ArqModem.sample_rate)
+        self.modem.audio_monitor = self.audio_monitor
         self.run = True
         self.is_transmitting = False
         self.signal = ModemSignals()
@@ -28,6 +79,9 @@ class ModemWorker(QObject):
         self.retransmit = False
         self.test_frame = False
 
+        self.rx_images = RxImages()
+        self.rx_frame_counts = {}
+
     def work(self):
         while self.run:
             if self.test_frame:
@@ -41,7 +95,9 @@ class ModemWorker(QObject):
                 self.retransmit = False
 
             elif not self.is_transmitting:
-                self.modem.arq_rx()
+                # blocks until pa_callback has a full chunk ready, so an idle modem doesn't spin
+                self.modem.arq_rx(timeout=self.rx_poll_time)
+                self.update_progressive_rx()
                 rx_data = self.modem.get_rx_data()
 
                 rx_callsign = self.modem.get_rx_callsign()
@@ -49,19 +105,67 @@ class ModemWorker(QObject):
                     self.signal.rx_callsign_signal.emit(rx_callsign)
 
                 if rx_data is not None:
+                    if progressive.is_progressive(rx_data):
+                        image = self.rx_images.complete(self.modem.rx_last_session.session_id, rx_data)
 
-                    self.signal.rx_signal.emit(rx_data)
+                        if image is not None:
+                            self.signal.rx_image_signal.emit(image)
+
+                    else:
+                        self.signal.rx_signal.emit(bytes(rx_data))
 
             elif self.tx_data is not None:
                 self.signal.transmit_on_off_signal.emit(True)
-                compressed_image = imagecodecs.avif_encode(self.tx_data, level=10)
-                self.modem.arq_tx(compressed_image)
+
+                # tx_data is the encoder's future, usually finished long before Transmit was pressed
+                try:
+                    compressed_image = self.tx_data.result()
+                except Exception as e:
+                    print(f'Image encoding failed: {e}')
+                    compressed_image = None
+
                 self.tx_data = None
 
+                if compressed_image is not None:
+                    try:
+                        self.modem.arq_tx(compressed_image)
+                    except freedv.DataTooLarge:
+                        print(f'Image too large to send: {len(compressed_image)} bytes')
+                        compressed_image = None
+
+                if compressed_image is None:
+                    self.is_transmitting = False
+                    self.signal.transmit_on_off_signal.emit(False)
+
             elif self.is_transmitting and not self.modem.is_transmitting:
                 self.is_transmitting = False
                 self.signal.transmit_on_off_signal.emit(False)
 
+    def update_progressive_rx(self):
+        session = self.modem.rx_current
+
+        # forget sessions the modem has dropped
+        for session_id in list(self.rx_frame_counts):
+            if self.modem.rx_table.get(session_id) is None:
+                del self.rx_frame_counts[session_id]
+
+        self.rx_images.forget(self.rx_frame_counts)
+
+        # only look again when new frames came in
+        if session is None or session.received_count == self.rx_frame_counts.get(session.session_id):
+            return
+
+        self.rx_frame_counts[session.session_id] = session.received_count
+        partial = self.modem.get_rx_partial(session)
+
+        if partial is None:
+            return
+
+        image = self.rx_images.partial(session.session_id, *partial)
+
+        if image is not None:
+            self.signal.rx_image_signal.emit(image)
+
     def stop(self):
         self.run = False
         self.modem.close()
@@ -74,25 +178,177 @@ class ModemWorker(QObject):
     def transmit_test_frame(self):
         self.test_frame = True
 
-    def transmit_image(self, data):
+    def transmit_image(self, encoded):
         self.is_transmitting = True
-        self.tx_data = data
+        self.tx_data = encoded
+
+    def set_tx_volume(self, vol):
+        self.modem.set_tx_volume(vol)
+
+    def halt_tx(self):
+        self.modem.halt_tx()
+
+    def get_frame_budget(self, seconds, mode):
+        return self.modem.get_frame_budget(seconds, mode)
+
+    def get_audio_level(self):
+        return audio.read_level(self.audio_monitor)
+
+
+class RemoteModemWorker(QObject):
+    """
+
+    Same interface as ModemWorker, for a modem that runs elsewhere: in daemon.py (client is a
+    daemon.ModemClient) or in a process of its own (a modemprocess.ModemProcess). RX comes in as the
+    client's events, everything else is a request to it.
+
+    """
+
+    reconnect_time = 2.0
+    budget_timeout = 2.0
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+        self.run = True
+        self.signal = ModemSignals()
+        self.rx_images = RxImages()
+        self.rx_partials = daemon.PartialReceptions()
+
+        # requests go out one at a time on a thread of their own, so a modem that is slow to answer, or gone,
+        # never holds up the GUI
+        self.requests = futures.ThreadPoolExecutor(max_workers=1)
+
+    def work(self):
+        while self.run:
+            try:
+                for header, payload in self.client.events():
+                    if not self.run:
+                        break
+
+                    self.handle_event(header, payload)
+
+            except OSError as e:
+                print(f'Lost the modem: {e}')
+
+            if self.run:
+                time.sleep(self.reconnect_time)
+
+    def handle_event(self, header, payload):
+        if header['type'] == 'transmitting':
+            self.signal.transmit_on_off_signal.emit(header['transmitting'])
+
+        elif header['type'] == 'callsign':
+            self.signal.rx_callsign_signal.emit(header['callsign'])
+
+        elif header['type'] == 'partial':
+            image = self.rx_images.partial(header['session'], *self.rx_partials.update(header, payload))
+
+            if image is not None:
+                self.signal.rx_image_signal.emit(image)
+
+        elif header['type'] == 'rx':
+            self.rx_partials.forget(header['session'])
+
+            if progressive.is_progressive(payload):
+                image = self.rx_images.complete(header['session'], payload)
+
+                if image is not None:
+                    self.signal.rx_image_signal.emit(image)
+
+            else:
+                self.signal.rx_signal.emit(payload)
+
+    def request(self, method, *args):
+        future = self.requests.submit(method, *args)
+        future.add_done_callback(self.check_request)
+        return future
+
+    @staticmethod
+    def check_request(future):
+        error = future.exception()
+
+        if error is not None:
+            print(f'Modem request failed: {type(error).__name__}: {error}')
+
+    def stop(self):
+        # the event stream notices at its next keepalive
+        self.run = False
+        self.requests.shutdown(wait=False)
+        self.client.close()
+        self.thread().quit()
+
+    def request_retransmit(self):
+        self.request(self.client.retransmit)
+
+    def transmit_test_frame(self):
+        self.request(self.client.test_frame)
+
+    def transmit_image(self, encoded):
+        # submitted once the encoder is done, the daemon reports when it starts transmitting
+        def submit(future):
+            try:
+                payload = future.result()
+            except Exception as e:
+                print(f'Image encoding failed: {e}')
+                return
+
+            self.request(self.client.submit, payload)
+
+        if encoded is not None:
+            encoded.add_done_callback(submit)
+
+    def set_tx_volume(self, vol):
+        self.request(self.client.set_volume, vol)
+
+    def halt_tx(self):
+        self.request(self.client.halt)
+
+    def get_frame_budget(self, seconds, mode):
+        # the remote budget is always in DATAC1 frames, None if the modem doesn't answer in time
+        try:
+            return self.request(self.client.get_frame_budget, seconds).result(self.budget_timeout)
+        except (OSError, EOFError, futures.TimeoutError):
+            return None
+
+    def get_audio_level(self):
+        return self.client.get_audio_level()
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    level_update_ms = 100
+
+    def __init__(self, daemon_url=None, in_process=False):
         super().__init__()
         self.setWindowTitle('FreeTV')
 
-        self.in_devices, self.out_devices = list_audio_devices()
-        self.in_device = int(next(iter(self.in_devices)))
-        self.out_device = int(next(iter(self.out_devices)))
+        # with a daemon_url the modem runs in daemon.py, and this window is one of its clients. Otherwise it
+        # runs in a child process, unless in_process is set
+        self.daemon_url = daemon_url
+        self.in_process = in_process
+
+        # the daemon opens its own devices, this machine may not even have any
+        if daemon_url is None:
+            self.in_devices, self.out_devices = list_audio_devices()
+            self.in_device = int(next(iter(self.in_devices)))
+            self.out_device = int(next(iter(self.out_devices)))
+        else:
+            self.in_devices, self.out_devices = {}, {}
+            self.in_device = None
+            self.out_device = None
 
         self.callsign = '-CALLSIGN-'
         self.modem = None
         self.modem_transmitting = False
         self.modem_thread = None
         self.tx_volume = 100
+        self.progressive = False
+        self.encoder = encoder.EncodePipeline()
+
+        # size budget for TX images: off, a number of DATAC1 frames, or seconds of airtime
+        self.budget_unit = 0
+        self.budget_value = 40
+        self.budget_time_limit = 20.0
 
         # menubar
         self.menu_bar = self.menuBar()
@@ -150,6 +406,33 @@ class MainWindow(QMainWindow):
         test_frame_button_palette.setColor(self.test_frame_button.backgroundRole(), Qt.GlobalColor.red)
         self.test_frame_button.setPalette(test_frame_button_palette)
 
+        self.progressive_checkbox = QCheckBox('Progressive TX')
+        self.progressive_checkbox.toggled.connect(self.set_progressive)
+
+        self.budget_label = QLabel('TX image budget')
+        self.budget_label.setFont(QFont('Arial', 12))
+
+        self.budget_select = QComboBox()
+        self.budget_select.addItems(['Off', 'DATAC1 frames', 'Seconds'])
+        self.budget_select.currentIndexChanged.connect(self.set_budget_unit)
+
+        self.budget_input = QSpinBox()
+        self.budget_input.setRange(1, 255)
+        self.budget_input.setValue(self.budget_value)
+        self.budget_input.editingFinished.connect(self.set_budget_value)
+
+        self.rx_level_label = QLabel('RX level')
+        self.rx_level_label.setFont(QFont('Arial', 12))
+
+        self.rx_level_bar = QProgressBar()
+        self.rx_level_bar.setRange(-60, 0)
+        self.rx_level_bar.setValue(-60)
+        self.rx_level_bar.setFormat('%v dBFS')
+
+        self.rx_level_timer = QTimer(self)
+        self.rx_level_timer.timeout.connect(self.update_rx_level)
+        self.rx_level_timer.start(self.level_update_ms)
+
         self.settings_label = QLabel('Settings')
         self.settings_label.setFont(QFont('Arial', 25))
 
@@ -161,6 +444,12 @@ class MainWindow(QMainWindow):
         self.settings_layout.addWidget(self.volume_label)
         self.settings_layout.addWidget(self.volume_slider)
         self.settings_layout.addWidget(self.test_frame_button)
+        self.settings_layout.addWidget(self.progressive_checkbox)
+        self.settings_layout.addWidget(self.budget_label)
+        self.settings_layout.addWidget(self.budget_select)
+        self.settings_layout.addWidget(self.budget_input)
+        self.settings_layout.addWidget(self.rx_level_label)
+        self.settings_layout.addWidget(self.rx_level_bar)
         self.settings_layout.setSpacing(0)
         self.settings_layout.addStretch(1)
 
@@ -235,8 +524,21 @@ class MainWindow(QMainWindow):
 
     def start_stop_modem(self):
         if self.modem is None:
-            self.modem = ModemWorker(self.callsign, self.in_device, self.out_device)
-            self.modem.modem.set_tx_volume(self.tx_volume)
+            if self.daemon_url is not None:
+                self.modem = RemoteModemWorker(daemon.ModemClient(self.daemon_url))
+            elif self.in_process:
+                self.modem = ModemWorker(self.callsign, self.in_device, self.out_device)
+            else:
+                try:
+                    modem_process = modemprocess.ModemProcess(self.callsign, self.in_device, self.out_device,
+                                                              ModemWorker.spool_dir)
+                except RuntimeError as e:
+                    print(e)
+                    return
+
+                self.modem = RemoteModemWorker(modem_process)
+
+            self.modem.set_tx_volume(self.tx_volume)
             self.modem_thread = QThread()
             self.modem.moveToThread(self.modem_thread)
             self.modem_thread.started.connect(self.modem.work)
@@ -245,6 +547,7 @@ class MainWindow(QMainWindow):
             self.modem.signal.transmit_on_off_signal.connect(self.modem_transmitting_on_off)
             self.modem.signal.rx_callsign_signal.connect(self.update_rx_callsign)
             self.modem.signal.rx_signal.connect(self.process_rx)
+            self.modem.signal.rx_image_signal.connect(self.process_rx_image)
 
             modem_button_palette = self.modem_start_button.palette()
             modem_button_palette.setColor(self.modem_start_button.backgroundRole(), Qt.GlobalColor.green)
@@ -304,9 +607,43 @@ class MainWindow(QMainWindow):
         if dialog.exec():
             filename = dialog.selectedFiles()[0]
             if filename:
+                import cv2
+
                 tx_image = cv2.imread(filename)
                 self.tx_image = cv2.resize(tx_image, (self.image_x, self.image_y))
                 self.update_tx_image(self.tx_image)
+                self.encode_tx_image()
+
+    def get_budget_bytes(self):
+        if self.budget_unit == 0:
+            return None
+
+        num_frames = self.budget_value
+
+        if self.budget_unit == 2:
+            # airtime depends on the modem's burst settings
+            if self.modem is None:
+                return None
+
+            num_frames = self.modem.get_frame_budget(self.budget_value, freedv.MODE_DATAC1)
+
+            if num_frames is None:
+                return None
+
+        return ArqModem.get_payload_budget(num_frames, freedv.get_payload_bytes_from_mode(freedv.MODE_DATAC1),
+                                           ArqModem.fec_group_size, ArqModem.fec_parity_frames)
+
+    def encode_tx_image(self):
+        # starts the encode in the background, transmit_image picks the same result up from the cache
+        if self.budget_unit == 0:
+            return self.encoder.submit(self.tx_image, progressive_tx=self.progressive, level=10)
+
+        budget_bytes = self.get_budget_bytes()
+
+        if budget_bytes is None:
+            return None
+
+        return self.encoder.submit_budget(self.tx_image, budget_bytes, time_limit=self.budget_time_limit)
 
     def tx_test_frame(self):
         if self.modem is not None:
@@ -325,40 +662,70 @@ class MainWindow(QMainWindow):
             self.tx_button.setPalette(tx_button_palette)
 
     def process_rx(self, rx_data):
-        image = None
-        try:
-            image = imagecodecs.avif_decode(rx_data)
-            self.update_rx_error_text(False)
-
-        except imagecodecs.AvifError:
-            self.update_rx_error_text(True)
+        # AVIF, JPEG XL or WebP, depending on what the budget search picked
+        image = encoder.decode_image(rx_data)
+        self.update_rx_error_text(image is None)
 
         if image is not None:
             self.rx_image = image
             self.update_rx_image(self.rx_image)
 
+    def process_rx_image(self, image):
+        # already decoded by the modem worker, e.g. a progressive image in progress
+        self.rx_image = image
+        self.update_rx_image(self.rx_image)
+        self.update_rx_error_text(False)
+
     def transmit_image(self):
         if self.modem is not None:
             if not self.modem_transmitting:
-                self.modem.transmit_image(self.tx_image)
+                self.modem.transmit_image(self.encode_tx_image())
             else:
-                self.modem.modem.halt_tx()
+                self.modem.halt_tx()
+
+    def set_progressive(self, enabled):
+        self.progressive = enabled
+        self.encode_tx_image()
+
+    def set_budget_unit(self, index):
+        self.budget_unit = index
+        self.encode_tx_image()
+
+    def set_budget_value(self):
+        if self.budget_input.value() != self.budget_value:
+            self.budget_value = self.budget_input.value()
+            self.encode_tx_image()
 
     def set_tx_volume(self, vol):
         self.tx_volume = vol
         self.volume_label.setText(f'TX volume: {vol}')
 
+    def update_rx_level(self):
+        level = self.modem.get_audio_level() if self.modem is not None else None
+
+        if level is not None:
+            self.rx_level_bar.setValue(max(-60, int(20 * math.log10(max(level, 1e-6)))))
+
     def closeEvent(self, event):
         if self.modem:
             self.modem.stop()
 
+        self.encoder.close()
         time.sleep(1)
 
 
 if __name__ == '__main__':
-    app = QApplication([])
+    # the modem process is started with spawn, which needs this in a frozen build
+    multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser(description='FreeTV')
+    parser.add_argument('--daemon', help='URL of a running modem daemon, e.g. http://127.0.0.1:8073')
+    parser.add_argument('--in-process', action='store_true', help='run the modem in the GUI process')
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication([sys.argv[0]] + qt_args)
 
-    window = MainWindow()
+    window = MainWindow(args.daemon, args.in_process)
     window.show()
 
     app.exec()
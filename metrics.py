@@ -0,0 +1,124 @@
+from bisect import bisect_right
+import json
+import threading
+import time
+
+# bucket upper bounds, in seconds, for timing histograms (50 us to 1 s)
+TIME_BUCKETS = (50e-6, 100e-6, 250e-6, 500e-6, 1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 50e-3, 100e-3, 250e-3, 1.0)
+
+# bucket upper bounds for buffer fill fractions
+FILL_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0)
+
+
+class Histogram:
+    # fixed bucket histogram, recording is a bisect and a few adds
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect_right(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        buckets = {str(bound): count for bound, count in zip(self.bounds, self.counts)}
+        buckets['inf'] = self.counts[-1]
+
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'buckets': buckets,
+        }
+
+
+class Metrics:
+    """
+
+    Counters, gauges and histograms for the modem hot path. Updates are plain dict / int operations,
+    cheap enough for the audio callback. Sources are functions pulled only when a snapshot is taken.
+
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.sources = {}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def histogram(self, name, bounds=TIME_BUCKETS):
+        histogram = self.histograms.get(name)
+
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(bounds)
+
+        return histogram
+
+    def record(self, name, value, bounds=TIME_BUCKETS):
+        self.histogram(name, bounds).record(value)
+
+    def add_source(self, name, func):
+        self.sources[name] = func
+
+    def snapshot(self):
+        return {
+            'time': time.time(),
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'histograms': {name: histogram.snapshot() for name, histogram in list(self.histograms.items())},
+            'sources': {name: func() for name, func in list(self.sources.items())},
+        }
+
+    def dump(self, format='json'):
+        snapshot = self.snapshot()
+
+        if format == 'json':
+            return json.dumps(snapshot, indent=2)
+
+        lines = []
+
+        for section in ('counters', 'gauges', 'sources'):
+            for name, value in snapshot[section].items():
+                lines.append(f'{name}: {value}')
+
+        for name, histogram in snapshot['histograms'].items():
+            lines.append(f'{name}: count={histogram["count"]} mean={histogram["mean"]:.6g} max={histogram["max"]:.6g}')
+
+        return '\n'.join(lines)
+
+
+class MetricsDumper(threading.Thread):
+    # periodically writes a metrics dump to filename (or prints it if filename is None)
+    def __init__(self, metrics, interval=10.0, filename=None, format='json'):
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.interval = interval
+        self.filename = filename
+        self.format = format
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            text = self.metrics.dump(self.format)
+
+            if self.filename is None:
+                print(text)
+            else:
+                with open(self.filename, 'w') as f:
+                    f.write(text)
+
+    def stop(self):
+        self.stopped.set()
@@ -1,25 +1,71 @@
 import numpy as np
 import freedv
-import pyaudio
+import adaptive
+import audio
+import fec
+import metrics
+import reassembly
+from audio import list_audio_devices
 import math
+import os
 import time
+import zlib
+from threading import Event
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 
-def list_audio_devices():
-    p = pyaudio.PyAudio()
-    input_devices = {}
-    output_devices = {}
+class TxOutputStage:
+    """
+    Vectorized output stage for the audio callback: gain, saturation, optional soft limiter and
+    fade in / out ramps at burst edges. Works on preallocated arrays so the callback doesn't allocate.
+    """
+
+    def __init__(self, frames_per_buffer, ramp_samples=32, limiter_threshold=0.8):
+        self.work = np.zeros(frames_per_buffer, dtype=np.float32)
+        self.out = np.zeros(frames_per_buffer, dtype=np.int16)
+        self.ramp_up = np.linspace(0, 1, ramp_samples, dtype=np.float32)
+        self.ramp_down = self.ramp_up[::-1].copy()
+
+        self.limiter = False
+        self.limiter_threshold = limiter_threshold * 32767
+
+    def resize(self, frame_count):
+        self.work = np.zeros(frame_count, dtype=np.float32)
+        self.out = np.zeros(frame_count, dtype=np.int16)
+
+    def process(self, samples, frame_count, volume, fade_in=False, fade_out=False):
+        if frame_count > len(self.out):
+            self.resize(frame_count)
+
+        num_samples = len(samples)
+        work = self.work[:frame_count]
+        work[num_samples:] = 0
+        np.multiply(samples, volume, out=work[:num_samples])
 
-    for i in range(p.get_device_count()):
-        device = p.get_device_info_by_index(i)
+        if self.limiter:
+            # soft knee: samples above the threshold are squashed with tanh towards full scale
+            magnitude = np.abs(work)
+            over = magnitude > self.limiter_threshold
 
-        if device['maxInputChannels'] == 0 and device['hostApi'] == 0:
-            output_devices[str(i)] = device['name']
+            if over.any():
+                headroom = 32767 - self.limiter_threshold
+                squashed = self.limiter_threshold + headroom * np.tanh((magnitude[over] - self.limiter_threshold) / headroom)
+                work[over] = np.copysign(squashed, work[over])
 
-        elif device['maxOutputChannels'] == 0 and device['hostApi'] == 0:
-            input_devices[str(i)] = device['name']
+        ramp_len = min(len(self.ramp_up), num_samples)
 
-    return input_devices, output_devices
+        if fade_in:
+            work[:ramp_len] *= self.ramp_up[:ramp_len]
+
+        if fade_out:
+            work[num_samples - ramp_len:num_samples] *= self.ramp_down[len(self.ramp_down) - ramp_len:]
+
+        np.clip(work, -32768, 32767, out=work)
+
+        out = self.out[:frame_count]
+        np.copyto(out, work, casting='unsafe')
+        return out
 
 
 class Modem:
@@ -34,18 +80,47 @@ class Modem:
     forward_mode = freedv.MODE_DATAC1
     arq_mode = freedv.MODE_DATAC13
 
-    def __init__(self, in_device, out_device):
+    # modes data may be sent in, fastest first. All of them are demodulated, so the receiver follows whichever is used
+    forward_modes = [freedv.MODE_DATAC1, freedv.MODE_DATAC3, freedv.MODE_DATAC4]
+
+    # default data frames per burst. Each burst pays for one preamble, postamble and gap, so longer
+    # bursts save airtime; run benchmark.py's burst airtime report to see the trade off for each mode.
+    # A fade mid burst only costs the frames it hits, since every frame has its own crc.
+    # The demodulator has to be told the burst length: it doesn't notice a burst ending early, and misses
+    # the next preamble. So both stations must use the same frames per burst, and every burst is sent full.
+    default_frames_per_burst = {
+        freedv.MODE_DATAC1: 4,
+        freedv.MODE_DATAC3: 8,
+        freedv.MODE_DATAC4: 8,
+        freedv.MODE_DATAC13: 1,
+    }
+
+    sample_rate = 8000
+    tx_buffer_seconds = 10  # how far ahead of the audio callback tx modulation may run
+
+    def __init__(self, in_device, out_device, backend=None):
         self.audio_frames_per_buffer = 256
 
-        self.p = pyaudio.PyAudio()
-        self.pastream = self.p.open(rate=8000, channels=1, format=pyaudio.paInt16,
-                                    frames_per_buffer=self.audio_frames_per_buffer,
-                                    input=True, output=True,
-                                    input_device_index=in_device, output_device_index=out_device,
-                                    stream_callback=self.pa_callback)
+        if backend is None:
+            backend = audio.PyAudioBackend(in_device, out_device)
+
+        self.backend = backend
+        self.clock = backend.clock
+
+        self.rx_modes = self.forward_modes + [self.arq_mode]
+
+        # separate modulators, so modulating never disturbs the demodulators' state
+        self.frames_per_burst = {mode: self.default_frames_per_burst.get(mode, 1) for mode in self.rx_modes}
+        self.rx_freedvs = {mode: freedv.FreeDVData(mode) for mode in self.rx_modes}
 
-        self.forward_freedv = freedv.FreeDVData(self.forward_mode)
-        self.arq_freedv = freedv.FreeDVData(self.arq_mode)
+        for mode, rx_freedv in self.rx_freedvs.items():
+            rx_freedv.set_frames_per_burst(self.frames_per_burst[mode])
+
+        # a modulator is only opened once something is sent in its mode
+        self.tx_freedvs = freedv.FreeDVSet(self.rx_modes, self.setup_tx_freedv)
+
+        self.forward_freedv = self.rx_freedvs[self.forward_mode]
+        self.arq_freedv = self.rx_freedvs[self.arq_mode]
 
         self.rx_state = 0
         self.is_transmitting = False
@@ -53,124 +128,422 @@ class Modem:
 
         self.forward_bytes_per_frame = freedv.get_payload_bytes_from_mode(self.forward_mode)
         self.arq_bytes_per_frame = freedv.get_payload_bytes_from_mode(self.arq_mode)
+        self.bytes_per_frame = {mode: freedv.get_payload_bytes_from_mode(mode) for mode in self.rx_modes}
+
+        self.tx_audio_buffer = freedv.audio_buffer(self.sample_rate * self.tx_buffer_seconds)
+
+        # every rx mode gets its own copy of the incoming audio, since each demodulator consumes it at its own nin
+        self.rx_audio_buffers = {}
+        self.rx_samples = {}
+        self.rx_states = {}
+        self.rx_sync_time = {}
+
+        for mode in self.rx_modes:
+            rx_freedv = self.get_freedv(mode)
+            self.rx_audio_buffers[mode] = freedv.audio_buffer(self.audio_frames_per_buffer * 5000)
+            # scratch space for reads that wrap around the end of the rx ring
+            self.rx_samples[mode] = np.zeros(rx_freedv.get_n_max_modem_samples(), dtype=np.int16)
+            self.rx_states[mode] = 0
+            self.rx_sync_time[mode] = None
+
+        # set by pa_callback once a full nin chunk is waiting, so the rx path can block instead of spinning
+        self.rx_event = Event()
 
-        self.rx_audio_buffer = freedv.audio_buffer(self.audio_frames_per_buffer * 5000)
-        self.tx_audio_buffer = freedv.audio_buffer(self.audio_frames_per_buffer * 5000)
+        # the demodulators spend their time in C code, which releases the GIL, so they can run side by side
+        self.rx_pool = ThreadPoolExecutor(max_workers=len(self.rx_modes))
 
         self.halted_tx = False
+        # set by halt_tx, the callback then drops what is queued: it is the tx buffer's only consumer
+        self.flush_tx = False
         self.tx_volume = 1.0
+        self.tx_burst_start = False
+        self.tx_output = TxOutputStage(self.audio_frames_per_buffer)
+        self.tx_samples = np.zeros(self.audio_frames_per_buffer, dtype=np.int16)
+
+        # tx is streamed: frames are modulated just ahead of pa_callback, which sets tx_space after every pop
+        self.tx_space = Event()
+        self.tx_streaming = False
+
+        self.metrics = metrics.Metrics()
+        self.metrics.add_source('tx_buffer_fill', lambda: self.tx_audio_buffer.nbuffer / self.tx_audio_buffer.size)
+
+        for mode in self.rx_modes:
+            self.metrics.add_source(f'rx_buffer_fill_{mode}',
+                                    lambda mode=mode: self.rx_audio_buffers[mode].nbuffer / self.rx_audio_buffers[mode].size)
+            self.metrics.add_source(f'freedv_{mode}', self.get_freedv(mode).get_stats)
+
+        self.callback_time = self.metrics.histogram('callback_time_s')
+
+        # optional audio_buffer that gets a copy of the received audio, e.g. for a level meter. Skipped while full
+        self.audio_monitor = None
+
+        # start audio last, so the callback never sees a half built modem
+        self.backend.start(self.pa_callback, self.sample_rate, self.audio_frames_per_buffer)
 
     def pa_callback(self, in_data, frame_count, time_info, status):
+        callback_start = time.perf_counter()
+        out_data = None
+
+        if self.flush_tx:
+            self.flush_tx = False
+            self.tx_audio_buffer.pop(self.tx_audio_buffer.nbuffer)
+            self.tx_space.set()
+
         if not self.is_transmitting:
             samples_int16 = np.frombuffer(in_data, dtype=np.int16)
-            self.rx_audio_buffer.push(samples_int16)
+
+            for mode in self.rx_modes:
+                rx_audio_buffer = self.rx_audio_buffers[mode]
+
+                if rx_audio_buffer.free() >= len(samples_int16):
+                    rx_audio_buffer.push(samples_int16)
+                else:
+                    # that demodulator fell a whole buffer behind, it loses the block instead of the stream stopping
+                    self.metrics.count(f'rx_overruns_{mode}')
+
+            if self.audio_monitor is not None and self.audio_monitor.free() >= len(samples_int16):
+                self.audio_monitor.push(samples_int16)
+
+            if self.rx_available():
+                self.rx_event.set()
 
         else:
-            if self.tx_audio_buffer.nbuffer > frame_count:
-                tx_samples = self.tx_audio_buffer.buffer[:frame_count]
-                self.tx_audio_buffer.pop(frame_count)
+            available = self.tx_audio_buffer.nbuffer
+
+            if available > 0:
+                num_samples = min(available, frame_count)
 
-                for i in range(len(tx_samples)):
-                    tx_samples[i] = int(tx_samples[i] * self.tx_volume)
+                if num_samples > len(self.tx_samples):
+                    self.tx_samples = np.zeros(num_samples, dtype=np.int16)
 
-                return tx_samples, pyaudio.paContinue
+                tx_samples = self.tx_audio_buffer.get(num_samples, out=self.tx_samples)
+                # only fade out at the real end: a streamed transmission may just be waiting for its next chunk
+                fade_out = num_samples == available and not self.tx_streaming
+                out_data = self.tx_output.process(tx_samples, frame_count, self.tx_volume,
+                                                  fade_in=self.tx_burst_start, fade_out=fade_out)
+                self.tx_audio_buffer.pop(num_samples)
+                self.tx_space.set()
+                self.tx_burst_start = False
+
+            elif self.tx_streaming:
+                # modulation fell behind, send silence but stay keyed
+                self.metrics.count('tx_underruns')
 
             else:
                 self.is_transmitting = False
 
-        # just generate silence
-        silence_samples = b'\x00' * (frame_count * 2)
-        return silence_samples, pyaudio.paContinue
+        if out_data is None:
+            # just generate silence
+            out_data = b'\x00' * (frame_count * 2)
+
+        self.callback_time.record(time.perf_counter() - callback_start)
+
+        return out_data, audio.CONTINUE
+
+    def setup_tx_freedv(self, mode, tx_freedv):
+        tx_freedv.set_frames_per_burst(self.frames_per_burst[mode])
+
+    def get_callback_headroom(self):
+        # fraction of the callback period left over in the worst callback seen so far
+        callback_period = self.audio_frames_per_buffer / self.sample_rate
+        return 1 - self.callback_time.max / callback_period
 
     def set_mode(self, mode):
+        # only selects the tx mode, rx always listens on every mode in rx_modes
         self.freedv_mode = mode
 
-    def tx(self, data):
-        self.is_transmitting = True
+    def get_freedv(self, mode):
+        return self.rx_freedvs.get(mode)
 
-        tx_freedv = None
-        if self.freedv_mode == self.forward_mode:
-            tx_freedv = self.forward_freedv
-        elif self.freedv_mode == self.arq_mode:
-            tx_freedv = self.arq_freedv
+    def push_tx_samples(self, samples):
+        # blocks until the tx buffer has room, so memory stays bounded whatever the payload size
+        assert len(samples) <= self.tx_audio_buffer.size
 
+        # a flush halt_tx asked for is still pending, it would take these samples with it
+        while self.flush_tx or self.tx_audio_buffer.free() < len(samples):
+            if self.halted_tx:
+                return False
+
+            self.tx_space.wait(0.1)
+            self.tx_space.clear()
+
+        if self.halted_tx:
+            return False
+
+        self.tx_audio_buffer.push(samples)
+
+        # key up as soon as the first chunk is ready
+        if not self.is_transmitting:
+            self.tx_burst_start = True
+            self.is_transmitting = True
+
+        return True
+
+    def tx_stream(self, bursts):
+        """
+        Modulate and queue an iterable of bursts just in time. Returns once the last chunk is queued,
+        use wait_for_tx to wait for it to be played.
+        """
+        tx_freedv = self.tx_freedvs.get(self.freedv_mode)
         assert tx_freedv is not None
 
-        tx_samples = tx_freedv.tx_burst(data)
-        self.tx_audio_buffer.push(np.frombuffer(tx_samples, dtype=np.int16))
+        self.tx_streaming = True
+
+        try:
+            for data in bursts:
+                for chunk in tx_freedv.tx_burst_chunks(data):
+                    if not self.push_tx_samples(chunk):
+                        return False
+
+        finally:
+            self.tx_streaming = False
+
+        return True
+
+    def tx(self, data):
+        return self.tx_stream([data])
+
+    def tx_frames(self, frames):
+        # group whole modem frames into bursts of frames_per_burst. A short last burst is filled up with
+        # repeats of its own frames, which the receiver drops as duplicates
+        frames_per_burst = self.frames_per_burst[self.freedv_mode]
+        bursts = (b''.join((frames[i:i + frames_per_burst] * frames_per_burst)[:frames_per_burst])
+                  for i in range(0, len(frames), frames_per_burst))
+
+        return self.tx_stream(bursts)
+
+    def set_frames_per_burst(self, mode, num_frames):
+        # for sending and receiving, the station at the other end has to use the same
+        self.frames_per_burst[mode] = num_frames
+        self.rx_freedvs[mode].set_frames_per_burst(num_frames)
+
+        if mode in self.tx_freedvs.instances:
+            self.tx_freedvs[mode].set_frames_per_burst(num_frames)
+
+    def get_airtime(self, num_frames, mode):
+        # seconds needed to send num_frames in mode, every burst is sent full
+        frames_per_burst = self.frames_per_burst[mode]
+        num_bursts = math.ceil(num_frames / frames_per_burst)
+
+        return num_bursts * self.rx_freedvs[mode].get_burst_samples(frames_per_burst) / self.sample_rate
+
+    def rx_available(self, mode=None):
+        modes = self.rx_modes if mode is None else [mode]
+
+        for mode in modes:
+            if self.rx_audio_buffers[mode].nbuffer >= self.get_freedv(mode).nin:
+                return True
 
-    def rx(self):
-        rx_freedv = None
-        if self.freedv_mode == self.forward_mode:
-            rx_freedv = self.forward_freedv
-        elif self.freedv_mode == self.arq_mode:
-            rx_freedv = self.arq_freedv
+        return False
 
+    def wait_for_rx(self, timeout=None):
+        # block until pa_callback signals at least one full nin chunk (or timeout)
+        if self.rx_available():
+            return True
+
+        self.rx_event.wait(timeout)
+        self.rx_event.clear()
+        return self.rx_available()
+
+    def rx_clock(self, mode):
+        # when the audio that mode's demodulator is at was heard: clock() less the backlog it still has to do.
+        # Times stamped with it don't drift when demodulation falls behind
+        return self.clock() - self.rx_audio_buffers[mode].nbuffer / self.sample_rate
+
+    def rx(self, mode=None):
+        # demodulate a single nin chunk of one mode
+        if mode is None:
+            mode = self.freedv_mode
+
+        rx_freedv = self.get_freedv(mode)
         assert rx_freedv is not None
 
+        rx_audio_buffer = self.rx_audio_buffers[mode]
         nin = rx_freedv.nin
         rx_bytes = None
 
-        if self.rx_audio_buffer.nbuffer >= nin:
-            rx_samples = self.rx_audio_buffer.buffer[:nin]
-            self.rx_audio_buffer.pop(nin)
+        if rx_audio_buffer.nbuffer >= nin:
+            rx_samples = rx_audio_buffer.get(nin, out=self.rx_samples[mode])
+
+            demod_start = time.perf_counter()
+            rx_state, rx_bytes = rx_freedv.rx(rx_samples)
+            self.metrics.record(f'demod_time_s_{mode}', time.perf_counter() - demod_start)
 
-            self.rx_state, rx_bytes = rx_freedv.rx(rx_samples.tobytes())
+            rx_audio_buffer.pop(nin)
+
+            if rx_state != self.rx_states[mode]:
+                self.metrics.count(f'rx_status_transitions_{mode}')
+
+            self.rx_states[mode] = rx_state
+
+            if rx_state != 0:
+                self.rx_sync_time[mode] = self.rx_clock(mode)
+
+            if mode in self.forward_modes:
+                self.rx_state = rx_state
 
         if rx_bytes:
             return rx_bytes[:-2]
 
+    def rx_mode(self, mode):
+        # demodulate every complete nin chunk of one mode, so rx catches up after a stall
+        frames = []
+        rx_audio_buffer = self.rx_audio_buffers[mode]
+        self.metrics.record(f'rx_buffer_fill_{mode}', rx_audio_buffer.nbuffer / rx_audio_buffer.size,
+                            metrics.FILL_BUCKETS)
+
+        while self.rx_available(mode):
+            rx_bytes = self.rx(mode)
+
+            if rx_bytes is not None:
+                frames.append((mode, rx_bytes))
+
+        return frames
+
+    def rx_all(self):
+        """
+        Fan the buffered audio out to every rx mode's demodulator in parallel.
+        Returns a list of (mode, frame) tuples.
+        """
+        futures = [self.rx_pool.submit(self.rx_mode, mode) for mode in self.rx_modes if self.rx_available(mode)]
+        frames = []
+
+        for future in futures:
+            frames.extend(future.result())
+
+        return frames
+
     def set_tx_volume(self, vol):
         self.tx_volume = vol / 100
 
+    def set_tx_limiter(self, enabled):
+        self.tx_output.limiter = enabled
+
     def halt_tx(self):
         self.halted_tx = True
-        self.tx_audio_buffer.pop(self.tx_audio_buffer.nbuffer)
+        self.flush_tx = True
 
     def close(self):
         self.halt_tx()
-        self.forward_freedv.close()
-        self.arq_freedv.close()
-        self.pastream.close()
-        self.p.terminate()
+        self.rx_pool.shutdown()
+        for rx_freedv in self.rx_freedvs.values():
+            rx_freedv.close()
+
+        for tx_freedv in self.tx_freedvs.values():
+            tx_freedv.close()
+        self.backend.close()
+
+
+def encode_varint(value):
+    # LEB128: 7 bits per byte, low bits first, the top bit says another byte follows
+    data = bytearray()
+
+    while value >= 0x80:
+        data.append(value & 0x7f | 0x80)
+        value >>= 7
+
+    data.append(value)
+    return bytes(data)
+
+
+def decode_varint(data, offset):
+    # returns the value and the offset just past it
+    value = 0
+    shift = 0
+
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+
+        if not byte & 0x80:
+            return value, offset
+
+
+def make_is_available(available, chunk_size, offset):
+    # is_available(start, end) for data that starts offset bytes into chunks of chunk_size, available per chunk
+    def is_available(start, end):
+        start += offset
+        end += offset
+        chunks = available[start // chunk_size:(end - 1) // chunk_size + 1]
+        return end <= len(available) * chunk_size and bool(chunks.all())
+
+    return is_available
 
 
 class ArqModem(Modem):
-    callsign_bytes = 10
-    tx_id_bytes = 1
-    frame_id_bytes = 1
-    frame_num_bytes = 1
+    # frame header: a byte holding the header version and frame kind, a 2 byte session id (a hash of the
+    # callsign and a nonce picked at startup, then the tx_id), the frame id and number of frames as varints,
+    # then the fec group size and parity frames. The callsign isn't repeated in every frame: it leads the data
+    # (a length byte, then the callsign), so it only takes room in the first data frame.
+    header_version = 1
+    kind_data = 0
+    kind_control = 1
+
+    version_bytes = 1
+    session_id_bytes = 2
+    fec_group_bytes = 1
+    fec_parity_bytes = 1
 
-    callsign_offset = 0
-    tx_id_offset = callsign_offset + callsign_bytes
-    frame_id_offset = tx_id_offset + tx_id_bytes
-    frame_num_offset = frame_id_offset + frame_id_bytes
-    payload_offset = frame_num_offset + frame_num_bytes
+    callsign_bytes = 10
+    max_frames = 16384
 
-    total_header_bytes = callsign_bytes + tx_id_bytes + frame_id_bytes + frame_num_bytes
+    # erasure coding: every fec_group_size data frames get fec_parity_frames parity frames,
+    # so any fec_group_size frames of a group rebuild it without a retransmit. 0 parity frames turns it off
+    fec_group_size = 32
+    fec_parity_frames = 3
 
-    retransmit_id_bytes = 1
-    retransmit_id_offset = callsign_offset + callsign_bytes
+    # a NACK is one burst of control frames, each carrying a run of missing frames: control_type, the version
+    # byte with the number of NACK frames left in the burst in its low bits, the session id, the first missing
+    # frame and the run length as varints, then as much of the callsign as fits. A run length of 0 acknowledges
+    # the whole transmission. Test frames share the mode and start with the callsign, control_type never
+    # appears in UTF-8 so no callsign can start with it.
+    control_type = 0xff
+    max_nack_frames = 16
 
     arq_wait_time = 15
     missed_frames_wait_time = 5
     retransmit_wait_time = 7
+    turnaround_time = 0.5
+
+    # longest the demodulator loses sync between two bursts of one transmission
+    burst_gap_time = 1.0
 
     retransmit_request_retries = 2
 
-    def __init__(self, in_device, out_device, callsign):
-        super().__init__(in_device, out_device)
+    def __init__(self, in_device, out_device, callsign, backend=None, spool=None):
+        super().__init__(in_device, out_device, backend)
         self.callsign = callsign
 
         self.frames = []
+        self.frames_session = None
         self.tx_id = 0
-        self.arq_callsign = None
 
-        self.rx_callsign = None
-        self.rx_num_frames = None
-        self.rx_id = None
-        self.rx_frames = {}
+        # a restarted station starts at tx_id 0 again, the nonce keeps its sessions apart from the ones the
+        # receiver still remembers from before the restart
+        self.session_nonce = os.urandom(4)
+        self.arq_callsign = None
+        self.nack_runs = []
+
+        # adaptive forward mode, driven by what the receiver's NACKs and the reverse link tell us
+        self.adaptive_mode = True
+        self.mode_selector = adaptive.ModeSelector(self.forward_modes, self.forward_mode)
+        self.frames_mode = self.forward_mode
+        self.tx_first_loss = None
+
+        # every transmission being received has its own session, rx_current is the one heard last.
+        # With a spool (spool.Spool) partial receptions from an earlier run are resumed
+        self.rx_table = reassembly.ReassemblyTable(self.split_callsign, on_complete=self.rx_session_complete,
+                                                   spool=spool, now=self.clock(), max_frames=self.max_frames)
+        self.rx_current = next(reversed(self.rx_table.sessions.values()), None)
+        self.rx_completed = deque()
+        self.rx_last_session = None
         self.last_rx_sync = None
+        self.auto_nack = True
+
+        self.metrics.add_source('rx_sessions', lambda: len(self.rx_table))
+        self.metrics.add_source('rx_session_bytes', lambda: self.rx_table.nbytes)
 
     def wait_for_tx(self):
         while self.is_transmitting:
@@ -181,209 +554,523 @@ class ArqModem(Modem):
         self.tx(self.callsign.encode() + b'TEST')
         self.wait_for_tx()
 
-    def arq_tx(self, data):
-        self.frames = []
+    @classmethod
+    def encode_callsign(cls, callsign):
+        return callsign.encode()[:cls.callsign_bytes]
+
+    @classmethod
+    def get_session_id(cls, callsign, tx_id, nonce=b''):
+        # short enough for every frame, and two stations (or two runs of one) sending the same tx_id rarely collide
+        return (zlib.crc32(cls.encode_callsign(callsign) + nonce) & 0xff) << 8 | tx_id
+
+    @classmethod
+    def get_version_byte(cls, kind, low_bits=0):
+        return cls.header_version << 5 | kind << 4 | low_bits
+
+    @classmethod
+    def get_header_bytes(cls, num_frames):
+        # every frame of a transmission gets room for the longest frame id, so all chunks are the same size
+        return cls.version_bytes + cls.session_id_bytes + 2 * len(encode_varint(num_frames)) + \
+            cls.fec_group_bytes + cls.fec_parity_bytes
+
+    @classmethod
+    def get_frame_count(cls, num_data, fec_group_size, fec_parity_frames):
+        return sum(data_count + parity_count
+                   for _, data_count, parity_count in fec.group_layout(num_data, fec_group_size, fec_parity_frames))
+
+    @classmethod
+    def build_frames(cls, data, callsign, tx_id, bytes_per_frame, fec_group_size=0, fec_parity_frames=0,
+                     nonce=b''):
+        # split data into frames of bytes_per_frame, each starting with the arq header, then add any parity frames
+        callsign = cls.encode_callsign(callsign)
+        data = bytes([len(callsign)]) + callsign + bytes(data)
+
+        if fec_parity_frames == 0:
+            fec_group_size = 0
+
+        # the header grows with the number of frames, which depends on the room left for data
+        header_bytes = cls.get_header_bytes(1)
+
+        while True:
+            chunk_size = bytes_per_frame - header_bytes
+            num_data_frames = math.ceil(len(data) / chunk_size)
+            num_frames = cls.get_frame_count(num_data_frames, fec_group_size, fec_parity_frames)
+
+            if cls.get_header_bytes(num_frames) <= header_bytes:
+                break
+
+            header_bytes = cls.get_header_bytes(num_frames)
+
+        if num_frames > cls.max_frames:
+            raise freedv.DataTooLarge
+
+        chunks = np.zeros((num_data_frames, chunk_size), dtype=np.uint8)
+        chunks.reshape(-1)[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+        chunks = fec.encode(chunks, fec_group_size, fec_parity_frames)
+
+        session = cls.get_session_id(callsign.decode(errors='replace'), tx_id, nonce)
+        frames = []
+
+        for frame_id, chunk in enumerate(chunks):
+            frame = bytearray([cls.get_version_byte(cls.kind_data)])
+            frame.extend(session.to_bytes(cls.session_id_bytes, 'big'))
+            frame.extend(encode_varint(frame_id))
+            frame.extend(encode_varint(num_frames))
+            frame.extend([fec_group_size, fec_parity_frames])
+            frame.extend(chunk.tobytes())
+
+            # frames with short frame ids have a byte or two to spare
+            frame.extend(bytes(bytes_per_frame - len(frame)))
+            frames.append(frame)
+
+        return frames
+
+    @classmethod
+    def get_payload_budget(cls, num_frames, bytes_per_frame, fec_group_size=0, fec_parity_frames=0):
+        # most payload bytes that build_frames fits in num_frames frames, parity frames and callsign included
+        num_data = min(num_frames, cls.max_frames)
+
+        while num_data > 0 and cls.get_frame_count(num_data, fec_group_size, fec_parity_frames) > num_frames:
+            num_data -= 1
+
+        chunk_size = bytes_per_frame - cls.get_header_bytes(num_frames)
+        return max(0, num_data * chunk_size - 1 - cls.callsign_bytes)
+
+    def get_max_payload(self):
+        # largest payload arq_tx accepts, it falls back to the fastest mode it may use
+        mode = self.get_tx_modes()[-1]
+        return self.get_payload_budget(self.max_frames, self.bytes_per_frame[mode],
+                                       self.fec_group_size, self.fec_parity_frames)
+
+    def get_frame_budget(self, seconds, mode=None):
+        # how many frames of mode go out in seconds of airtime
+        mode = self.forward_mode if mode is None else mode
+        num_frames = 0
+
+        while num_frames < self.max_frames and self.get_airtime(num_frames + 1, mode) <= seconds:
+            num_frames += 1
 
-        data_size = len(data)
-        payload_available_for_data = self.forward_bytes_per_frame - self.total_header_bytes
+        return num_frames
 
-        frame_id = 0
+    @classmethod
+    def parse_frame(cls, rx_bytes):
+        # returns session id, frame_id, num_frames, (fec group size, fec parity frames), payload,
+        # or None if rx_bytes isn't a data frame of this header version
+        if len(rx_bytes) < cls.get_header_bytes(1) or rx_bytes[0] != cls.get_version_byte(cls.kind_data):
+            return None
+
+        offset = cls.version_bytes
+        session = int.from_bytes(rx_bytes[offset:offset + cls.session_id_bytes], 'big')
+
+        try:
+            frame_id, offset = decode_varint(rx_bytes, offset + cls.session_id_bytes)
+            num_frames, offset = decode_varint(rx_bytes, offset)
+            fec_params = (rx_bytes[offset], rx_bytes[offset + 1])
+        except IndexError:
+            return None
+
+        offset += cls.fec_group_bytes + cls.fec_parity_bytes
+
+        # a corrupt header that passed the crc mustn't make the receiver allocate for it
+        if not 0 <= frame_id < num_frames <= cls.max_frames or (fec_params[1] and not fec_params[0]):
+            return None
 
-        callsign = self.callsign.encode()
+        chunk_size = len(rx_bytes) - cls.get_header_bytes(num_frames)
+        payload = rx_bytes[offset:offset + chunk_size]
 
-        if len(callsign) < self.callsign_bytes:
-            callsign += (b'\x00' * (self.callsign_bytes - len(callsign)))
+        return session, frame_id, num_frames, fec_params, payload
 
-        num_frames = math.ceil(data_size / payload_available_for_data)
+    @classmethod
+    def split_callsign(cls, data):
+        # the data of a transmission starts with the sender's callsign, returns callsign, data
+        callsign_length = data[0]
+        return bytes(data[1:1 + callsign_length]), data[1 + callsign_length:]
 
-        for i in range(0, data_size + 1, payload_available_for_data):
-            frame_data = bytearray(data[i:i + payload_available_for_data])
+    def get_tx_modes(self):
+        # modes to try for the next transmission, best first
+        if not self.adaptive_mode:
+            return [self.forward_mode]
 
-            if len(frame_data) != payload_available_for_data:
-                frame_data.extend(b'\x00' * (payload_available_for_data - len(frame_data)))
+        # the selector's choice, then faster modes, closest first: a step down mustn't lose data that doesn't fit
+        return self.mode_selector.modes[self.mode_selector.index::-1]
 
-            frame = bytearray(callsign + self.tx_id.to_bytes(1) + frame_id.to_bytes(1) + num_frames.to_bytes(1))
-            frame_id += 1
+    def build_tx_frames(self, data):
+        # returns the mode and frames for data, raises freedv.DataTooLarge if it doesn't fit any mode tried
+        modes = self.get_tx_modes()
 
-            frame.extend(frame_data)
-            self.frames.append(frame)
+        for mode in modes:
+            try:
+                frames = self.build_frames(data, self.callsign, self.tx_id, self.bytes_per_frame[mode],
+                                           self.fec_group_size, self.fec_parity_frames, self.session_nonce)
+            except freedv.DataTooLarge:
+                continue
 
-        self.set_mode(self.forward_mode)
+            if mode != modes[0]:
+                print(f'Payload too large for mode {modes[0]}, sending in mode {mode}')
+
+            return mode, frames
+
+        raise freedv.DataTooLarge
+
+    def arq_tx(self, data):
+        mode, self.frames = self.build_tx_frames(data)
+        bytes_per_frame = self.bytes_per_frame[mode]
+
+        self.frames_session = self.get_session_id(self.callsign, self.tx_id, self.session_nonce)
+        self.frames_mode = mode
+        self.nack_runs = []
+        self.tx_first_loss = None
+
+        self.set_mode(mode)
+        self.halted_tx = False
 
         for frame in self.frames:
-            assert len(frame) == self.forward_bytes_per_frame
-            self.tx(frame)
+            assert len(frame) == bytes_per_frame
+
+        airtime = self.get_airtime(len(self.frames), mode)
+        self.metrics.gauge('last_tx_airtime_s', airtime)
+        print(f'Transmitting {len(self.frames)} frames, about {airtime:.1f} s of airtime')
 
+        self.tx_frames(self.frames)
         self.wait_for_tx()
 
         if self.halted_tx:
             self.halted_tx = False
             return
 
+        arq_freedv = self.get_freedv(self.arq_mode)
+        total_bits = arq_freedv.get_total_bits()
+        total_bit_errors = arq_freedv.get_total_bit_errors()
+        wait_start = self.clock()
+
         self.arq_callsign = self.wait_for_arq()
 
+        if self.adaptive_mode:
+            self.update_mode_selector(total_bits, total_bit_errors, wait_start)
+
         self.tx_id += 1
 
         if self.tx_id > 255:
             self.tx_id = 0
 
-    def arq_retransmit_frame(self, frame_id):
-        self.set_mode(self.forward_mode)
-        self.tx(self.frames[frame_id])
+    def update_mode_selector(self, total_bits, total_bit_errors, wait_start):
+        # the NACK / ACK traffic on the reverse link tells us how the channel is doing
+        arq_freedv = self.get_freedv(self.arq_mode)
+        bits = arq_freedv.get_total_bits() - total_bits
+        bit_errors = arq_freedv.get_total_bit_errors() - total_bit_errors
+        ber = bit_errors / bits if bits > 0 else None
+
+        sync_time = self.rx_sync_time[self.arq_mode]
+        sync_ok = sync_time is not None and sync_time >= wait_start
+
+        if self.tx_first_loss is not None:
+            frame_loss = self.tx_first_loss
+        elif self.arq_callsign:
+            frame_loss = 0.0
+        else:
+            frame_loss = 1.0
+
+        old_mode = self.mode_selector.mode
+        new_mode = self.mode_selector.update(frame_loss, ber, sync_ok)
+        self.metrics.gauge('forward_mode', new_mode)
+
+        if new_mode != old_mode:
+            print(f'Link quality: frame loss {frame_loss:.2f}, ber {ber}, switching from mode {old_mode} to {new_mode}')
+            self.metrics.count('mode_changes')
 
+    def arq_retransmit_frames(self, frame_ids):
+        # all missing frames go out back to back in one transmission
+        frames = [self.frames[frame_id] for frame_id in frame_ids if frame_id < len(self.frames)]
+        print(f'Retransmitting {len(frames)} frames')
+        self.metrics.count('frames_retransmitted', len(frames))
+
+        if self.tx_first_loss is None and self.frames:
+            self.tx_first_loss = len(frames) / len(self.frames)
+
+        self.set_mode(self.frames_mode)
+        self.tx_frames(frames)
         self.wait_for_tx()
 
-    def wait_for_arq(self):
-        print('Waiting for ARQ retransmit request...')
+    @classmethod
+    def missing_to_runs(cls, missing, max_runs):
+        # turn a sorted list of frame ids into (start, length) runs, merging the smallest gaps until max_runs remain
+        runs = []
+
+        for frame_id in missing:
+            if runs and runs[-1][0] + runs[-1][1] == frame_id:
+                runs[-1][1] += 1
+            else:
+                runs.append([frame_id, 1])
+
+        while len(runs) > max_runs:
+            gaps = [runs[i + 1][0] - (runs[i][0] + runs[i][1]) for i in range(len(runs) - 1)]
+            i = gaps.index(min(gaps))
+            runs[i:i + 2] = [[runs[i][0], runs[i + 1][0] + runs[i + 1][1] - runs[i][0]]]
+
+        return [tuple(run) for run in runs]
+
+    def build_nack(self, session, missing):
+        callsign = self.encode_callsign(self.callsign)
+        runs = self.missing_to_runs(missing, self.max_nack_frames) if missing else [(0, 0)]
+        frames = []
+
+        for i, (start, count) in enumerate(runs):
+            frames_left = len(runs) - i - 1
+            frame = bytearray([self.control_type, self.get_version_byte(self.kind_control, frames_left)])
+            frame.extend(session.to_bytes(self.session_id_bytes, 'big'))
+            frame.extend(encode_varint(start))
+            frame.extend(encode_varint(count))
+
+            # the callsign fills whatever room is left
+            frame.extend(callsign[:self.arq_bytes_per_frame - len(frame)])
+            frame.extend(bytes(self.arq_bytes_per_frame - len(frame)))
+            frames.append(bytes(frame))
+
+        return frames
+
+    def is_nack(self, rx_bytes):
+        return len(rx_bytes) > 1 + self.version_bytes + self.session_id_bytes and \
+            rx_bytes[0] == self.control_type and rx_bytes[1] & 0xf0 == self.get_version_byte(self.kind_control)
+
+    def parse_nack(self, rx_bytes):
+        # returns callsign, session id, start, count, frames left in the burst
+        offset = 1 + self.version_bytes
+        session = int.from_bytes(rx_bytes[offset:offset + self.session_id_bytes], 'big')
+        start, offset = decode_varint(rx_bytes, offset + self.session_id_bytes)
+        count, offset = decode_varint(rx_bytes, offset)
+        callsign = bytes(rx_bytes[offset:]).rstrip(b'\x00')
+
+        return callsign, session, start, count, rx_bytes[1] & 0x0f
+
+    def tx_nack(self, session, missing):
+        frames = self.build_nack(session, missing)
+
+        if missing:
+            print(f'Sending NACK for {len(missing)} frames in {len(frames)} runs')
+            self.metrics.count('retransmit_requests_sent')
+        else:
+            print('Sending ACK')
+            self.metrics.count('acks_sent')
+
         self.set_mode(self.arq_mode)
-        start_time = time.time()
+        self.tx_frames(frames)
+        self.wait_for_tx()
+
+    def flush_nack(self):
+        # retransmit everything requested so far
+        frame_ids = [frame_id for start, count in self.nack_runs for frame_id in range(start, start + count)]
+        self.nack_runs = []
+        self.arq_retransmit_frames(frame_ids)
+
+    def handle_nack(self, rx_bytes):
+        # returns 'ack' when the receiver has everything, 'retransmitted' once a full NACK burst was served
+        callsign, session, start, count, frames_left = self.parse_nack(rx_bytes)
+
+        if session != self.frames_session:
+            return None
+
+        if count == 0:
+            print(f'ACK received from {callsign.decode(errors="replace")}')
+            self.metrics.count('acks_received')
+            return 'ack'
+
+        self.metrics.count('retransmit_requests_received')
+        self.nack_runs.append((start, count))
+
+        if frames_left == 0:
+            self.flush_nack()
+            return 'retransmitted'
+
+        return None
+
+    def wait_for_arq(self):
+        print('Waiting for ARQ NACK...')
+        start_time = self.clock()
+        callsign = False
 
         while True:
-            new_time = time.time()
+            remaining_time = self.arq_wait_time - (self.clock() - start_time)
+
+            if remaining_time <= 0:
+                if self.nack_runs:
+                    # the end of the NACK burst was lost, serve what we heard
+                    self.flush_nack()
+                    start_time = self.clock()
+                    continue
 
-            if new_time - start_time > self.arq_wait_time:
                 print('ARQ wait timed out')
-                return False
+                self.metrics.count('arq_wait_timeouts')
+                return callsign
 
-            rx_bytes = self.rx()
+            self.wait_for_rx(remaining_time)
 
-            if rx_bytes is not None:
-                callsign = rx_bytes[self.callsign_offset:self.retransmit_id_offset]
-                retransmit_id = rx_bytes[self.retransmit_id_offset]
-                print(f'ARQ retransmit request received by {callsign.decode()} for frame {retransmit_id}')
+            for mode, rx_bytes in self.rx_all():
+                if mode != self.arq_mode or not self.is_nack(rx_bytes):
+                    continue
 
-                self.arq_retransmit_frame(retransmit_id)
-                self.wait_for_arq()
-                return callsign
+                result = self.handle_nack(rx_bytes)
+                callsign = self.parse_nack(rx_bytes)[0]
 
-    def arq_rx(self):
-        self.set_mode(self.forward_mode)
-        rx_bytes = self.rx()
+                if result == 'ack':
+                    return callsign
 
-        if self.rx_state != 0:
-            self.last_rx_sync = time.time()
+                if result == 'retransmitted':
+                    # wait for the next NACK round
+                    start_time = self.clock()
 
-        if rx_bytes is not None:
-            callsign = rx_bytes[self.callsign_offset:self.tx_id_offset]
-            tx_id = rx_bytes[self.tx_id_offset:self.frame_id_offset]
-            frame_id = rx_bytes[self.frame_id_offset:self.frame_num_offset]
-            num_frames = rx_bytes[self.frame_num_offset:self.payload_offset]
-            payload = rx_bytes[self.payload_offset:]
+    def store_rx_frame(self, rx_bytes, mode=None):
+        if mode is None:
+            mode = self.forward_mode
 
-            tx_id = int.from_bytes(tx_id)
+        frame = self.parse_frame(rx_bytes)
 
-            if callsign != self.rx_callsign or tx_id != self.rx_id:
-                self.rx_frames = {}
+        if frame is None:
+            return
 
-            self.rx_frames[str(int.from_bytes(frame_id))] = payload
+        session_id, frame_id, num_frames, fec_params, payload = frame
+        session = self.rx_table.add_frame(session_id, mode, frame_id, num_frames, fec_params, payload,
+                                          self.rx_clock(mode))
 
-            self.rx_callsign = callsign
-            self.rx_id = tx_id
-            self.rx_num_frames = int.from_bytes(num_frames)
+        if session is not None:
+            self.rx_current = session
+            self.metrics.count('arq_frames_received')
 
-    def check_missed_frames(self):
-        if self.last_rx_sync is not None and self.rx_num_frames is not None:
-            if time.time() - self.last_rx_sync > self.missed_frames_wait_time:
-                missed_frames = []
+    def rx_session_complete(self, session, data):
+        self.rx_completed.append((session, data))
+        self.metrics.count('rx_sessions_completed')
 
-                for i in range(self.rx_num_frames):
-                    if str(i) not in self.rx_frames.keys():
-                        missed_frames.append(i)
+    def arq_rx(self, timeout=None):
+        if timeout is not None:
+            self.wait_for_rx(timeout)
 
-                return missed_frames
+        # every mode is demodulated, so a NACK that arrives while receiving isn't lost
+        for mode, rx_bytes in self.rx_all():
+            if mode in self.forward_modes:
+                self.store_rx_frame(rx_bytes, mode)
+            elif mode == self.arq_mode and self.is_nack(rx_bytes):
+                self.handle_nack(rx_bytes)
 
-            return False
+        sync_times = [self.rx_sync_time[mode] for mode in self.forward_modes if self.rx_sync_time[mode] is not None]
 
-    def wait_for_retransmit(self):
-        print('Waiting for station to retransmit frame...')
-        self.set_mode(self.forward_mode)
-        start_time = time.time()
+        if sync_times:
+            self.last_rx_sync = max(sync_times)
 
-        while True:
-            new_time = time.time()
+        if self.auto_nack:
+            self.check_auto_nack()
 
-            if new_time - start_time > self.retransmit_wait_time:
-                return False
+    def get_missing_frames(self, session=None):
+        session = self.rx_current if session is None else session
 
-            rx_bytes = self.rx()
+        if session is None:
+            return None
 
-            if rx_bytes is not None:
-                callsign = rx_bytes[self.callsign_offset:self.tx_id_offset]
-                tx_id = rx_bytes[self.tx_id_offset:self.frame_id_offset]
-                frame_id = rx_bytes[self.frame_id_offset:self.frame_num_offset]
-                num_frames = rx_bytes[self.frame_num_offset:self.payload_offset]
-                payload = rx_bytes[self.payload_offset:]
+        return session.get_missing_frames()
 
-                tx_id = int.from_bytes(tx_id)
+    def rx_hearing_sender(self, session):
+        # the sender of session is still on the air: a frame came in just now, or its mode had sync lately.
+        # With one frame per burst frames come a whole burst apart, so a demodulator stuck in sync holds
+        # things up for a burst's airtime and a burst gap without a frame at most
+        now = self.rx_clock(session.mode)
 
-                if callsign != self.rx_callsign or tx_id != self.rx_id:
-                    self.rx_frames = {}
+        if now - session.last_frame_time < self.turnaround_time:
+            return True
 
-                self.rx_frames[str(int.from_bytes(frame_id))] = payload
-                print(self.rx_frames)
+        sync_time = self.rx_sync_time[session.mode]
 
-                self.rx_callsign = callsign
-                self.rx_id = tx_id
-                self.rx_num_frames = int.from_bytes(num_frames)
+        if sync_time is None or now - sync_time > self.burst_gap_time:
+            return False
 
-                return True
+        burst_time = self.get_airtime(self.frames_per_burst[session.mode], session.mode)
+        return now - session.last_frame_time < burst_time + self.burst_gap_time
 
-    def tx_retransmit_request(self):
-        missed_frames = self.check_missed_frames()
+    def rx_transmission_ended(self, session):
+        # the last frame was heard, or the channel went quiet, and the other station has had time to unkey.
+        # Short bursts are filled up with repeats, so the last frame isn't always the end of the transmission
+        now = self.clock()
 
-        if isinstance(missed_frames, list):
-            callsign = self.callsign.encode()
+        if self.rx_hearing_sender(session):
+            return False
 
-            if len(callsign) < self.callsign_bytes:
-                callsign += (b'\x00' * (self.callsign_bytes - len(callsign)))
+        if session.last_nack_time is not None and now - session.last_nack_time > self.retransmit_wait_time:
+            return True
 
-            for frame_id in missed_frames:
-                retransmit_success = False
+        if session.end_seen:
+            return True
 
-                for attempt_num in range(self.retransmit_request_retries):
-                    print(f'Sending retransmit request for frame {frame_id} (attempt {attempt_num + 1})')
-                    self.set_mode(self.arq_mode)
+        return self.last_rx_sync is not None and now - self.last_rx_sync > self.missed_frames_wait_time and \
+            (session.last_nack_time is None or self.last_rx_sync > session.last_nack_time)
 
-                    arq_frame = callsign + frame_id.to_bytes(1)
-                    self.tx(arq_frame)
+    def check_auto_nack(self):
+        for session in self.rx_table.active():
+            if session.complete:
+                # erasure coding can complete a session before its last frames are sent, and the sender only
+                # hears the ACK once it has stopped transmitting. The data is already waiting in rx_completed
+                if not self.rx_hearing_sender(session):
+                    self.tx_nack(session.session_id, [])
+                    session.acked = True
 
-                    self.wait_for_tx()
+            elif session.nack_rounds < self.retransmit_request_retries + 1 and self.rx_transmission_ended(session):
+                self.tx_nack(session.session_id, session.get_missing_frames())
+                session.nack_rounds += 1
+                session.last_nack_time = self.clock()
+                session.end_seen = False
 
-                    if self.halted_tx:
-                        self.halted_tx = False
-                        return False
+    def check_missed_frames(self):
+        if self.rx_current is not None and not self.rx_current.complete:
+            # no sync since startup means the session was resumed from the spool
+            if self.last_rx_sync is None or self.clock() - self.last_rx_sync > self.missed_frames_wait_time:
+                return self.get_missing_frames()
 
-                    retransmit_success = self.wait_for_retransmit()
-                    if retransmit_success:
-                        break
+            return False
 
-                if not retransmit_success:
-                    return False
+    def tx_retransmit_request(self):
+        # manual NACK for every missing frame of the current session, the retransmitted frames are picked up by arq_rx
+        missed_frames = self.check_missed_frames()
 
-            missed_frames = self.check_missed_frames()
+        if isinstance(missed_frames, list):
+            session = self.rx_current
+            self.tx_nack(session.session_id, missed_frames)
+            session.nack_rounds += 1
+            session.last_nack_time = self.clock()
 
-            if missed_frames:
-                self.tx_retransmit_request()
+            if self.halted_tx:
+                self.halted_tx = False
+                return False
 
             return True
 
     def get_rx_data(self):
-        data = bytearray()
+        # the next completed transmission, its session is left in rx_last_session
+        if not self.rx_completed:
+            return None
 
-        if self.rx_num_frames is not None:
-            for i in range(self.rx_num_frames):
-                try:
-                    data.extend(self.rx_frames[str(i)])
-                except KeyError:
-                    return None
+        # a read only view of the reassembly buffer, not a copy
+        self.rx_last_session, data = self.rx_completed.popleft()
+        return data
 
-            self.rx_num_frames = None
-            self.rx_frames = {}
-            return data
+    def get_rx_partial(self, session=None):
+        """
+        Data received so far, before the transmission is complete. Returns the data with missing
+        chunks zeroed, and a function telling whether the byte range start:end of it was received.
+        """
+        session = self.rx_current if session is None else session
 
-        else:
+        if session is None or session.data is None:
+            return None
+
+        # the data buffer is filled in place, missing chunks are still zero
+        data = memoryview(session.data.reshape(-1)).toreadonly()
+        available = session.get_data_available()
+        chunk_size = session.chunk_size
+
+        # the data only starts after the callsign, which is in the first chunk
+        if not available[0]:
             return None
 
+        offset = 1 + data[0]
+        return data[offset:], make_is_available(available, chunk_size, offset)
+
     def get_rx_callsign(self):
-        if self.rx_callsign is not None:
-            return self.rx_callsign.decode()
+        # callsign of the transmission heard last, once its first frame is in
+        if self.rx_current is not None and self.rx_current.callsign is not None:
+            return self.rx_current.callsign.decode(errors='replace')
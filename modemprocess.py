@@ -0,0 +1,380 @@
+"""
+
+Runs the modem in a process of its own, so the audio callback and the demodulators never wait for the
+GUI's GIL. The two processes share ring buffers in shared memory: TX payloads go one way, and RX payloads
+and a copy of the received audio come back the other way. A pair of pipes carries the small stuff:
+commands and their replies one way, event headers the other way.
+
+ModemProcess has the same interface as daemon.ModemClient, so the GUI drives either one the same way.
+
+"""
+from multiprocessing import shared_memory
+from threading import Lock
+import multiprocessing
+import threading
+import queue
+import time
+import numpy as np
+import audio
+import daemon
+import freedv
+import spool
+from modem import ArqModem
+
+
+class SharedRing(freedv.audio_buffer):
+    """
+
+    audio_buffer in shared memory, for one producer and one consumer in different processes. The head and
+    tail counters sit in front of the samples in the same block; each is only written by its own side.
+    Pickling a ring (e.g. passing it to a Process) attaches to the same block on the other end.
+
+    There are no memory barriers: a side writes the samples, then moves its counter, and the other side
+    relies on seeing those stores in that order. x86 and x86-64 keep stores in program order for every
+    other core, so this holds there. Weakly ordered CPUs such as ARM don't promise it, and on those the
+    reader could see a new head before the samples behind it.
+
+    """
+
+    counter_bytes = 16
+
+    def __init__(self, size, dtype=np.int16, name=None):
+        dtype = np.dtype(dtype)
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner,
+                                              size=self.counter_bytes + size * dtype.itemsize)
+        self.size = size
+        self.counters = np.ndarray(2, dtype=np.int64, buffer=self.shm.buf)
+        self.buffer = np.ndarray(size, dtype=dtype, buffer=self.shm.buf, offset=self.counter_bytes)
+        self.mutex = Lock()
+
+        if self.owner:
+            self.counters[:] = 0
+
+    def __reduce__(self):
+        return SharedRing, (self.size, self.buffer.dtype.str, self.shm.name)
+
+    @property
+    def head(self):
+        return int(self.counters[0])
+
+    @head.setter
+    def head(self, value):
+        self.counters[0] = value
+
+    @property
+    def tail(self):
+        return int(self.counters[1])
+
+    @tail.setter
+    def tail(self, value):
+        self.counters[1] = value
+
+    def close(self):
+        # the views go first, shared memory can't be closed while they point into it
+        self.counters = None
+        self.buffer = None
+        self.shm.close()
+
+        if self.owner:
+            self.shm.unlink()
+
+
+poll_time = 0.002
+
+
+def write_bytes(ring, data, is_running):
+    # push data through a byte ring as the reader makes room, so payloads may be bigger than the ring
+    data = np.frombuffer(data, dtype=np.uint8)
+
+    while len(data):
+        num_bytes = min(ring.free(), len(data))
+
+        if num_bytes == 0:
+            if not is_running():
+                return False
+
+            time.sleep(poll_time)
+            continue
+
+        ring.push(data[:num_bytes])
+        data = data[num_bytes:]
+
+    return True
+
+
+def read_bytes(ring, length, is_running):
+    # the next length bytes from a byte ring, None if the writer went away first
+    data = bytearray(length)
+    view = np.frombuffer(data, dtype=np.uint8)
+    offset = 0
+
+    while offset < length:
+        num_bytes = min(ring.nbuffer, length - offset)
+
+        if num_bytes == 0:
+            if not is_running():
+                return None
+
+            time.sleep(poll_time)
+            continue
+
+        for chunk in ring.peek(num_bytes):
+            view[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+
+        ring.pop(num_bytes)
+
+    return bytes(data)
+
+
+def forward_events(service, event_conn, rx_ring):
+    # the service drops the oldest events if the GUI falls behind, so only this thread ever waits on it
+    events = service.subscribe()
+
+    while service.running:
+        try:
+            header, payload = events.get(timeout=service.rx_poll_time)
+        except queue.Empty:
+            continue
+
+        try:
+            event_conn.send(header)
+        except OSError:
+            return
+
+        write_bytes(rx_ring, payload, lambda: service.running)
+
+
+def handle_commands(service, control_conn, tx_ring):
+    while service.running:
+        try:
+            command, value = control_conn.recv()
+        except (EOFError, OSError):
+            # the GUI is gone
+            service.stop()
+            return
+
+        reply = None
+
+        if command == 'tx':
+            payload = read_bytes(tx_ring, value, lambda: service.running)
+
+            if payload is not None:
+                try:
+                    reply = service.submit(payload)
+                except freedv.DataTooLarge as e:
+                    # raised again on the GUI side by ModemProcess.command
+                    reply = e
+
+        elif command == 'retransmit':
+            service.request_retransmit()
+
+        elif command == 'test_frame':
+            service.request_test_frame()
+
+        elif command == 'halt':
+            service.halt()
+
+        elif command == 'volume':
+            service.set_volume(value)
+
+        elif command == 'frame_budget':
+            reply = service.get_frame_budget(value)
+
+        elif command == 'status':
+            reply = service.status
+
+        elif command == 'stop':
+            service.stop()
+
+        control_conn.send(reply)
+
+
+def run_modem(callsign, in_device, out_device, spool_dir, control_conn, event_conn, tx_ring, rx_ring, monitor_ring,
+              backend=None):
+    # entry point of the modem process, a plain module level function so it works with the spawn start method.
+    # The first message on control_conn says whether the modem came up
+    try:
+        arq_modem = ArqModem(in_device, out_device, callsign, backend=backend, spool=spool.Spool(spool_dir))
+    except Exception as e:
+        control_conn.send(('error', f'{type(e).__name__}: {e}'))
+
+        for ring in (tx_ring, rx_ring, monitor_ring):
+            ring.close()
+
+        return
+
+    arq_modem.audio_monitor = monitor_ring
+    control_conn.send(('ready', None))
+    service = daemon.ModemService(arq_modem)
+
+    threads = [threading.Thread(target=forward_events, args=(service, event_conn, rx_ring), daemon=True),
+               threading.Thread(target=handle_commands, args=(service, control_conn, tx_ring), daemon=True)]
+
+    for thread in threads:
+        thread.start()
+
+    try:
+        service.run()
+    finally:
+        service.stop()
+
+        for thread in threads:
+            thread.join(1)
+
+        # the rings can only be let go of once nothing uses them
+        if not any(thread.is_alive() for thread in threads):
+            tx_ring.close()
+            rx_ring.close()
+            monitor_ring.close()
+
+
+class ModemProcess:
+    """
+
+    Starts an ArqModem in a child process and talks to it. Same methods as daemon.ModemClient.
+    backend is passed on to the ArqModem, so it has to be picklable; by default the child opens the
+    audio devices itself. Raises RuntimeError if the modem doesn't come up in the child.
+
+    """
+
+    tx_ring_bytes = 1024 * 1024
+    rx_ring_bytes = 4 * 1024 * 1024
+    monitor_seconds = 2
+    command_timeout = 10
+    startup_timeout = 30
+    stop_timeout = 5
+
+    def __init__(self, callsign, in_device, out_device, spool_dir='spool', backend=None):
+        # spawn, never fork: the GUI process has Qt and audio state a forked child must not inherit
+        context = multiprocessing.get_context('spawn')
+
+        self.control_conn, child_control_conn = context.Pipe()
+        self.event_conn, child_event_conn = context.Pipe(duplex=False)
+        self.control_lock = threading.Lock()
+
+        self.tx_ring = SharedRing(self.tx_ring_bytes, np.uint8)
+        self.rx_ring = SharedRing(self.rx_ring_bytes, np.uint8)
+        self.monitor_ring = SharedRing(ArqModem.sample_rate * self.monitor_seconds)
+        self.rx_lock = threading.Lock()
+        self.closed = False
+
+        self.process = context.Process(target=run_modem, daemon=True,
+                                       args=(callsign, in_device, out_device, spool_dir, child_control_conn,
+                                             child_event_conn, self.tx_ring, self.rx_ring, self.monitor_ring,
+                                             backend))
+        self.process.start()
+
+        # the child has its own copies of these ends now
+        child_control_conn.close()
+        child_event_conn.close()
+
+        status, message = self.wait_for_startup()
+
+        if status != 'ready':
+            self.close()
+            raise RuntimeError(f'Modem process failed to start: {message}')
+
+    def wait_for_startup(self):
+        # the child's first message, or an error if it died or hangs before sending one
+        try:
+            if not self.control_conn.poll(self.startup_timeout):
+                return 'error', f'no answer in {self.startup_timeout} s'
+
+            return self.control_conn.recv()
+        except (EOFError, OSError):
+            self.process.join(self.stop_timeout)
+            return 'error', f'exited with code {self.process.exitcode}'
+
+    def command(self, command, value=None, payload=None):
+        with self.control_lock:
+            self.control_conn.send((command, value))
+
+            if payload is not None:
+                write_bytes(self.tx_ring, payload, self.process.is_alive)
+
+            if not self.control_conn.poll(self.command_timeout):
+                raise TimeoutError(f'Modem process did not answer {command}')
+
+            reply = self.control_conn.recv()
+
+        if isinstance(reply, Exception):
+            raise reply
+
+        return reply
+
+    def status(self):
+        return self.command('status')
+
+    def get_frame_budget(self, seconds):
+        return self.command('frame_budget', seconds)
+
+    def submit(self, payload):
+        payload = bytes(payload)
+        return self.command('tx', len(payload), payload)
+
+    def retransmit(self):
+        return self.command('retransmit')
+
+    def test_frame(self):
+        return self.command('test_frame')
+
+    def halt(self):
+        return self.command('halt')
+
+    def set_volume(self, volume):
+        return self.command('volume', volume)
+
+    def get_audio_level(self):
+        if self.closed:
+            return None
+
+        return audio.read_level(self.monitor_ring)
+
+    def events(self):
+        # yields (header, payload) like daemon.ModemClient.events, until the modem process ends
+        while True:
+            try:
+                if not self.event_conn.poll(daemon.ModemService.keepalive_time):
+                    yield {'type': 'keepalive', 'length': 0}, b''
+                    continue
+
+                header = self.event_conn.recv()
+            except (EOFError, OSError):
+                return
+
+            with self.rx_lock:
+                if self.closed:
+                    return
+
+                payload = read_bytes(self.rx_ring, header['length'], self.process.is_alive)
+
+            if payload is None:
+                return
+
+            yield header, payload
+
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self.command('stop')
+            except (OSError, EOFError, TimeoutError):
+                pass
+
+            self.process.join(self.stop_timeout)
+
+            if self.process.is_alive():
+                self.process.terminate()
+
+        with self.control_lock:
+            self.control_conn.close()
+            self.tx_ring.close()
+
+        # waits for an event still being read by the events() thread
+        with self.rx_lock:
+            self.closed = True
+            self.event_conn.close()
+            self.rx_ring.close()
+
+        self.monitor_ring.close()
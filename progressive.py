@@ -0,0 +1,154 @@
+"""
+
+Progressive image payloads: a small, low resolution base layer first, then full resolution tiles that
+each decode on their own. A table of contents at the start says where every segment lives, so the
+receiver can paint segments as soon as the frames that carry them arrive, instead of waiting for the
+whole image.
+
+Layout: magic, version, width, height, tile size, base scale, segment count, then one (kind, tile x,
+tile y, length) entry per segment, then the AVIF encoded segments back to back.
+
+"""
+import numpy as np
+import struct
+
+MAGIC = b'FTVP'
+VERSION = 1
+
+SEGMENT_BASE = 0
+SEGMENT_TILE = 1
+
+header_format = '>4sBHHHBH'
+header_bytes = struct.calcsize(header_format)
+toc_entry_format = '>BBBI'
+toc_entry_bytes = struct.calcsize(toc_entry_format)
+
+
+def encode(image, tile_size=125, base_scale=5, level=10):
+    # imported here, they are slow to load and only needed once there is an image to work on
+    import imagecodecs
+    import cv2
+
+    height, width = image.shape[:2]
+
+    base = cv2.resize(image, (max(1, width // base_scale), max(1, height // base_scale)),
+                      interpolation=cv2.INTER_AREA)
+    segments = [(SEGMENT_BASE, 0, 0, imagecodecs.avif_encode(base, level=level))]
+
+    for tile_y in range(0, (height + tile_size - 1) // tile_size):
+        for tile_x in range(0, (width + tile_size - 1) // tile_size):
+            tile = image[tile_y * tile_size:(tile_y + 1) * tile_size, tile_x * tile_size:(tile_x + 1) * tile_size]
+            segments.append((SEGMENT_TILE, tile_x, tile_y, imagecodecs.avif_encode(np.ascontiguousarray(tile),
+                                                                                   level=level)))
+
+    data = bytearray(struct.pack(header_format, MAGIC, VERSION, width, height, tile_size, base_scale, len(segments)))
+
+    for kind, tile_x, tile_y, segment in segments:
+        data += struct.pack(toc_entry_format, kind, tile_x, tile_y, len(segment))
+
+    for segment in segments:
+        data += segment[3]
+
+    return bytes(data)
+
+
+def is_progressive(data):
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+class ProgressiveDecoder:
+    """
+
+    Paints a progressive payload as it arrives. Call update with the payload received so far (missing
+    bytes can be anything) and a function telling whether a byte range has been received; it returns
+    the updated picture whenever a new segment could be decoded, otherwise None.
+
+    """
+
+    def __init__(self):
+        self.header = None
+        self.toc = None
+        self.base = None
+        self.tiles = {}
+        self.decoded = set()
+
+    def read_header(self, data, is_available):
+        if self.header is None:
+            if not is_available(0, header_bytes):
+                return False
+
+            magic, version, width, height, tile_size, base_scale, num_segments = \
+                struct.unpack_from(header_format, data)
+
+            if magic != MAGIC or version != VERSION:
+                return False
+
+            self.header = (width, height, tile_size, base_scale, num_segments)
+
+        if self.toc is None:
+            num_segments = self.header[4]
+            toc_end = header_bytes + num_segments * toc_entry_bytes
+
+            if not is_available(header_bytes, toc_end):
+                return False
+
+            self.toc = []
+            offset = toc_end
+
+            for i in range(num_segments):
+                kind, tile_x, tile_y, length = struct.unpack_from(toc_entry_format, data,
+                                                                  header_bytes + i * toc_entry_bytes)
+                self.toc.append((kind, tile_x, tile_y, offset, length))
+                offset += length
+
+        return True
+
+    def update(self, data, is_available):
+        import imagecodecs
+
+        if not self.read_header(data, is_available):
+            return None
+
+        new_segments = False
+
+        for i, (kind, tile_x, tile_y, offset, length) in enumerate(self.toc):
+            if i in self.decoded or not is_available(offset, offset + length):
+                continue
+
+            try:
+                pixels = imagecodecs.avif_decode(bytes(data[offset:offset + length]))
+            except imagecodecs.AvifError:
+                continue
+
+            if kind == SEGMENT_BASE:
+                self.base = pixels
+            else:
+                self.tiles[(tile_x, tile_y)] = pixels
+
+            self.decoded.add(i)
+            new_segments = True
+
+        if new_segments:
+            return self.compose()
+
+        return None
+
+    def is_complete(self):
+        return self.toc is not None and len(self.decoded) == len(self.toc)
+
+    def compose(self):
+        import cv2
+
+        width, height, tile_size, base_scale, num_segments = self.header
+
+        if self.base is not None:
+            canvas = cv2.resize(self.base, (width, height), interpolation=cv2.INTER_LINEAR)
+        else:
+            canvas = np.full((height, width, 3), 200, dtype=np.uint8)
+
+        for (tile_x, tile_y), tile in self.tiles.items():
+            y = tile_y * tile_size
+            x = tile_x * tile_size
+            canvas[y:y + tile.shape[0], x:x + tile.shape[1]] = tile[:, :, :3]
+
+        return np.ascontiguousarray(canvas)
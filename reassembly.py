@@ -0,0 +1,304 @@
+"""
+
+Reassembly of received transmissions. Frames are filed by session id (a hash of the sender's callsign
+and a nonce from the sender's startup, then its tx_id), so several stations can send at once, or
+interleave, without one stray frame throwing away another station's nearly complete transmission. Memory
+stays bounded: past max_bytes or max_sessions the least recently heard sessions are dropped, and sessions
+that went quiet for max_age seconds are dropped too. With a spool, session buffers are memory-mapped
+files, so partial receptions survive a restart.
+
+"""
+from collections import OrderedDict
+import numpy as np
+import fec
+
+
+class Session:
+    """
+
+    One transmission being received, with the NACK state that goes with it. Frames are written in place
+    into a data buffer (in data order, so the finished payload is the buffer itself) and a parity buffer,
+    both allocated when the first frame tells the chunk size. A bitmap and per group counters make the
+    completion check O(1) and the missing frame check one vectorized pass.
+
+    """
+
+    def __init__(self, session_id, mode, num_frames, fec_params, now):
+        if num_frames <= 0:
+            raise ValueError(f'Session needs at least one frame, not {num_frames}')
+
+        self.session_id = session_id
+        self.mode = mode
+        self.num_frames = num_frames
+        self.fec = fec_params
+        self.num_data = fec.num_data_frames(num_frames, *fec_params)
+        self.is_parity, self.rows, self.groups, self.group_data = fec.frame_slots(self.num_data, *fec_params)
+        self.data_frame_ids = np.flatnonzero(~self.is_parity)
+
+        self.chunk_size = None
+        self.data = None
+        self.parity = None
+        self.nbytes = 0
+        self.spool_name = None
+        self.mapping = None
+
+        self.received = np.zeros(num_frames, dtype=bool)
+        self.received_count = 0
+        self.group_received = np.zeros(len(self.group_data), dtype=np.int64)
+        self.groups_ready = 0
+
+        self.callsign = None
+        self.complete = False
+        self.callbacks = []
+
+        self.created = now
+        self.last_frame_time = now
+        self.end_seen = False
+        self.acked = False
+        self.nack_rounds = 0
+        self.last_nack_time = None
+
+    @property
+    def tx_id(self):
+        return self.session_id & 0xff
+
+    def allocate(self, chunk_size, spool=None):
+        if chunk_size <= 0:
+            raise ValueError(f'Session chunk size must be positive, not {chunk_size}')
+
+        self.chunk_size = chunk_size
+        self.nbytes = self.num_frames * chunk_size
+
+        if spool is not None:
+            # the bitmap moves into the file too, it is still all zeros here
+            self.spool_name, self.mapping, self.received, self.data, self.parity = spool.create(self)
+        else:
+            self.data = np.zeros((self.num_data, chunk_size), dtype=np.uint8)
+            self.parity = np.zeros((self.num_frames - self.num_data, chunk_size), dtype=np.uint8)
+
+    @classmethod
+    def restore(cls, spool, name, now):
+        # map a partial reception from the spool back in, and rebuild the counters from its bitmap
+        entry = spool.index[name]
+        session = cls(entry['session_id'], entry['mode'], entry['num_frames'], tuple(entry['fec']), now)
+        session.chunk_size = entry['chunk_size']
+        session.nbytes = session.num_frames * session.chunk_size
+        session.spool_name = name
+        session.mapping, session.received, session.data, session.parity = \
+            spool.map(name, session.num_frames, session.num_data, session.chunk_size, 'r+')
+
+        session.received_count = int(session.received.sum())
+        session.group_received = np.bincount(session.groups[session.received], minlength=len(session.group_data))
+        session.groups_ready = int((session.group_received >= session.group_data).sum())
+
+        return session
+
+    def add(self, frame_id, payload):
+        # returns False for duplicates and frames that don't fit this session
+        if frame_id >= self.num_frames or self.received[frame_id] or len(payload) != self.chunk_size:
+            return False
+
+        buffer = self.parity if self.is_parity[frame_id] else self.data
+        buffer[self.rows[frame_id]] = np.frombuffer(payload, dtype=np.uint8)
+
+        self.received[frame_id] = True
+        self.received_count += 1
+
+        group = self.groups[frame_id]
+        self.group_received[group] += 1
+
+        if self.group_received[group] == self.group_data[group]:
+            self.groups_ready += 1
+
+        return True
+
+    @property
+    def ready(self):
+        # every group has enough frames to be rebuilt
+        return self.groups_ready == len(self.group_data)
+
+    def get_missing_frames(self):
+        # with erasure coding only enough frames to rebuild each group are needed
+        if self.complete:
+            return []
+
+        return fec.needed_from_mask(self.received, self.groups, self.group_data).tolist()
+
+    def get_data_available(self):
+        # bool array of which data chunks are in, in data order
+        return self.received[self.data_frame_ids]
+
+    def decode(self):
+        # the whole payload as a flat view of the data buffer, missing data rows are rebuilt in place
+        if not fec.decode_into(self.data, self.parity, self.received, self.num_data, *self.fec):
+            return None
+
+        return memoryview(self.data.reshape(-1)).toreadonly()
+
+    def release(self):
+        # the data buffer lives on for as long as the decoded payload is referenced
+        self.data = None
+        self.parity = None
+        self.mapping = None
+        self.nbytes = 0
+
+
+class ReassemblyTable:
+    """
+
+    In-progress sessions, least recently heard first. on_complete(session, data) is called for every
+    session that completes, after the session's own callbacks; data is a read only view of the session's
+    buffer with the callsign stripped, nothing is copied.
+    Completed sessions stay in the table without their frames, so late duplicates are ignored and the
+    ACK state is kept, until they age out.
+
+    """
+
+    def __init__(self, split_callsign, max_sessions=8, max_bytes=16 * 1024 * 1024, max_age=600, on_complete=None,
+                 spool=None, now=0.0, max_frames=16384):
+        self.split_callsign = split_callsign
+        self.max_sessions = max_sessions
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.on_complete = on_complete
+        self.spool = spool
+
+        self.sessions = OrderedDict()
+        self.nbytes = 0
+        self.evicted = 0
+
+        if spool is not None:
+            self.restore(now)
+
+    def restore(self, now):
+        # pick up partial receptions left in the spool by an earlier run, newest last
+        for name, _ in self.spool.partials():
+            session = Session.restore(self.spool, name, now)
+
+            if session.received[0]:
+                session.callsign = self.split_callsign(session.data[0])[0]
+
+            # an older partial reception with the same session id is superseded
+            self.remove(session.session_id)
+            self.sessions[session.session_id] = session
+            self.nbytes += session.nbytes
+            print(f'Resuming reception {session.session_id:04x}: {session.received_count} of '
+                  f'{session.num_frames} frames')
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    def add_callback(self, session_id, callback):
+        # callback(session, data) once that session completes
+        session = self.sessions.get(session_id)
+
+        if session is not None:
+            session.callbacks.append(callback)
+
+    def remove(self, session_id):
+        session = self.sessions.pop(session_id, None)
+
+        if session is not None:
+            self.nbytes -= session.nbytes
+
+            # a dropped partial reception is gone for good, completed ones stay in the spool's archive
+            if self.spool is not None and session.spool_name is not None and not session.complete:
+                session.release()
+                self.spool.remove(session.spool_name)
+
+        return session
+
+    def add_frame(self, session_id, mode, frame_id, num_frames, fec_params, payload, now):
+        # returns the session the frame was filed in, or None if it was ignored
+        session = self.sessions.get(session_id)
+
+        if session is not None and (session.num_frames != num_frames or session.fec != fec_params or
+                                    (session.chunk_size is not None and session.chunk_size != len(payload))):
+            # the tx_id came around again, this is a new transmission
+            self.remove(session_id)
+            session = None
+
+        if session is None:
+            # whatever the header says, one session never gets more than the whole table's memory
+            if not 0 < num_frames <= self.max_frames or not 0 < num_frames * len(payload) <= self.max_bytes:
+                return None
+
+            if fec.num_data_frames(num_frames, *fec_params) is None:
+                return None
+
+            session = self.sessions[session_id] = Session(session_id, mode, num_frames, fec_params, now)
+
+        elif mode != session.mode:
+            # a transmission keeps its mode for all of its frames, so this one can't belong to it
+            return None
+
+        self.sessions.move_to_end(session_id)
+        session.last_frame_time = now
+
+        if frame_id == num_frames - 1:
+            session.end_seen = True
+
+        if session.complete:
+            return session
+
+        if session.data is None:
+            session.allocate(len(payload), self.spool)
+            self.nbytes += session.nbytes
+
+        if not session.add(frame_id, payload):
+            return session
+
+        # the first frame always carries data, and the data starts with the callsign
+        if frame_id == 0:
+            session.callsign = self.split_callsign(payload)[0]
+
+        if session.ready:
+            self.complete(session)
+
+        self.evict(now)
+        return session
+
+    def complete(self, session):
+        data = session.decode()
+
+        if data is None:
+            return
+
+        session.callsign, data = self.split_callsign(data)
+        session.complete = True
+        self.nbytes -= session.nbytes
+
+        if self.spool is not None and session.spool_name is not None:
+            self.spool.complete(session.spool_name, session.callsign, 1 + len(session.callsign), len(data),
+                                session.mapping)
+
+        session.release()
+
+        for callback in session.callbacks:
+            callback(session, data)
+
+        if self.on_complete is not None:
+            self.on_complete(session, data)
+
+    def evict(self, now):
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_frame_time > self.max_age:
+                self.remove(session_id)
+                self.evicted += 1
+
+        # least recently heard go first, but never the session that was just updated
+        while len(self.sessions) > 1 and (len(self.sessions) > self.max_sessions or self.nbytes > self.max_bytes):
+            session = self.remove(next(iter(self.sessions)))
+
+            if not session.complete:
+                print(f'Dropping partial reception {session.session_id:04x}')
+
+            self.evicted += 1
+
+    def active(self):
+        # sessions still waiting for frames, plus completed ones that haven't been acknowledged
+        return [session for session in self.sessions.values() if not session.complete or not session.acked]
@@ -0,0 +1,137 @@
+"""
+
+On-disk spool for receptions. Every session being received gets a memory-mapped file holding its frame
+bitmap, data buffer and parity buffer, so frames land on disk as they are written, and a small JSON
+index describes each file. After a restart the partial sessions are mapped back in and only the frames
+they still lack need to be requested. Completed payloads stay in the spool as an archive and are read
+back through memory maps instead of being held in RAM.
+
+"""
+import numpy as np
+import json
+import os
+import time
+
+
+class Spool:
+    index_name = 'index.json'
+
+    def __init__(self, directory='spool', max_completed_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_completed_bytes = max_completed_bytes
+
+        os.makedirs(directory, exist_ok=True)
+        self.index = self.read_index()
+
+    def get_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read_index(self):
+        try:
+            with open(self.get_path(self.index_name)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        # entries whose file is gone are dropped
+        return {name: entry for name, entry in index.items() if os.path.exists(self.get_path(name))}
+
+    def write_index(self):
+        # write then rename, so a crash never leaves half an index behind
+        path = self.get_path(self.index_name)
+
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.index, f, indent=1)
+
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def get_layout(num_frames, num_data, chunk_size):
+        # byte offsets of the data and parity regions (the bitmap comes first), and the file size
+        data_offset = num_frames
+        parity_offset = data_offset + num_data * chunk_size
+
+        return data_offset, parity_offset, parity_offset + (num_frames - num_data) * chunk_size
+
+    def map(self, name, num_frames, num_data, chunk_size, mode):
+        # returns the mapping, then the bitmap, data and parity views into it
+        data_offset, parity_offset, size = self.get_layout(num_frames, num_data, chunk_size)
+        mapping = np.memmap(self.get_path(name), dtype=np.uint8, mode=mode, shape=(size,))
+
+        return (mapping, mapping[:data_offset].view(bool), mapping[data_offset:parity_offset].reshape(-1, chunk_size),
+                mapping[parity_offset:].reshape(-1, chunk_size))
+
+    def create(self, session):
+        name = f'{session.session_id:04x}_{int(time.time() * 1000)}.rx'
+        self.index[name] = {
+            'session_id': session.session_id,
+            'mode': session.mode,
+            'num_frames': session.num_frames,
+            'fec': list(session.fec),
+            'chunk_size': session.chunk_size,
+            'created': time.time(),
+            'complete': False,
+        }
+
+        mapped = self.map(name, session.num_frames, session.num_data, session.chunk_size, 'w+')
+        self.write_index()
+
+        return (name,) + mapped
+
+    def partials(self):
+        # (name, entry) of every unfinished session, oldest first
+        return sorted(((name, entry) for name, entry in self.index.items() if not entry['complete']),
+                      key=lambda item: item[1]['created'])
+
+    def complete(self, name, callsign, payload_offset, payload_length, mapping):
+        mapping.flush()
+
+        entry = self.index[name]
+        entry['complete'] = True
+        entry['completed'] = time.time()
+        entry['callsign'] = callsign.decode(errors='replace')
+        entry['payload_offset'] = entry['num_frames'] + payload_offset
+        entry['payload_length'] = payload_length
+
+        self.trim()
+        self.write_index()
+
+    def remove(self, name):
+        if self.index.pop(name, None) is None:
+            return
+
+        try:
+            os.remove(self.get_path(name))
+        except OSError:
+            pass
+
+        self.write_index()
+
+    def completed(self):
+        # (name, entry) of every completed payload, oldest first
+        return sorted(((name, entry) for name, entry in self.index.items() if entry['complete']),
+                      key=lambda item: item[1]['completed'])
+
+    def get_payload(self, name):
+        # a read only, memory-mapped view of a completed payload
+        entry = self.index[name]
+        mapping = np.memmap(self.get_path(name), dtype=np.uint8, mode='r')
+
+        return memoryview(mapping[entry['payload_offset']:entry['payload_offset'] + entry['payload_length']])
+
+    def trim(self):
+        # the oldest completed payloads go first once the archive is over max_completed_bytes
+        completed = self.completed()
+        total = sum(os.path.getsize(self.get_path(name)) for name, _ in completed)
+
+        for name, _ in completed:
+            if total <= self.max_completed_bytes:
+                break
+
+            total -= os.path.getsize(self.get_path(name))
+            self.index.pop(name)
+
+            try:
+                os.remove(self.get_path(name))
+            except OSError:
+                pass
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+import fec
+
+
+def make_chunks(num_data, chunk_size=20, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (num_data, chunk_size), dtype=np.uint8)
+
+
+def get_frame_count(num_data, group_size, parity):
+    layout = fec.group_layout(num_data, group_size, parity)
+    return sum(data_count + parity_count for _, data_count, parity_count in layout)
+
+
+@pytest.mark.parametrize('group_size, parity', [(32, 3), (8, 2), (4, 4), (5, 0)])
+def test_num_data_frames_inverts_group_layout(group_size, parity):
+    frame_counts = set()
+
+    for num_data in range(1, 200):
+        num_frames = get_frame_count(num_data, group_size, parity)
+        frame_counts.add(num_frames)
+        assert fec.num_data_frames(num_frames, group_size, parity) == num_data
+
+    # frame counts no data count adds up to
+    for num_frames in set(range(1, max(frame_counts))) - frame_counts:
+        assert fec.num_data_frames(num_frames, group_size, parity) is None
+
+
+@pytest.mark.parametrize('num_data', [1, 7, 32, 33, 100])
+def test_round_trip_without_loss(num_data):
+    chunks = make_chunks(num_data)
+    frames = fec.encode(chunks, 32, 3)
+
+    assert len(frames) == get_frame_count(num_data, 32, 3)
+    assert fec.decode(dict(enumerate(frames)), len(frames), 32, 3) == chunks.tobytes()
+
+
+def test_round_trip_rebuilds_lost_frames():
+    chunks = make_chunks(70)
+    frames = fec.encode(chunks, 32, 3)
+
+    # lose as many frames of every group as it has parity frames, data frames included
+    lost = set()
+
+    for first_frame, data_count, parity_count in fec.group_layout(70, 32, 3):
+        lost.update(range(first_frame + 1, first_frame + 1 + parity_count))
+
+    received = {frame_id: bytes(frame) for frame_id, frame in enumerate(frames) if frame_id not in lost}
+
+    assert fec.needed_frames(set(received), len(frames), 32, 3) == []
+    assert fec.decode(received, len(frames), 32, 3) == chunks.tobytes()
+
+
+def test_decode_needs_enough_frames():
+    chunks = make_chunks(10)
+    frames = fec.encode(chunks, 32, 3)
+    received = {frame_id: bytes(frame) for frame_id, frame in enumerate(frames) if frame_id not in (0, 1, 2, 3)}
+
+    assert fec.decode(received, len(frames), 32, 3) is None
+
+    # 10 data frames get a single parity frame, which makes up for one of the 4 missing
+    assert fec.needed_frames(set(received), len(frames), 32, 3) == [0, 1, 2]
+
+
+def test_needed_from_mask_matches_needed_frames():
+    num_data = 90
+    num_frames = get_frame_count(num_data, 32, 3)
+    is_parity, rows, groups, group_data = fec.frame_slots(num_data, 32, 3)
+    received = np.random.default_rng(1).random(num_frames) > 0.3
+
+    expected = fec.needed_frames(set(np.flatnonzero(received).tolist()), num_frames, 32, 3)
+    assert fec.needed_from_mask(received, groups, group_data).tolist() == expected
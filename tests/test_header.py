@@ -0,0 +1,130 @@
+import pytest
+import freedv
+from modem import ArqModem, decode_varint, encode_varint
+
+BYTES_PER_FRAME = 100
+
+
+@pytest.mark.parametrize('value', [0, 1, 127, 128, 255, 300, 16383, 16384, 2 ** 32])
+def test_varint_round_trip(value):
+    data = b'\xaa' + encode_varint(value) + b'\xbb'
+    assert decode_varint(data, 1) == (value, len(data) - 1)
+
+
+def test_varint_length():
+    assert len(encode_varint(127)) == 1
+    assert len(encode_varint(128)) == 2
+    assert len(encode_varint(16383)) == 2
+    assert len(encode_varint(16384)) == 3
+
+
+@pytest.mark.parametrize('num_bytes, fec_params', [(10, (0, 0)), (5000, (0, 0)), (5000, (32, 3)), (40000, (32, 3))])
+def test_build_and_parse(num_bytes, fec_params):
+    data = bytes(range(256)) * (num_bytes // 256) + bytes(num_bytes % 256)
+    frames = ArqModem.build_frames(data, 'N0CALL', 7, BYTES_PER_FRAME, *fec_params, nonce=b'1234')
+    session_id = ArqModem.get_session_id('N0CALL', 7, b'1234')
+
+    assert all(len(frame) == BYTES_PER_FRAME for frame in frames)
+
+    chunks = []
+
+    for i, frame in enumerate(frames):
+        session, frame_id, num_frames, parsed_fec, payload = ArqModem.parse_frame(bytes(frame))
+
+        assert (session, frame_id, num_frames) == (session_id, i, len(frames))
+        assert parsed_fec == (fec_params if fec_params[1] else (0, 0))
+        chunks.append(payload)
+
+    assert len({len(chunk) for chunk in chunks}) == 1
+
+    # without parity frames the payloads are the data itself, callsign first
+    if not fec_params[1]:
+        callsign, rx_data = ArqModem.split_callsign(b''.join(chunks))
+        assert callsign == b'N0CALL'
+        assert rx_data[:num_bytes] == data
+
+
+def test_more_than_255_frames():
+    frames = ArqModem.build_frames(bytes(30000), 'N0CALL', 1, BYTES_PER_FRAME)
+
+    assert len(frames) > 255
+    assert ArqModem.parse_frame(bytes(frames[-1]))[1:3] == (len(frames) - 1, len(frames))
+
+
+def test_payload_budget_fits():
+    # with erasure coding a single frame has no room, the smallest transmission is a data and a parity frame
+    assert ArqModem.get_payload_budget(1, BYTES_PER_FRAME, 32, 3) == 0
+
+    for num_frames in (2, 10, 35, 100):
+        num_bytes = ArqModem.get_payload_budget(num_frames, BYTES_PER_FRAME, 32, 3)
+        assert num_bytes > 0
+        frames = ArqModem.build_frames(bytes(num_bytes), 'N0CALL', 1, BYTES_PER_FRAME, 32, 3)
+        assert len(frames) <= num_frames
+
+
+def test_too_many_frames():
+    with pytest.raises(freedv.DataTooLarge):
+        ArqModem.build_frames(bytes(ArqModem.max_frames * BYTES_PER_FRAME), 'N0CALL', 1, BYTES_PER_FRAME)
+
+
+def make_header(frame_id, num_frames, fec_params=(0, 0)):
+    header = bytes([ArqModem.get_version_byte(ArqModem.kind_data)]) + b'\x12\x34'
+    return header + encode_varint(frame_id) + encode_varint(num_frames) + bytes(fec_params)
+
+
+@pytest.mark.parametrize('frame_id, num_frames, fec_params', [
+    (5, 5, (0, 0)),
+    (0, 0, (0, 0)),
+    (0, ArqModem.max_frames + 1, (0, 0)),
+    (0, 10, (0, 3)),
+])
+def test_parse_rejects_bad_headers(frame_id, num_frames, fec_params):
+    frame = make_header(frame_id, num_frames, fec_params)
+    assert ArqModem.parse_frame(frame + bytes(BYTES_PER_FRAME - len(frame))) is None
+
+
+def test_parse_rejects_truncated_varints():
+    # every byte after the session id says another varint byte follows
+    frame = bytes([ArqModem.get_version_byte(ArqModem.kind_data)]) + b'\x12\x34' + b'\xff' * 5
+    assert ArqModem.parse_frame(frame) is None
+
+
+def test_parse_rejects_other_frames():
+    frame = bytearray(ArqModem.build_frames(b'data', 'N0CALL', 1, BYTES_PER_FRAME)[0])
+    frame[0] = ArqModem.get_version_byte(ArqModem.kind_control)
+    assert ArqModem.parse_frame(bytes(frame)) is None
+
+
+def make_nack_modem(callsign):
+    # build_nack and friends only need the callsign and the control frame size
+    arq_modem = ArqModem.__new__(ArqModem)
+    arq_modem.callsign = callsign
+    arq_modem.arq_bytes_per_frame = 14
+    return arq_modem
+
+
+def test_nack_round_trip():
+    arq_modem = make_nack_modem('N0CALL')
+    frames = arq_modem.build_nack(0x1234, [1, 2, 3, 10, 16000])
+
+    parsed = [arq_modem.parse_nack(frame) for frame in frames]
+
+    assert all(arq_modem.is_nack(frame) for frame in frames)
+    assert [(start, count) for _, _, start, count, _ in parsed] == [(1, 3), (10, 1), (16000, 1)]
+    assert [frames_left for *_, frames_left in parsed] == [2, 1, 0]
+    assert all(callsign == b'N0CALL'[:len(callsign)] and session == 0x1234 for callsign, session, *_ in parsed)
+
+
+def test_ack():
+    arq_modem = make_nack_modem('N0CALL')
+    frames = arq_modem.build_nack(0x1234, [])
+
+    assert len(frames) == 1
+    assert arq_modem.parse_nack(frames[0])[2:4] == (0, 0)
+
+
+@pytest.mark.parametrize('callsign', ['3Z9ABC', '0X1Y', 'N0CALL'])
+def test_test_frames_are_not_nacks(callsign):
+    arq_modem = make_nack_modem(callsign)
+    frame = callsign.encode() + b'TEST'
+    assert not arq_modem.is_nack(frame + bytes(14 - len(frame)))
@@ -0,0 +1,54 @@
+import os
+import threading
+import numpy as np
+import pytest
+import audio
+import freedv
+from modem import ArqModem
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the demodulators run against a virtual clock at twice realtime, slow enough for one core to keep up
+SPEED = 2
+
+pytestmark = pytest.mark.skipif(not os.path.exists(os.path.join(ROOT, 'lib', 'libcodec2.so')),
+                                reason='needs lib/libcodec2.so')
+
+
+@pytest.fixture
+def modems(monkeypatch):
+    # libcodec2 is loaded from a path relative to the repository
+    monkeypatch.chdir(ROOT)
+
+    link = audio.LoopbackLink(delay=0.05, speed=SPEED)
+    sender = ArqModem(None, None, 'TX', backend=link.a)
+    receiver = ArqModem(None, None, 'RX', backend=link.b)
+
+    yield link, sender, receiver
+
+    sender.halt_tx()
+    sender.close()
+    receiver.close()
+
+
+def test_arq_transfer(modems):
+    link, sender, receiver = modems
+    sender.adaptive_mode = False
+    sender.forward_mode = freedv.MODE_DATAC3
+
+    data = np.random.default_rng(0).integers(0, 256, 2000, dtype=np.uint8).tobytes()
+    tx_thread = threading.Thread(target=sender.arq_tx, args=(data,), daemon=True)
+    tx_thread.start()
+
+    rx_data = None
+
+    # the sender returns once it has the receiver's ACK
+    while tx_thread.is_alive() and link.time() < 120:
+        receiver.arq_rx(timeout=0.1)
+        rx_data = receiver.get_rx_data() or rx_data
+
+    tx_thread.join(sender.arq_wait_time)
+
+    assert rx_data is not None and bytes(rx_data[:len(data)]) == data
+    assert sender.arq_callsign == b'RX'
+    assert sender.metrics.counters.get('frames_retransmitted', 0) == 0
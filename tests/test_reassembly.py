@@ -0,0 +1,196 @@
+import numpy as np
+import pytest
+from modem import ArqModem
+from reassembly import ReassemblyTable, Session
+
+BYTES_PER_FRAME = 100
+MODE = 10
+
+
+def make_frames(data, callsign='N0CALL', tx_id=1, nonce=b'', fec_params=(32, 3)):
+    frames = ArqModem.build_frames(data, callsign, tx_id, BYTES_PER_FRAME, *fec_params, nonce=nonce)
+    return [ArqModem.parse_frame(bytes(frame)) for frame in frames]
+
+
+def make_data(num_bytes, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, num_bytes, dtype=np.uint8).tobytes()
+
+
+class Receiver:
+
+    def __init__(self, **kwargs):
+        self.completed = []
+        self.table = ReassemblyTable(ArqModem.split_callsign, on_complete=self.on_complete, **kwargs)
+
+    def on_complete(self, session, data):
+        self.completed.append((session.session_id, session.callsign, bytes(data)))
+
+    def add(self, frame, now=0.0, mode=MODE):
+        return self.table.add_frame(frame[0], mode, *frame[1:], now)
+
+
+def test_complete_transmission():
+    data = make_data(3000)
+    receiver = Receiver()
+
+    for frame in make_frames(data):
+        receiver.add(frame)
+
+    [(session_id, callsign, rx_data)] = receiver.completed
+    assert callsign == b'N0CALL'
+    assert rx_data[:len(data)] == data
+
+
+def test_lost_frames_are_rebuilt():
+    data = make_data(3000)
+    frames = make_frames(data)
+    receiver = Receiver()
+
+    # 3000 bytes are one group, its 3 parity frames make up for 3 lost data frames
+    for frame in frames[:2] + frames[5:]:
+        receiver.add(frame)
+
+    assert receiver.completed[0][2][:len(data)] == data
+
+
+def test_missing_frames():
+    frames = make_frames(make_data(3000))
+    receiver = Receiver()
+
+    for frame in frames[:2] + frames[7:]:
+        session = receiver.add(frame)
+
+    # 5 frames lost, the 3 parity frames cover all but 2 of them
+    assert session.get_missing_frames() == [2, 3]
+    assert not receiver.completed
+
+
+def test_interleaved_senders():
+    first_data, second_data = make_data(3000, 1), make_data(2000, 2)
+    first, second = make_frames(first_data, 'AA1AA'), make_frames(second_data, 'BB2BB')
+    receiver = Receiver()
+
+    for i in range(max(len(first), len(second))):
+        for frames in (first, second):
+            if i < len(frames):
+                receiver.add(frames[i])
+
+    received = {callsign: rx_data for _, callsign, rx_data in receiver.completed}
+    assert received[b'AA1AA'][:len(first_data)] == first_data
+    assert received[b'BB2BB'][:len(second_data)] == second_data
+
+
+def test_completed_sessions_ignore_late_frames():
+    frames = make_frames(make_data(3000))
+    receiver = Receiver()
+
+    for frame in frames:
+        receiver.add(frame)
+
+    # the tombstone takes the duplicates, nothing completes twice
+    session = receiver.add(frames[0], now=1.0)
+
+    assert session.complete
+    assert len(receiver.completed) == 1
+    assert receiver.table.nbytes == 0
+
+
+def test_tombstones_age_out():
+    frames = make_frames(make_data(3000))
+    receiver = Receiver(max_age=10)
+
+    for frame in frames:
+        receiver.add(frame)
+
+    receiver.table.evict(now=20.0)
+    assert len(receiver.table) == 0
+
+
+def test_restarted_sender_gets_new_sessions():
+    # the same callsign and tx_id after a restart, which picked a new nonce
+    first_data, second_data = make_data(3000, 1), make_data(3000, 2)
+    receiver = Receiver()
+
+    for frame in make_frames(first_data, nonce=b'\x00\x00\x00\x01'):
+        receiver.add(frame)
+
+    for frame in make_frames(second_data, nonce=b'\x00\x00\x00\x02'):
+        receiver.add(frame)
+
+    assert [rx_data[:3000] for _, _, rx_data in receiver.completed] == [first_data, second_data]
+
+
+def test_new_transmission_with_reused_tx_id():
+    receiver = Receiver()
+
+    for frame in make_frames(make_data(3000))[:4]:
+        receiver.add(frame)
+
+    # a different length under the same session id replaces the partial reception
+    second_data = make_data(5000, 3)
+
+    for frame in make_frames(second_data):
+        receiver.add(frame)
+
+    assert len(receiver.completed) == 1
+    assert receiver.completed[0][2][:5000] == second_data
+
+
+def test_frames_of_another_mode_are_ignored():
+    frames = make_frames(make_data(3000))
+    receiver = Receiver()
+    receiver.add(frames[0])
+
+    assert receiver.add(frames[1], mode=MODE + 1) is None
+    assert receiver.table.get(frames[0][0]).received_count == 1
+
+
+def test_least_recently_heard_are_evicted():
+    receiver = Receiver(max_sessions=2)
+
+    for tx_id in range(3):
+        receiver.add(make_frames(make_data(3000), tx_id=tx_id)[0])
+
+    assert len(receiver.table) == 2
+    assert receiver.table.evicted == 1
+    assert receiver.table.get(ArqModem.get_session_id('N0CALL', 0)) is None
+
+
+def test_sessions_too_big_for_the_table_are_refused():
+    frame = make_frames(make_data(3000))[0]
+    session_id, frame_id, num_frames, fec_params, payload = frame
+    receiver = Receiver(max_bytes=2000)
+
+    assert receiver.add(frame) is None
+    assert len(receiver.table) == 0
+
+    receiver = Receiver(max_frames=num_frames - 1)
+    assert receiver.add(frame) is None
+
+
+def test_empty_sessions_are_refused():
+    receiver = Receiver()
+
+    assert receiver.table.add_frame(0x1234, MODE, 0, 0, (0, 0), bytes(10), 0.0) is None
+    assert receiver.table.add_frame(0x1234, MODE, 0, 5, (0, 0), b'', 0.0) is None
+
+    with pytest.raises(ValueError):
+        Session(0x1234, MODE, 0, (0, 0), 0.0)
+
+    with pytest.raises(ValueError):
+        Session(0x1234, MODE, 5, (0, 0), 0.0).allocate(0)
+
+
+def test_buffer_is_preallocated():
+    frames = make_frames(make_data(3000))
+    receiver = Receiver()
+    session = receiver.add(frames[3])
+
+    assert session.data.shape == (session.num_data, len(frames[3][4]))
+    assert receiver.table.nbytes == session.nbytes == session.num_frames * len(frames[3][4])
+    assert session.get_data_available().tolist() == [i == 3 for i in range(session.num_data)]
+
+    # frames that don't fit the session are dropped, not written
+    assert not session.add(3, frames[3][4])
+    assert not session.add(4, frames[4][4][:-1])
+    assert session.received_count == 1